@@ -40,6 +40,7 @@ export class HelpComponent {
     { syntax: 'type:image,gif,video', description: 'Filter by media type', example: 'type:video' },
     { syntax: '-type:image,gif,video', description: 'Exclude media type', example: '-type:video' },
     { syntax: 'tag-count:[op]N', description: 'Filter by number of tags, operators: =, >, >=, <, <=', example: 'tag-count:>=5' },
+    { syntax: 'id:[op]N', description: 'Filter by post id, operators: =, >, >=, <, <=', example: 'id:>1000' },
     { syntax: 'favorite:true|false', description: 'Filter favorite posts', example: 'favorite:true' },
     { syntax: 'filename:TEXT', description: 'Match text in relative file path', example: 'filename:abc.jpg' },
     { syntax: 'filename:*pattern*', description: 'Filename wildcard search (* and ?)', example: 'filename:*wallpaper*' },
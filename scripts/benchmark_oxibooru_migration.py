@@ -0,0 +1,915 @@
+#!/usr/bin/env python3
+"""
+Benchmark `migrate_oxibooru_tags.py` end to end against local stand-in
+Bakabooru and Oxibooru servers.
+
+The stand-ins implement the endpoints the migrator uses (`/auth/login`,
+`/posts`, `/posts/{id}`, `/posts/{id}/content`, `/posts/{id}/tags`,
+`/posts/{id}/sources`, `/tags`, `/tagcategories`, thumbnails, and Oxibooru's
+`/tag-categories`, `/posts/` and `/posts/reverse-search`) over a synthetic
+corpus generated on the fly from post ids, so 1M posts cost no more memory
+than 10k. Every request can be delayed and a fraction answered with 503.
+
+The servers run in a child process and the migrator is started as a separate
+process with the given arguments, exactly as a user would run it. Reported:
+- posts/sec (from the migrator's `--metrics-json`),
+- requests per post, per endpoint (counted by the stand-ins),
+- peak RSS of the migrator process.
+
+The corpus, match outcomes and tags are derived from `--seed` alone, so runs
+with the same parameters are comparable across commits. `--output` appends
+each result as a JSON line (with the commit it ran against) and prints the
+change from the last result with identical parameters; `--migrator` points at
+another checkout's script to compare against it.
+
+Post content is synthetic bytes, not real images: JXL decoding and
+`--upload-mode downscale` fall back to their non-image paths, while
+`--upload-mode thumbnail` and `--oxibooru-index` are fully exercised.
+
+Usage:
+  python scripts/benchmark_oxibooru_migration.py --posts 10000
+  python scripts/benchmark_oxibooru_migration.py --posts 100000 --latency-ms 2 \\
+      --search-latency-ms 40 --error-rate 0.01 --output bench.jsonl -- --async --workers 32
+
+Requirements:
+- Python 3.10+ on Linux or macOS (peak memory is read with `os.wait4`)
+- whatever the migrator itself needs for the chosen arguments
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import Request, urlopen
+
+DEFAULT_MIGRATOR = Path(__file__).with_name("migrate_oxibooru_tags.py")
+OXIBOORU_CATEGORIES = (
+    ("general", "#0073ff", 1),
+    ("artist", "#cc0000", 2),
+    ("character", "#00aa00", 3),
+    ("copyright", "#a300aa", 4),
+    ("meta", "#ff8a00", 5),
+)
+CONTENT_KEY_PATTERN = re.compile(rb"(bench|thumb):(\d+):")
+
+
+@dataclass(frozen=True)
+class CorpusConfig:
+    posts: int = 10_000
+    seed: int = 1
+    content_bytes: int = 64 * 1024
+    duplicate_ratio: float = 0.05
+    video_every: int = 20
+    exact_ratio: float = 0.6
+    similar_ratio: float = 0.2
+    tags_per_post: int = 8
+    tag_vocabulary: int = 5_000
+    existing_tags: int = 0
+
+
+class SyntheticCorpus:
+    """
+    Deterministic library derived from `CorpusConfig`: post N has content
+    key `content_key(N)` (posts sharing a key are byte-identical duplicates),
+    and whether Oxibooru knows a key, exactly or only similarly, is decided
+    by hashing it with the seed.
+    """
+
+    def __init__(self, config: CorpusConfig) -> None:
+        self.config = config
+        self.distinct = max(1, round(config.posts * (1 - config.duplicate_ratio)))
+
+    def _unit(self, key: int, salt: str) -> float:
+        digest = hashlib.blake2b(f"{self.config.seed}:{salt}:{key}".encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big") / 2**64
+
+    def content_key(self, post_id: int) -> int:
+        return (post_id - 1) % self.distinct + 1
+
+    def content(self, key: int, kind: str = "bench", size: int | None = None) -> bytes:
+        size = self.config.content_bytes if size is None else size
+        prefix = f"{kind}:{key}:".encode()
+        block = hashlib.blake2b(prefix + str(self.config.seed).encode()).digest()
+        filler = block * (max(0, size - len(prefix)) // len(block) + 1)
+        return (prefix + filler)[: max(size, len(prefix))]
+
+    def thumbnail(self, key: int) -> bytes:
+        return self.content(key, kind="thumb", size=max(256, self.config.content_bytes // 16))
+
+    def content_hash(self, key: int) -> str:
+        return f"{key:016x}"
+
+    def is_video(self, post_id: int) -> bool:
+        return self.config.video_every > 0 and post_id % self.config.video_every == 0
+
+    def content_type(self, post_id: int) -> str:
+        if self.is_video(post_id):
+            return "video/mp4"
+        return "image/gif" if post_id % 9 == 0 else ("image/png" if post_id % 2 else "image/jpeg")
+
+    def post(self, post_id: int) -> dict[str, Any]:
+        key = self.content_key(post_id)
+        return {
+            "id": post_id,
+            "libraryId": 1,
+            "relativePath": f"bench/{post_id}",
+            "contentHash": self.content_hash(key),
+            "sizeBytes": self.config.content_bytes,
+            "width": 1000,
+            "height": 1000,
+            "contentType": self.content_type(post_id),
+            "importDate": "2026-01-01T00:00:00Z",
+            "fileModifiedDate": "2026-01-01T00:00:00Z",
+            "isFavorite": False,
+            "thumbnailLibraryId": 1,
+            "thumbnailContentHash": self.content_hash(key),
+            "tags": [],
+            "sources": [],
+        }
+
+    def listed_after(self, after_id: int, images_only: bool) -> int:
+        """How many posts a listing with `id:>after_id` matches."""
+        remaining = max(0, self.config.posts - after_id)
+        if images_only and self.config.video_every > 0:
+            every = self.config.video_every
+            remaining -= self.config.posts // every - min(after_id, self.config.posts) // every
+        return remaining
+
+    def listing(
+        self,
+        after_id: int,
+        offset: int,
+        limit: int,
+        images_only: bool,
+        descending: bool = False,
+    ) -> list[dict[str, Any]]:
+        items: list[dict[str, Any]] = []
+        ids = range(self.config.posts, after_id, -1) if descending else range(after_id + 1, self.config.posts + 1)
+        skipped = 0
+        for post_id in ids:
+            if len(items) >= limit:
+                break
+            if images_only and self.is_video(post_id):
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            items.append(self.post(post_id))
+        return items
+
+    def match_kind(self, key: int) -> str:
+        roll = self._unit(key, "match")
+        if roll < self.config.exact_ratio:
+            return "exact"
+        if roll < self.config.exact_ratio + self.config.similar_ratio:
+            return "similar"
+        return "none"
+
+    def oxibooru_post(self, key: int) -> dict[str, Any] | None:
+        kind = self.match_kind(key)
+        if kind == "none":
+            return None
+        content = self.content(key)
+        checksum = hashlib.sha1(content if kind == "exact" else b"similar:" + content).hexdigest()
+        tags = []
+        for slot in range(self.config.tags_per_post):
+            index = int(self._unit(key, f"tag{slot}") * self.config.tag_vocabulary)
+            category = OXIBOORU_CATEGORIES[index % len(OXIBOORU_CATEGORIES)][0]
+            tags.append({"names": [f"tag_{index}"], "category": category})
+        return {
+            "id": key,
+            "checksum": checksum,
+            "tags": tags,
+            "source": f"https://oxibooru.invalid/post/{key}",
+        }
+
+    def reverse_search(self, upload: bytes) -> dict[str, Any]:
+        found = CONTENT_KEY_PATTERN.search(upload[:64])
+        if found is None:
+            return {"exactPost": None, "similarPosts": []}
+        kind, key = found.group(1), int(found.group(2))
+        post = self.oxibooru_post(key) if 0 < key <= self.distinct else None
+        if post is None:
+            return {"exactPost": None, "similarPosts": []}
+        if self.match_kind(key) == "exact" and kind == b"bench":
+            return {"exactPost": post, "similarPosts": []}
+        distance = 0.01 + self._unit(key, "distance") * 0.09
+        return {"exactPost": None, "similarPosts": [{"distance": distance, "post": post}]}
+
+    def oxibooru_listing(self, min_id: int, offset: int, limit: int) -> list[dict[str, Any]]:
+        results: list[dict[str, Any]] = []
+        skipped = 0
+        for key in range(max(1, min_id), self.distinct + 1):
+            post = self.oxibooru_post(key)
+            if post is None:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            results.append(post)
+            if len(results) >= limit:
+                break
+        return results
+
+
+class BenchmarkState:
+    """Bakabooru write-side state and per-endpoint request counts, shared by both stand-ins."""
+
+    def __init__(self, existing_tags: int = 0) -> None:
+        self.lock = threading.Lock()
+        self.existing_tags = existing_tags
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests: Counter[str] = Counter()
+            self.injected_errors = 0
+            # Uncategorized tags Bakabooru already has, so startup has a catalogue to load.
+            self.tags: dict[str, dict[str, Any]] = {
+                f"existing_{n}": {"id": n, "name": f"existing_{n}", "categoryId": None}
+                for n in range(1, self.existing_tags + 1)
+            }
+            self.categories: dict[str, dict[str, Any]] = {}
+            self.post_tags: dict[int, list[dict[str, Any]]] = {}
+            self.post_sources: dict[int, list[str]] = {}
+
+    def snapshot(self) -> dict[str, Any]:
+        with self.lock:
+            return {"requests": dict(self.requests), "injected_errors": self.injected_errors}
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(
+        self,
+        handler: type[BaseHTTPRequestHandler],
+        corpus: SyntheticCorpus,
+        state: BenchmarkState,
+        latency: float,
+        error_rate: float,
+        search_latency: float,
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), handler)
+        self.corpus = corpus
+        self.state = state
+        self.latency = latency
+        self.error_rate = error_rate
+        self.search_latency = search_latency
+        self.random = random.Random(corpus.config.seed)
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # Clients dropping idle keep-alive connections are routine here.
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs
+    # stall every keep-alive response by ~40 ms and dominate the results.
+    disable_nagle_algorithm = True
+    server: StandInServer
+    REMOTE = ""
+    ROUTES: tuple[tuple[str, re.Pattern[str], str, str], ...] = ()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        return None
+
+    def do_GET(self) -> None:
+        self._dispatch("GET")
+
+    def do_POST(self) -> None:
+        self._dispatch("POST")
+
+    def do_PUT(self) -> None:
+        self._dispatch("PUT")
+
+    def _dispatch(self, method: str) -> None:
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if url.path.startswith("/_bench/"):
+            self._control(method, url.path)
+            return
+
+        for route_method, pattern, handler_name, label in self.ROUTES:
+            found = pattern.fullmatch(url.path)
+            if route_method != method or found is None:
+                continue
+            state = self.server.state
+            with state.lock:
+                state.requests[f"{self.REMOTE} {method} {label}"] += 1
+            delay = self.server.search_latency if handler_name == "reverse_search" else self.server.latency
+            if delay:
+                time.sleep(delay)
+            if self.server.error_rate and self.server.random.random() < self.server.error_rate:
+                with state.lock:
+                    state.injected_errors += 1
+                self._send_json(503, {"title": "Injected failure"})
+                return
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            getattr(self, handler_name)(body, params, *found.groups())
+            return
+        self._send_json(404, {"title": f"No stand-in route for {method} {url.path}"})
+
+    def _control(self, method: str, path: str) -> None:
+        if method == "GET" and path == "/_bench/stats":
+            self._send_json(200, self.server.state.snapshot())
+        elif method == "POST" and path == "/_bench/reset":
+            self.server.state.reset()
+            self._send(204)
+        else:
+            self._send_json(404, {"title": "Unknown control endpoint"})
+
+    def _send(self, status: int, data: bytes = b"", content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def _send_json(self, status: int, payload: Any) -> None:
+        self._send(status, json.dumps(payload).encode("utf-8"))
+
+
+def route(
+    method: str,
+    pattern: str,
+    handler_name: str,
+    label: str | None = None,
+) -> tuple[str, re.Pattern[str], str, str]:
+    """A stand-in route; `label` names it in request counts (defaults to the pattern with ids as `{id}`)."""
+    label = label or pattern.replace(r"(\d+)", "{id}")
+    return method, re.compile(pattern), handler_name, label
+
+
+class BakabooruStandIn(StandInHandler):
+    REMOTE = "bakabooru"
+    ROUTES = (
+        route("POST", r"/api/auth/login", "login"),
+        route("GET", r"/api/posts", "list_posts"),
+        route("GET", r"/api/posts/(\d+)", "get_post"),
+        route("PUT", r"/api/posts/(\d+)", "update_post"),
+        route("GET", r"/api/posts/(\d+)/content", "get_content"),
+        route("POST", r"/api/posts/(\d+)/tags", "add_post_tag"),
+        route("GET", r"/api/posts/(\d+)/sources", "get_sources"),
+        route("PUT", r"/api/posts/(\d+)/sources", "set_sources"),
+        route("GET", r"/api/tags", "list_tags"),
+        route("POST", r"/api/tags", "create_tag"),
+        route("PUT", r"/api/tags/(\d+)", "update_tag"),
+        route("GET", r"/api/tagcategories", "list_categories"),
+        route("POST", r"/api/tagcategories", "create_category"),
+        route("GET", r"/thumbnails/(\d+)/([0-9a-f]+)\.webp", "get_thumbnail", "/thumbnails/{library}/{hash}.webp"),
+    )
+
+    def _post_id(self, raw: str) -> int | None:
+        post_id = int(raw)
+        if not 1 <= post_id <= self.server.corpus.config.posts:
+            self._send_json(404, {"title": "Post not found"})
+            return None
+        return post_id
+
+    def login(self, body: bytes, params: dict[str, str]) -> None:
+        self.send_response(200)
+        self.send_header("Set-Cookie", "bench_session=1; Path=/; HttpOnly")
+        self.send_header("Content-Type", "application/json")
+        payload = json.dumps({"username": json.loads(body or b"{}").get("username")}).encode()
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def list_posts(self, body: bytes, params: dict[str, str]) -> None:
+        query = params.get("tags", "")
+        after = re.search(r"\bid:>(\d+)", query)
+        after_id = int(after.group(1)) if after else 0
+        images_only = "type:image" in query
+        page = max(1, int(params.get("page", 1)))
+        page_size = max(1, int(params.get("pageSize", 20)))
+        corpus = self.server.corpus
+        items = corpus.listing(after_id, (page - 1) * page_size, page_size, images_only, "sort:id_desc" in query)
+        self._send_json(
+            200,
+            {
+                "items": items,
+                "totalCount": corpus.listed_after(after_id, images_only),
+                "page": page,
+                "pageSize": page_size,
+            },
+        )
+
+    def get_post(self, body: bytes, params: dict[str, str], raw_id: str) -> None:
+        post_id = self._post_id(raw_id)
+        if post_id is None:
+            return
+        post = self.server.corpus.post(post_id)
+        with self.server.state.lock:
+            post["tags"] = list(self.server.state.post_tags.get(post_id, []))
+            post["sources"] = list(self.server.state.post_sources.get(post_id, []))
+        self._send_json(200, post)
+
+    def update_post(self, body: bytes, params: dict[str, str], raw_id: str) -> None:
+        post_id = self._post_id(raw_id)
+        if post_id is None:
+            return
+        update = json.loads(body or b"{}")
+        state = self.server.state
+        with state.lock:
+            if update.get("tagsWithSources") is not None:
+                missing = [t["name"] for t in update["tagsWithSources"] if t["name"] not in state.tags]
+                if missing:
+                    self._send_json(400, {"title": f"Unknown tags: {', '.join(missing)}"})
+                    return
+                state.post_tags[post_id] = [
+                    {"id": state.tags[t["name"]]["id"], "name": t["name"], "source": int(t.get("source") or 0)}
+                    for t in update["tagsWithSources"]
+                ]
+            if update.get("sources") is not None:
+                state.post_sources[post_id] = [str(s) for s in update["sources"]]
+        self._send(204)
+
+    def get_content(self, body: bytes, params: dict[str, str], raw_id: str) -> None:
+        post_id = self._post_id(raw_id)
+        if post_id is None:
+            return
+        corpus = self.server.corpus
+        self._send(200, corpus.content(corpus.content_key(post_id)), corpus.content_type(post_id))
+
+    def get_thumbnail(self, body: bytes, params: dict[str, str], library_id: str, content_hash: str) -> None:
+        key = int(content_hash, 16)
+        if not 1 <= key <= self.server.corpus.distinct:
+            self._send_json(404, {"title": "Thumbnail not found"})
+            return
+        self._send(200, self.server.corpus.thumbnail(key), "image/webp")
+
+    def add_post_tag(self, body: bytes, params: dict[str, str], raw_id: str) -> None:
+        post_id = self._post_id(raw_id)
+        if post_id is None:
+            return
+        name = str(json.loads(body or b'""'))
+        state = self.server.state
+        with state.lock:
+            tag = state.tags.get(name)
+            if tag is None:
+                self._send_json(400, {"title": f"Unknown tag: {name}"})
+                return
+            links = state.post_tags.setdefault(post_id, [])
+            if any(link["name"] == name for link in links):
+                self._send_json(409, {"title": "Tag already assigned"})
+                return
+            links.append({"id": tag["id"], "name": name, "source": 0})
+        self._send(200)
+
+    def get_sources(self, body: bytes, params: dict[str, str], raw_id: str) -> None:
+        post_id = self._post_id(raw_id)
+        if post_id is None:
+            return
+        with self.server.state.lock:
+            sources = list(self.server.state.post_sources.get(post_id, []))
+        self._send_json(200, sources)
+
+    def set_sources(self, body: bytes, params: dict[str, str], raw_id: str) -> None:
+        post_id = self._post_id(raw_id)
+        if post_id is None:
+            return
+        with self.server.state.lock:
+            self.server.state.post_sources[post_id] = [str(s) for s in json.loads(body or b"[]")]
+        self._send(204)
+
+    def list_tags(self, body: bytes, params: dict[str, str]) -> None:
+        page = max(1, int(params.get("page", 1)))
+        page_size = max(1, int(params.get("pageSize", 100)))
+        query = params.get("query", "").strip()
+        with self.server.state.lock:
+            tags = sorted(self.server.state.tags.values(), key=lambda tag: tag["id"])
+        if query:
+            tags = [tag for tag in tags if query in tag["name"]]
+        self._send_json(
+            200,
+            {
+                "items": tags[(page - 1) * page_size : page * page_size],
+                "totalCount": len(tags),
+                "page": page,
+                "pageSize": page_size,
+            },
+        )
+
+    def create_tag(self, body: bytes, params: dict[str, str]) -> None:
+        request = json.loads(body or b"{}")
+        state = self.server.state
+        with state.lock:
+            if request["name"] in state.tags:
+                self._send_json(409, {"title": "Tag already exists."})
+                return
+            tag = {"id": len(state.tags) + 1, "name": request["name"], "categoryId": request.get("categoryId")}
+            state.tags[tag["name"]] = tag
+        self._send_json(200, tag)
+
+    def update_tag(self, body: bytes, params: dict[str, str], raw_id: str) -> None:
+        request = json.loads(body or b"{}")
+        with self.server.state.lock:
+            tag = next((t for t in self.server.state.tags.values() if t["id"] == int(raw_id)), None)
+            if tag is not None:
+                tag["categoryId"] = request.get("categoryId")
+        if tag is None:
+            self._send_json(404, {"title": "Tag not found"})
+            return
+        self._send_json(200, tag)
+
+    def list_categories(self, body: bytes, params: dict[str, str]) -> None:
+        with self.server.state.lock:
+            counts = Counter(tag["categoryId"] for tag in self.server.state.tags.values())
+            categories = [
+                {**category, "tagCount": counts[category["id"]]}
+                for category in sorted(self.server.state.categories.values(), key=lambda category: category["id"])
+            ]
+        self._send_json(200, categories)
+
+    def create_category(self, body: bytes, params: dict[str, str]) -> None:
+        request = json.loads(body or b"{}")
+        state = self.server.state
+        with state.lock:
+            if request["name"] in state.categories:
+                self._send_json(409, {"title": "Category already exists."})
+                return
+            category = {
+                "id": len(state.categories) + 1,
+                "name": request["name"],
+                "color": request.get("color") or "#808080",
+                "order": int(request.get("order") or 0),
+                "tagCount": 0,
+            }
+            state.categories[category["name"]] = category
+        self._send_json(200, category)
+
+
+class OxibooruStandIn(StandInHandler):
+    REMOTE = "oxibooru"
+    ROUTES = (
+        route("GET", r"/api/tag-categories", "list_categories"),
+        route("GET", r"/api/posts/", "list_posts"),
+        route("POST", r"/api/posts/reverse-search", "reverse_search"),
+    )
+
+    def list_categories(self, body: bytes, params: dict[str, str]) -> None:
+        results = [{"name": name, "color": color, "order": order} for name, color, order in OXIBOORU_CATEGORIES]
+        self._send_json(200, {"results": results})
+
+    def list_posts(self, body: bytes, params: dict[str, str]) -> None:
+        query = params.get("query", "")
+        lower = re.search(r"\bid:(\d+)\.\.", query)
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        results = self.server.corpus.oxibooru_listing(int(lower.group(1)) if lower else 1, offset, limit)
+        self._send_json(200, {"query": query, "offset": offset, "limit": limit, "results": results})
+
+    def reverse_search(self, body: bytes, params: dict[str, str]) -> None:
+        # The single multipart part starts after the first blank line.
+        start = body.find(b"\r\n\r\n")
+        self._send_json(200, self.server.corpus.reverse_search(body[start + 4 :] if start >= 0 else body))
+
+
+def serve(config: CorpusConfig, latency: float, search_latency: float, error_rate: float) -> int:
+    """Run both stand-ins until stdin closes; announces their URLs as one JSON line."""
+    corpus = SyntheticCorpus(config)
+    state = BenchmarkState(config.existing_tags)
+    servers = [
+        StandInServer(handler, corpus, state, latency, error_rate, search_latency)
+        for handler in (BakabooruStandIn, OxibooruStandIn)
+    ]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(json.dumps({"bakabooru": servers[0].url, "oxibooru": servers[1].url}), flush=True)
+    try:
+        sys.stdin.read()
+    except KeyboardInterrupt:
+        pass
+    for server in servers:
+        server.shutdown()
+    return 0
+
+
+def control(base_url: str, path: str, method: str = "GET") -> Any:
+    request = Request(f"{base_url}/_bench/{path}", method=method, data=b"" if method == "POST" else None)
+    with urlopen(request, timeout=30) as response:
+        body = response.read()
+    return json.loads(body) if body else None
+
+
+def git_revision(path: Path) -> dict[str, Any]:
+    def git(*args: str) -> str:
+        completed = subprocess.run(
+            ["git", *args], cwd=path, capture_output=True, text=True, check=False
+        )
+        return completed.stdout.strip() if completed.returncode == 0 else ""
+
+    return {"commit": git("rev-parse", "--short", "HEAD") or None, "dirty": bool(git("status", "--porcelain"))}
+
+
+def run_migrator(
+    migrator: Path,
+    servers: dict[str, str],
+    migrator_args: list[str],
+    log: Any,
+) -> tuple[int, float, int, dict[str, Any] | None]:
+    """Returns (exit code, wall seconds, peak RSS bytes, metrics report)."""
+    with tempfile.TemporaryDirectory(prefix="bakabooru-bench-") as workdir:
+        report_path = Path(workdir) / "metrics.json"
+        command = [
+            sys.executable,
+            str(migrator),
+            "--bakabooru-api",
+            f"{servers['bakabooru']}/api",
+            "--oxibooru-api",
+            f"{servers['oxibooru']}/api",
+            "--progress-interval",
+            "0",
+            "--metrics-json",
+            str(report_path),
+            *migrator_args,
+        ]
+        started = time.monotonic()
+        process = subprocess.Popen(command, stdout=log, stderr=log, cwd=workdir)
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        except BaseException:
+            process.terminate()
+            process.wait()
+            raise
+        elapsed = time.monotonic() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is KiB on Linux and bytes on macOS.
+        peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+        report = json.loads(report_path.read_text(encoding="utf-8")) if report_path.exists() else None
+    return process.returncode, elapsed, peak_rss, report
+
+
+def summarize(
+    exit_code: int,
+    elapsed: float,
+    peak_rss: int,
+    report: dict[str, Any] | None,
+    stats: dict[str, Any],
+) -> dict[str, Any]:
+    counters = (report or {}).get("counters", {})
+    posts = int(counters.get("scanned", 0))
+    requests_made = stats["requests"]
+    per_post = {name: round(count / posts, 3) for name, count in sorted(requests_made.items())} if posts else {}
+    return {
+        "exit_code": exit_code,
+        "posts": posts,
+        "wall_seconds": round(elapsed, 3),
+        "posts_per_second": (report or {}).get("posts_per_second"),
+        "requests_per_post": round(sum(requests_made.values()) / posts, 3) if posts else None,
+        "requests_per_post_by_endpoint": per_post,
+        "injected_errors": stats["injected_errors"],
+        "peak_rss_mib": round(peak_rss / (1024 * 1024), 1),
+        "matched": counters.get("matched", 0),
+        "failed": counters.get("failed", 0),
+    }
+
+
+def previous_result(output: Path, params: dict[str, Any]) -> dict[str, Any] | None:
+    if not output.exists():
+        return None
+    previous = None
+    for line in output.read_text(encoding="utf-8").splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if record.get("params") == params:
+            previous = record
+    return previous
+
+
+def change(current: float | None, before: float | None) -> str:
+    if not current or not before:
+        return ""
+    return f" ({(current - before) / before:+.1%} vs {before:g})"
+
+
+def print_result(record: dict[str, Any], before: dict[str, Any] | None) -> None:
+    result = record["result"]
+    old = (before or {}).get("result", {})
+    print(f"\n=== Benchmark run {record['run']} ({record['commit'] or 'unknown commit'}) ===")
+    print(f"Exit code:         {result['exit_code']}")
+    print(f"Posts scanned:     {result['posts']} in {result['wall_seconds']}s")
+    print(f"Posts/sec:         {result['posts_per_second']}{change(result['posts_per_second'], old.get('posts_per_second'))}")
+    print(
+        f"Requests/post:     {result['requests_per_post']}"
+        f"{change(result['requests_per_post'], old.get('requests_per_post'))}"
+    )
+    for endpoint, per_post in result["requests_per_post_by_endpoint"].items():
+        print(f"  {endpoint:<40}{per_post}")
+    print(f"Peak RSS:          {result['peak_rss_mib']} MiB{change(result['peak_rss_mib'], old.get('peak_rss_mib'))}")
+    print(f"Matched / failed:  {result['matched']} / {result['failed']}")
+    print(f"Injected errors:   {result['injected_errors']}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Oxibooru tag migration against local stand-in servers.",
+        epilog="Arguments after `--` are passed to the migrator, e.g. `-- --async --workers 32`.",
+    )
+    parser.add_argument("--posts", type=int, default=CorpusConfig.posts, help="Posts in the synthetic library.")
+    parser.add_argument("--seed", type=int, default=CorpusConfig.seed, help="Seed for the corpus and match outcomes.")
+    parser.add_argument(
+        "--content-kib",
+        type=int,
+        default=CorpusConfig.content_bytes // 1024,
+        help="Size of each post's content in KiB.",
+    )
+    parser.add_argument(
+        "--duplicate-ratio",
+        type=float,
+        default=CorpusConfig.duplicate_ratio,
+        help="Fraction of posts whose content duplicates another post.",
+    )
+    parser.add_argument(
+        "--video-every",
+        type=int,
+        default=CorpusConfig.video_every,
+        help="Every Nth post is a video (filtered out by the listing); 0 for none.",
+    )
+    parser.add_argument(
+        "--exact-ratio",
+        type=float,
+        default=CorpusConfig.exact_ratio,
+        help="Fraction of distinct content Oxibooru has as an exact match.",
+    )
+    parser.add_argument(
+        "--similar-ratio",
+        type=float,
+        default=CorpusConfig.similar_ratio,
+        help="Fraction of distinct content Oxibooru only has a similar match for.",
+    )
+    parser.add_argument(
+        "--tags-per-post",
+        type=int,
+        default=CorpusConfig.tags_per_post,
+        help="Tags on each Oxibooru post.",
+    )
+    parser.add_argument(
+        "--tag-vocabulary",
+        type=int,
+        default=CorpusConfig.tag_vocabulary,
+        help="Distinct tag names across Oxibooru.",
+    )
+    parser.add_argument(
+        "--existing-tags",
+        type=int,
+        default=CorpusConfig.existing_tags,
+        help="Tags Bakabooru already has before the run (exercises the tag catalogue load).",
+    )
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay added to every stand-in request.")
+    parser.add_argument(
+        "--search-latency-ms",
+        type=float,
+        default=None,
+        help="Delay for Oxibooru reverse searches (defaults to --latency-ms).",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of stand-in requests answered with 503.",
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Runs against the same servers (state reset between).")
+    parser.add_argument(
+        "--migrator",
+        type=Path,
+        default=DEFAULT_MIGRATOR,
+        help="Migration script to benchmark (e.g. from another checkout).",
+    )
+    parser.add_argument("--output", type=Path, default=None, help="Append results as JSON lines to this file.")
+    parser.add_argument("--label", default=None, help="Free-form label stored with the results.")
+    parser.add_argument(
+        "--migrator-log",
+        type=Path,
+        default=None,
+        help="Write the migrator's output here instead of discarding it.",
+    )
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("migrator_args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.migrator_args[:1] == ["--"]:
+        args.migrator_args = args.migrator_args[1:]
+    return args
+
+
+def corpus_config(args: argparse.Namespace) -> CorpusConfig:
+    return CorpusConfig(
+        posts=args.posts,
+        seed=args.seed,
+        content_bytes=args.content_kib * 1024,
+        duplicate_ratio=args.duplicate_ratio,
+        video_every=args.video_every,
+        exact_ratio=args.exact_ratio,
+        similar_ratio=args.similar_ratio,
+        tags_per_post=args.tags_per_post,
+        tag_vocabulary=args.tag_vocabulary,
+        existing_tags=args.existing_tags,
+    )
+
+
+def main() -> int:
+    args = parse_args()
+    if args.search_latency_ms is None:
+        args.search_latency_ms = args.latency_ms
+
+    if args.posts < 1 or args.content_kib < 1 or args.repeat < 1:
+        print("--posts, --content-kib and --repeat must be positive", file=sys.stderr)
+        return 2
+    if not 0 <= args.duplicate_ratio < 1 or not 0 <= args.error_rate < 1:
+        print("Invalid --duplicate-ratio/--error-rate", file=sys.stderr)
+        return 2
+    if args.exact_ratio < 0 or args.similar_ratio < 0 or args.exact_ratio + args.similar_ratio > 1:
+        print("Invalid --exact-ratio/--similar-ratio", file=sys.stderr)
+        return 2
+    if args.latency_ms < 0 or args.search_latency_ms < 0:
+        print("Invalid --latency-ms/--search-latency-ms", file=sys.stderr)
+        return 2
+
+    config = corpus_config(args)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if args.serve:
+        return serve(config, args.latency_ms / 1000, args.search_latency_ms / 1000, args.error_rate)
+
+    if not args.migrator.exists():
+        print(f"Migrator script not found: {args.migrator}", file=sys.stderr)
+        return 2
+
+    server_command = [sys.executable, str(Path(__file__).resolve()), "--serve", *sys.argv[1:]]
+    if "--" in server_command:
+        del server_command[server_command.index("--") :]
+    server = subprocess.Popen(server_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    params = {
+        "corpus": asdict(config),
+        "latency_ms": args.latency_ms,
+        "search_latency_ms": args.search_latency_ms,
+        "error_rate": args.error_rate,
+        "migrator_args": args.migrator_args,
+    }
+    revision = git_revision(args.migrator.resolve().parent)
+    before = previous_result(args.output, params) if args.output else None
+    log = open(args.migrator_log, "a", encoding="utf-8") if args.migrator_log else subprocess.DEVNULL
+    exit_code = 0
+    try:
+        assert server.stdout is not None
+        servers = json.loads(server.stdout.readline())
+        print(f"[bench] stand-ins: bakabooru {servers['bakabooru']}, oxibooru {servers['oxibooru']}")
+        for run in range(1, args.repeat + 1):
+            control(servers["bakabooru"], "reset", method="POST")
+            print(f"[bench] run {run}/{args.repeat}: {args.posts} posts, migrator args {args.migrator_args}")
+            code, elapsed, peak_rss, report = run_migrator(args.migrator, servers, args.migrator_args, log)
+            record = {
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                **revision,
+                "label": args.label,
+                "python": sys.version.split()[0],
+                "run": run,
+                "params": params,
+                "result": summarize(code, elapsed, peak_rss, report, control(servers["bakabooru"], "stats")),
+            }
+            print_result(record, before)
+            if args.output:
+                with args.output.open("a", encoding="utf-8") as handle:
+                    handle.write(json.dumps(record) + "\n")
+            exit_code = exit_code or code
+    finally:
+        if log is not subprocess.DEVNULL:
+            log.close()
+        if server.stdin is not None:
+            server.stdin.close()
+        server.wait(timeout=30)
+    return exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
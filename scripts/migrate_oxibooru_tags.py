@@ -4,60 +4,223 @@ Migrate tags, tag categories, and sources from Oxibooru to Bakabooru by
 reverse-searching Bakabooru posts against Oxibooru.
 
 Flow:
-1. Iterate Bakabooru posts (paged).
-2. Process only image/gif posts (skip videos).
+1. Iterate Bakabooru posts by id cursor, filtered server-side to image/gif
+   posts (videos are skipped).
+2. Optionally narrow the scan with a Bakabooru search `--query`.
 3. Download post content from Bakabooru.
-4. If source is JXL, decode it to JPEG using `djxl`.
-5. Reverse-search file in Oxibooru (`/posts/reverse-search`).
+4. If source is JXL, decode it to JPEG using `djxl` (bounded number of
+   concurrent decoders, spooled through tmpfs; `--jxl-cache` keeps decoded
+   JPEGs by content hash so reruns skip both download and decode).
+5. Reverse-search file in Oxibooru (`/posts/reverse-search`). With
+   `--oxibooru-index`, exact matches are first resolved locally by SHA-1
+   against an index of Oxibooru's post listing, and only misses are uploaded.
 6. If exact match exists (or a sufficiently close similar match), sync tag
    categories + tags to Bakabooru.
-7. Add missing sources to the Bakabooru post.
+7. Merge missing tags and sources into the Bakabooru post with a single
+   metadata update (`--legacy-writes` keeps the per-tag requests).
+
+Steps 3-5 can run for many posts at once with `--workers N`; the listing is
+prefetched one page ahead and all Bakabooru writes stay on the main thread.
+Content is streamed through spooled buffers (`--spool-memory-mb` in memory
+per file, the rest on disk) and `--inflight-budget-mb` caps the content held
+by all in-flight posts together.
+With `--journal`, per-post outcomes are checkpointed to SQLite so an
+interrupted run can be resumed without redoing completed posts.
+`--follow` keeps running after the scan and migrates new imports as they
+appear, polling every `--poll-interval` seconds past an (import date, id)
+watermark that the journal keeps across restarts.
+
+Bakabooru's tag catalogue is fetched with parallel page requests at
+startup; `--tag-snapshot` keeps a copy on disk that is reused while the
+server's tag counts still match it.
+
+`--plan out.jsonl` is a dry run that records every match decision and the
+changes it implies; `--apply out.jsonl` later executes it without touching
+Oxibooru or post content: all missing categories and tags are created in
+one parallel pass, then post metadata is written in parallel batches.
+
+Several Oxibooru replicas can be given as a comma-separated
+`--oxibooru-api`: reverse searches go to the least loaded one, and a search
+still running past the `--hedge-quantile` of recent latencies is repeated
+on another replica, keeping whichever answer comes first.
+
+`--estimate N` dry-runs a random sample of N posts and extrapolates the
+match rates, tags added, transfer and runtime of the full scan, with 95%
+confidence intervals.
+
+When the migrator runs next to Bakabooru, `--library-root-map` reads post
+files straight from the library folders (memory-mapped) instead of over
+HTTP, falling back to HTTP for any file it cannot reach.
+
+Transient HTTP failures (429/5xx, resets, timeouts) are retried with capped
+exponential backoff and jitter, honoring `Retry-After`; non-idempotent calls
+are only repeated when the server cannot have acted on them. A per-host
+circuit breaker pauses requests to a remote that keeps failing. With
+`--adaptive-concurrency`, per-stage AIMD limits adjust how many calls run
+at once against each remote.
+
+Progress (rate, ETA, slowest stages) is printed every `--progress-interval`
+seconds; `--metrics-json` and `--prometheus-textfile` export the run's
+counters, per-stage latency histograms and per-remote traffic.
+
+Large libraries can be split across processes or machines with
+`--shard I/N` (posts whose id % N == I); shard 0 creates the tag
+categories and the others reuse them, and tags created concurrently by
+another shard are adopted instead of failing. `--spawn-shards N` runs all
+shards locally and merges their metrics; `--merge-reports` combines the
+`--metrics-json` files of shards run elsewhere.
+
+`--priority untagged,smallest` schedules the posts where a match adds the
+most and costs the least first: a `tag-count:0` listing pass precedes the
+rest, and within a bounded window (`--priority-window`) smaller and non-JXL
+files overtake larger ones, so a time-boxed run makes the most progress.
+
+`--duplicate-groups` reverse-searches one post per unresolved Bakabooru
+duplicate group (exact, or perceptual at `--group-min-similarity` percent
+or more) and applies an accepted match to the other members.
+
+Video posts are skipped unless `--video-frames N` is given: ffmpeg then
+seeks into the post's content URL with HTTP range requests (never
+downloading the whole file), N frames are reverse-searched and the best
+match across them is kept.
 
 Requirements:
 - Python 3.10+
 - `requests` package
+- `aiohttp` package (only required for `--async`)
+- `Pillow` package (only required for `--upload-mode downscale`)
 - `djxl` in PATH (only required for JXL inputs)
+- `ffmpeg` and `ffprobe` in PATH (only required for `--video-frames`)
+- `xxhash` package (only required for `--library-verify-hash`)
 """
 
 from __future__ import annotations
 
 import argparse
+import asyncio
+import cProfile
+import hashlib
+import heapq
+import io
 import json
+import math
+import mmap
+import os
+import pstats
+import queue
+import random
+import re
+import shutil
+import signal
+import sqlite3
+import struct
 import subprocess
 import sys
 import tempfile
-from dataclasses import dataclass
+import threading
+import time
+from collections import Counter, deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable, Iterator
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Any
+from typing import IO, Any
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import aiohttp
+except ImportError:  # Only needed for --async.
+    aiohttp = None
+
+try:
+    from PIL import Image
+except ImportError:  # Only needed for --upload-mode downscale.
+    Image = None
+
+try:
+    import xxhash
+except ImportError:  # Only needed for --library-verify-hash.
+    xxhash = None
 
 
 DEFAULT_OXIBOORU_API = "https://oxibooru.example.com/api"
 DEFAULT_BAKABOORU_API = "http://localhost:5119/api"
 
+# Bakabooru `PostTagSource` enum values (serialized as numbers).
+POST_TAG_SOURCE_MANUAL = 0
+
+UPLOAD_MODES = ("full", "thumbnail", "downscale")
+
+CONTENT_CHUNK_SIZE = 1024 * 1024
+
+OXIBOORU_INDEX_PAGE_SIZE = 100
+# The server caps /tags pages at 500.
+TAG_PAGE_SIZE = 500
+# Parallel page requests when the tag catalogue is fetched at startup.
+TAG_CATALOGUE_WORKERS = 8
+# Full fetches before a catalogue that keeps changing underneath is used unsaved.
+TAG_CATALOGUE_ATTEMPTS = 3
+
+# Reverse-search latencies kept per replica set, and how many are needed
+# before the hedging threshold is trusted.
+HEDGE_WINDOW = 500
+HEDGE_MIN_SAMPLES = 20
+
+# Failed attempts after which --follow lets its watermark pass a post; the
+# journal still records the failure for a later run to retry.
+FOLLOW_MAX_ATTEMPTS = 3
+
+# Bakabooru `type:` filter of the scan; `video` joins it with --video-frames.
+SCAN_MEDIA_TYPES = "image,gif"
+# Longest edge of extracted video frames; reverse search is perceptual.
+VIDEO_FRAME_MAX_EDGE = 1024
+
+# Bakabooru's content hash covers the size plus the first and last chunk.
+CONTENT_HASH_CHUNK_SIZE = 64 * 1024
+
 
 def normalize_name(name: str) -> str:
     return name.strip().lower()
 
 
-def is_supported_content_type(content_type: str) -> bool:
+def is_supported_content_type(content_type: str, video: bool = False) -> bool:
     ct = (content_type or "").lower()
     if ct.startswith("video/"):
-        return False
+        return video
     return ct.startswith("image/")
 
 
+def is_video_content_type(content_type: str) -> bool:
+    return (content_type or "").lower().startswith("video/")
+
+
 def is_jxl_content_type(content_type: str) -> bool:
     ct = (content_type or "").lower()
     return ct in {"image/jxl", "image/jxlp", "image/jxl-sequence"}
 
 
-def decode_jxl_to_jpeg(jxl_bytes: bytes) -> bytes:
-    with tempfile.TemporaryDirectory(prefix="baka-jxl-") as tmpdir:
+def default_spool_dir() -> str | None:
+    """tmpfs directory for short-lived decoder files, or None for the system default."""
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return str(shm)
+    return None
+
+
+def decode_jxl_to_jpeg(source: IO[bytes], destination: IO[bytes], spool_dir: str | None = None) -> None:
+    with tempfile.TemporaryDirectory(prefix="baka-jxl-", dir=spool_dir) as tmpdir:
         in_path = Path(tmpdir) / "input.jxl"
         out_path = Path(tmpdir) / "output.jpg"
-        in_path.write_bytes(jxl_bytes)
+        with in_path.open("wb") as handle:
+            shutil.copyfileobj(source, handle, CONTENT_CHUNK_SIZE)
 
         result = subprocess.run(
             ["djxl", str(in_path), str(out_path)],
@@ -74,546 +237,5490 @@ def decode_jxl_to_jpeg(jxl_bytes: bytes) -> bytes:
         if not out_path.exists():
             raise RuntimeError("djxl succeeded but did not produce output file.")
 
-        return out_path.read_bytes()
+        with out_path.open("rb") as handle:
+            shutil.copyfileobj(handle, destination, CONTENT_CHUNK_SIZE)
 
 
-def with_leading_slash(path: str) -> str:
-    if path.startswith("/"):
-        return path
-    return f"/{path}"
+class JxlDecoder:
+    """
+    Thread-safe `djxl` front end. At most `max_processes` decoders run at once
+    (callers on other threads keep doing network I/O meanwhile), temporary
+    files live on tmpfs when available, and with `cache_dir` decoded JPEGs are
+    kept on disk by Bakabooru content hash.
+    """
 
+    def __init__(
+        self,
+        max_processes: int,
+        cache_dir: str | None = None,
+        spool_dir: str | None = None,
+    ) -> None:
+        self.slots = threading.BoundedSemaphore(max_processes)
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.spool_dir = spool_dir if spool_dir is not None else default_spool_dir()
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
 
-@dataclass
-class ManagedTag:
-    id: int
-    name: str
-    category_id: int | None
+    def _cache_path(self, content_hash: str) -> Path | None:
+        if self.cache_dir is None or not content_hash:
+            return None
+        return self.cache_dir / content_hash[:2] / f"{content_hash}.jpg"
 
+    def cached(self, content_hash: str) -> IO[bytes] | None:
+        path = self._cache_path(content_hash)
+        if path is None:
+            return None
+        try:
+            return path.open("rb")
+        except FileNotFoundError:
+            return None
 
-@dataclass
-class ManagedCategory:
-    id: int
-    name: str
-    color: str
-    order: int
+    def decode(self, source: IO[bytes], content_hash: str = "", max_memory: int = 0) -> IO[bytes]:
+        """Decoded JPEG as a readable stream: the cache file, or a spooled buffer without a cache."""
+        path = self._cache_path(content_hash)
+        if path is None:
+            destination = tempfile.SpooledTemporaryFile(max_size=max_memory)
+            with self.slots:
+                decode_jxl_to_jpeg(source, destination, self.spool_dir)
+            destination.seek(0)
+            return destination
 
+        path.parent.mkdir(exist_ok=True)
+        partial = path.with_name(f"{path.name}.{threading.get_ident()}.part")
+        with partial.open("wb") as destination, self.slots:
+            decode_jxl_to_jpeg(source, destination, self.spool_dir)
+        os.replace(partial, path)
+        return path.open("rb")
 
-class BakabooruClient:
-    def __init__(
-        self,
-        api_base: str,
-        username: str | None = None,
-        password: str | None = None,
-        timeout: int = 60,
-    ) -> None:
-        self.api_base = api_base.rstrip("/")
-        self.timeout = timeout
-        self.session = requests.Session()
-        self.session.headers.update({"Accept": "application/json"})
 
-        if username and password:
-            self.login(username, password)
+def ffmpeg_header_args(headers: dict[str, str]) -> list[str]:
+    if not headers:
+        return []
+    return ["-headers", "".join(f"{name}: {value}\r\n" for name, value in headers.items())]
 
-    def _url(self, path: str) -> str:
-        return f"{self.api_base}{with_leading_slash(path)}"
 
-    def _raise_for_status(self, response: requests.Response, context: str) -> None:
-        if response.ok:
-            return
+class VideoFrameExtractor:
+    """
+    Thread-safe ffmpeg front end for video posts. ffmpeg reads the content URL
+    itself and seeks with HTTP range requests, so only the container index and
+    the data around each requested frame are transferred. At most
+    `max_processes` ffprobe/ffmpeg processes run at once.
+    """
 
-        detail = response.text
-        try:
-            parsed = response.json()
-            if isinstance(parsed, dict):
-                detail = parsed.get("description") or parsed.get("title") or json.dumps(parsed)
-        except Exception:
-            pass
+    def __init__(self, frames: int, max_processes: int, timeout: int = 60) -> None:
+        self.frames = frames
+        self.slots = threading.BoundedSemaphore(max_processes)
+        self.timeout = timeout
 
-        raise RuntimeError(f"{context} failed: HTTP {response.status_code} - {detail}")
+    def _run(self, command: list[str], text: bool = False) -> subprocess.CompletedProcess:
+        try:
+            with self.slots:
+                return subprocess.run(command, capture_output=True, text=text, timeout=self.timeout, check=False)
+        except FileNotFoundError:
+            raise RuntimeError(f"{command[0]} is not in PATH (required for video posts).") from None
+        except subprocess.TimeoutExpired:
+            raise RuntimeError(f"{command[0]} timed out after {self.timeout}s") from None
 
-    def login(self, username: str, password: str) -> None:
-        response = self.session.post(
-            self._url("/auth/login"),
-            json={"username": username, "password": password},
-            timeout=self.timeout,
+    def offsets(self, url: str, headers: dict[str, str]) -> list[float]:
+        """
+        Seconds into the video of each frame to search. Boorus of the
+        szurubooru family thumbnail videos about 30% in, so that frame goes
+        first; the rest are spread evenly.
+        """
+        result = self._run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                *ffmpeg_header_args(headers),
+                "-show_entries",
+                "format=duration",
+                "-of",
+                "default=noprint_wrappers=1:nokey=1",
+                url,
+            ],
+            text=True,
         )
-        self._raise_for_status(response, "Bakabooru login")
+        try:
+            duration = float(result.stdout.strip())
+        except ValueError:
+            duration = 0.0
+        if result.returncode != 0 or duration <= 0:
+            return [0.0]
+        fractions = [0.3] + [(index + 0.5) / (self.frames - 1) for index in range(self.frames - 1)]
+        return [duration * fraction for fraction in fractions]
 
-    def get_posts_page(self, page: int, page_size: int) -> dict[str, Any]:
-        response = self.session.get(
-            self._url("/posts"),
-            params={"page": page, "pageSize": page_size},
-            timeout=self.timeout,
+    def frame(self, url: str, headers: dict[str, str], offset: float) -> bytes:
+        """One JPEG frame at `offset` seconds, at most `VIDEO_FRAME_MAX_EDGE` pixels wide."""
+        result = self._run(
+            [
+                "ffmpeg",
+                "-nostdin",
+                "-v",
+                "error",
+                *ffmpeg_header_args(headers),
+                "-ss",
+                f"{offset:.3f}",
+                "-i",
+                url,
+                "-frames:v",
+                "1",
+                "-vf",
+                f"scale='min({VIDEO_FRAME_MAX_EDGE},iw)':-2",
+                "-f",
+                "image2",
+                "-c:v",
+                "mjpeg",
+                "pipe:1",
+            ]
         )
-        self._raise_for_status(response, "Bakabooru list posts")
-        data = response.json()
-        if not isinstance(data, dict):
-            raise RuntimeError("Bakabooru list posts returned unexpected payload.")
-        return data
+        if result.returncode != 0 or not result.stdout:
+            detail = result.stderr.decode("utf-8", errors="replace").strip()
+            raise RuntimeError(f"ffmpeg failed with exit code {result.returncode}: {detail or 'no frame produced'}")
+        return result.stdout
 
-    def get_post_content(self, post_id: int) -> bytes:
-        response = self.session.get(
-            self._url(f"/posts/{post_id}/content"),
-            timeout=self.timeout,
-        )
-        self._raise_for_status(response, f"Bakabooru fetch content for post {post_id}")
-        return response.content
 
-    def get_categories(self) -> list[ManagedCategory]:
-        response = self.session.get(self._url("/tagcategories"), timeout=self.timeout)
-        self._raise_for_status(response, "Bakabooru list categories")
-        payload = response.json()
-        if not isinstance(payload, list):
-            raise RuntimeError("Bakabooru categories payload is not a list.")
-
-        result: list[ManagedCategory] = []
-        for item in payload:
-            result.append(
-                ManagedCategory(
-                    id=int(item["id"]),
-                    name=str(item["name"]),
-                    color=str(item["color"]),
-                    order=int(item.get("order", 0)),
-                )
-            )
-        return result
+def bakabooru_content_hash(data: mmap.mmap | bytes) -> str:
+    """Bakabooru's `ContentHash`: XxHash64 of the size, the first and (beyond two chunks) the last 64 KiB."""
+    size = len(data)
+    hasher = xxhash.xxh64()
+    hasher.update(struct.pack("<q", size))
+    hasher.update(data[:CONTENT_HASH_CHUNK_SIZE])
+    if size > CONTENT_HASH_CHUNK_SIZE * 2:
+        hasher.update(data[-CONTENT_HASH_CHUNK_SIZE:])
+    return f"{hasher.intdigest():016x}"
 
-    def create_category(self, name: str, color: str, order: int) -> ManagedCategory:
-        response = self.session.post(
-            self._url("/tagcategories"),
-            json={"name": name, "color": color, "order": order},
-            timeout=self.timeout,
-        )
-        self._raise_for_status(response, f"Bakabooru create category '{name}'")
-        item = response.json()
-        return ManagedCategory(
-            id=int(item["id"]),
-            name=str(item["name"]),
-            color=str(item["color"]),
-            order=int(item.get("order", 0)),
-        )
 
-    def get_all_tags(self) -> list[ManagedTag]:
-        page = 1
-        page_size = 500
-        tags: list[ManagedTag] = []
+def parse_root_map(value: str) -> list[tuple[str, str]] | None:
+    """`SERVER=LOCAL[,SERVER=LOCAL...]` -> prefix pairs, or None when malformed."""
+    pairs: list[tuple[str, str]] = []
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        server, separator, local = item.partition("=")
+        if not separator or not server.strip() or not local.strip():
+            return None
+        pairs.append((server.strip().rstrip("/\\"), local.strip()))
+    return pairs
 
-        while True:
-            response = self.session.get(
-                self._url("/tags"),
-                params={"page": page, "pageSize": page_size},
-                timeout=self.timeout,
-            )
-            self._raise_for_status(response, "Bakabooru list tags")
-            payload = response.json()
-
-            items = payload.get("items") or payload.get("Items") or []
-            if not isinstance(items, list):
-                raise RuntimeError("Bakabooru tags payload has invalid 'items'.")
-
-            for item in items:
-                tags.append(
-                    ManagedTag(
-                        id=int(item["id"]),
-                        name=str(item["name"]),
-                        category_id=(int(item["categoryId"]) if item.get("categoryId") is not None else None),
-                    )
-                )
 
-            if len(items) < page_size:
-                break
-            page += 1
+class LibraryFiles:
+    """
+    Direct reads of post files when Bakabooru's library folders are visible
+    to the migrator. Files are memory-mapped, so uploads are served from the
+    page cache without a spooled copy. Any post whose file is missing,
+    outside its library, of a different size than listed or (with
+    `verify_hash`) of a different content hash is left to HTTP.
+    """
 
-        return tags
+    def __init__(self, roots: dict[int, Path], verify_hash: bool = False) -> None:
+        self.roots = roots
+        self.verify_hash = verify_hash
 
-    def create_tag(self, name: str, category_id: int | None) -> ManagedTag:
-        response = self.session.post(
-            self._url("/tags"),
-            json={"name": name, "categoryId": category_id},
-            timeout=self.timeout,
-        )
-        self._raise_for_status(response, f"Bakabooru create tag '{name}'")
-        payload = response.json()
-        return ManagedTag(
-            id=int(payload["id"]),
-            name=str(payload["name"]),
-            category_id=(int(payload["categoryId"]) if payload.get("categoryId") is not None else None),
-        )
+    @classmethod
+    def from_libraries(
+        cls,
+        libraries: list[dict[str, Any]],
+        root_map: list[tuple[str, str]],
+        verify_hash: bool = False,
+    ) -> LibraryFiles:
+        roots: dict[int, Path] = {}
+        for library in libraries:
+            path = str(library.get("path") or "")
+            for server, local in root_map:
+                if path == server or path.startswith(server + "/") or path.startswith(server + "\\"):
+                    path = local + path[len(server) :]
+                    break
+            if path and Path(path).is_dir():
+                roots[int(library["id"])] = Path(path).resolve()
+        print(f"[library] {len(roots)} of {len(libraries)} library roots readable locally")
+        return cls(roots, verify_hash)
 
-    def update_tag(self, tag_id: int, name: str, category_id: int | None) -> ManagedTag:
-        response = self.session.put(
-            self._url(f"/tags/{tag_id}"),
-            json={"name": name, "categoryId": category_id},
-            timeout=self.timeout,
-        )
-        self._raise_for_status(response, f"Bakabooru update tag '{name}'")
-        payload = response.json()
-        return ManagedTag(
-            id=int(payload["id"]),
-            name=str(payload["name"]),
-            category_id=(int(payload["categoryId"]) if payload.get("categoryId") is not None else None),
-        )
+    def path(self, post: dict[str, Any]) -> Path | None:
+        root = self.roots.get(int(post.get("libraryId") or 0))
+        relative = str(post.get("relativePath") or "")
+        if root is None or not relative:
+            return None
+        candidate = (root / relative.replace("\\", "/")).resolve()
+        if not candidate.is_relative_to(root) or not candidate.is_file():
+            return None
+        return candidate
 
-    def add_tag_to_post(self, post_id: int, tag_name: str) -> tuple[bool, int]:
-        response = self.session.post(
-            self._url(f"/posts/{post_id}/tags"),
-            data=json.dumps(tag_name),
-            headers={"Content-Type": "application/json", "Accept": "application/json"},
-            timeout=self.timeout,
-        )
-        if response.status_code in (204, 201, 200):
-            return True, response.status_code
-        if response.status_code == 409:
-            return False, response.status_code
+    def open(self, post: dict[str, Any]) -> IO[bytes] | None:
+        """The post's file mapped read-only, or None to fall back to HTTP."""
+        path = self.path(post)
+        if path is None:
+            return None
+        try:
+            with path.open("rb") as handle:
+                size = os.fstat(handle.fileno()).st_size
+                if size == 0 or size != int(post.get("sizeBytes") or size):
+                    return None
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            return None
+        if self.verify_hash and bakabooru_content_hash(mapped) != str(post.get("contentHash") or ""):
+            mapped.close()
+            print(f"[library] post {post.get('id')}: {path} does not match its content hash; using HTTP")
+            return None
+        return mapped
 
-        self._raise_for_status(response, f"Bakabooru add tag '{tag_name}' to post {post_id}")
-        return False, response.status_code
 
-    def get_post_sources(self, post_id: int) -> list[str]:
-        response = self.session.get(
-            self._url(f"/posts/{post_id}/sources"),
-            timeout=self.timeout,
-        )
-        self._raise_for_status(response, f"Bakabooru get sources for post {post_id}")
-        payload = response.json()
-        if not isinstance(payload, list):
-            raise RuntimeError(f"Bakabooru sources payload for post {post_id} is not a list.")
-        result: list[str] = []
-        for item in payload:
-            if isinstance(item, str):
-                value = item.strip()
-                if value:
-                    result.append(value)
-        return result
+def with_leading_slash(path: str) -> str:
+    if path.startswith("/"):
+        return path
+    return f"/{path}"
 
-    def set_post_sources(self, post_id: int, sources: list[str]) -> None:
-        response = self.session.put(
-            self._url(f"/posts/{post_id}/sources"),
-            json=sources,
-            timeout=self.timeout,
-        )
-        self._raise_for_status(response, f"Bakabooru set sources for post {post_id}")
 
+def site_base_from_api(api_base: str) -> str:
+    """Bakabooru serves thumbnails next to `/api`, at the site root."""
+    base = api_base.rstrip("/")
+    return base[: -len("/api")] if base.endswith("/api") else base
 
-class OxibooruClient:
-    def __init__(
-        self,
-        api_base: str,
-        token_auth: str | None = None,
-        timeout: int = 60,
-    ) -> None:
-        self.api_base = api_base.rstrip("/")
-        self.timeout = timeout
-        self.session = requests.Session()
-        self.session.headers.update({"Accept": "application/json"})
-        if token_auth:
-            self.session.headers["Authorization"] = token_auth
 
-    def _url(self, path: str) -> str:
-        return f"{self.api_base}{with_leading_slash(path)}"
+def thumbnail_path(post: dict[str, Any]) -> str | None:
+    content_hash = str(post.get("thumbnailContentHash") or "")
+    library_id = post.get("thumbnailLibraryId", post.get("libraryId"))
+    if not content_hash or library_id is None:
+        return None
+    return f"/thumbnails/{int(library_id)}/{content_hash}.webp"
 
-    def _raise_for_status(self, response: requests.Response, context: str) -> None:
-        if response.ok:
-            return
 
-        detail = response.text
-        try:
-            parsed = response.json()
-            if isinstance(parsed, dict):
-                detail = parsed.get("description") or parsed.get("title") or json.dumps(parsed)
-        except Exception:
-            pass
-        raise RuntimeError(f"{context} failed: HTTP {response.status_code} - {detail}")
+def format_bytes(value: float) -> str:
+    sign = "-" if value < 0 else ""
+    value = abs(value)
+    if value < 1024:
+        return f"{sign}{int(value)} B"
+    for unit in ("KiB", "MiB", "GiB"):
+        value /= 1024
+        if value < 1024 or unit == "GiB":
+            break
+    return f"{sign}{value:.1f} {unit}"
 
-    def get_tag_categories(self) -> dict[str, dict[str, Any]]:
-        response = self.session.get(self._url("/tag-categories"), timeout=self.timeout)
-        self._raise_for_status(response, "Oxibooru list categories")
-        payload = response.json()
-        results = payload.get("results", [])
-        if not isinstance(results, list):
-            raise RuntimeError("Oxibooru categories payload has invalid 'results'.")
-
-        mapped: dict[str, dict[str, Any]] = {}
-        for item in results:
-            name = str(item.get("name", "")).strip()
-            if not name:
-                continue
-            mapped[normalize_name(name)] = {
-                "name": name,
-                "color": str(item.get("color") or "#808080"),
-                "order": int(item.get("order") or 0),
-            }
-        return mapped
 
-    def reverse_search(
-        self,
-        content_bytes: bytes,
-        filename: str,
-        content_type: str,
-    ) -> dict[str, Any]:
-        files = {
-            "content": (filename, content_bytes, content_type),
-        }
-        response = self.session.post(
-            self._url("/posts/reverse-search"),
-            files=files,
-            timeout=self.timeout,
-        )
-        self._raise_for_status(response, "Oxibooru reverse search")
-        payload = response.json()
-        if not isinstance(payload, dict):
-            raise RuntimeError("Oxibooru reverse search payload is invalid.")
-        return payload
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
 
 
-def select_reverse_search_match(
-    reverse_result: dict[str, Any],
-    max_similar_distance: float,
-) -> tuple[dict[str, Any] | None, str, float | None]:
-    """
-    Pick the most reliable reverse-search candidate.
+def sha1_of(stream: IO[bytes]) -> bytes:
+    """SHA-1 digest of a seekable stream (Oxibooru's `checksum`); leaves it rewound."""
+    digest = hashlib.sha1()
+    while chunk := stream.read(CONTENT_CHUNK_SIZE):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.digest()
 
-    Returns: (post, match_kind, distance)
-      - match_kind: "exact", "similar", "none", "too_far"
-    """
-    exact = reverse_result.get("exactPost")
-    if isinstance(exact, dict):
-        return exact, "exact", 0.0
 
-    similar_posts = reverse_result.get("similarPosts") or []
-    if not isinstance(similar_posts, list) or not similar_posts:
-        return None, "none", None
+def stream_size(stream: IO[bytes]) -> int:
+    """Total length of a seekable stream; leaves it rewound."""
+    # `tell`, not the return of `seek`: mmap's `seek` returns None before 3.13.
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
 
-    candidates: list[tuple[float, dict[str, Any]]] = []
-    for item in similar_posts:
-        if not isinstance(item, dict):
-            continue
-        post = item.get("post")
-        if not isinstance(post, dict):
-            continue
 
-        distance_raw = item.get("distance")
-        try:
-            distance = float(distance_raw)
-        except (TypeError, ValueError):
-            continue
+@dataclass
+class Upload:
+    """A file to reverse-search: a seekable body plus its multipart metadata."""
 
-        candidates.append((distance, post))
+    body: IO[bytes]
+    size: int
+    filename: str
+    content_type: str
+    # Serializes seek+read, so hedged requests can stream one body concurrently.
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+    withdrawn: bool = field(default=False, repr=False, compare=False)
 
-    if not candidates:
-        return None, "none", None
+    @classmethod
+    def from_bytes(cls, data: bytes, filename: str, content_type: str) -> Upload:
+        return cls(io.BytesIO(data), len(data), filename, content_type)
 
-    candidates.sort(key=lambda pair: pair[0])
-    best_distance, best_post = candidates[0]
-    if best_distance > max_similar_distance:
-        return None, "too_far", best_distance
+    def withdraw(self) -> None:
+        """Fail every later read (after one in progress), so the body can be closed under a request still sending it."""
+        with self.lock:
+            self.withdrawn = True
 
-    print("Found non-exact similar match with distance =", best_distance)
-    return best_post, "similar", best_distance
+    def close(self) -> None:
+        self.body.close()
 
 
-class Migrator:
-    def __init__(
-        self,
-        baka: BakabooruClient,
-        oxi: OxibooruClient,
-        dry_run: bool = False,
-    ) -> None:
-        self.baka = baka
-        self.oxi = oxi
-        self.dry_run = dry_run
+class UploadWithdrawn(Exception):
+    """
+    Read from an `Upload` after `Upload.withdraw`. Deliberately not an
+    `OSError`: HTTP clients let it through unwrapped and drop the connection,
+    and it is not a transient error, so the request is not retried.
+    """
 
-        self.oxi_categories = self.oxi.get_tag_categories()
-        self.categories_by_name: dict[str, ManagedCategory] = {
-            normalize_name(c.name): c for c in self.baka.get_categories()
-        }
-        self.tags_by_name: dict[str, ManagedTag] = {
-            normalize_name(t.name): t for t in self.baka.get_all_tags()
-        }
 
-    def ensure_category(self, category_name: str | None) -> int | None:
-        if not category_name or not category_name.strip():
-            return None
+class MultipartStream(io.RawIOBase):
+    """
+    `multipart/form-data` body with a single file field. It is read lazily
+    from the upload's body, so the file is never copied into memory whole;
+    `__len__` lets HTTP clients send a Content-Length instead of chunking.
+    """
 
-        key = normalize_name(category_name)
-        existing = self.categories_by_name.get(key)
-        if existing:
-            return existing.id
+    def __init__(self, field: str, upload: Upload) -> None:
+        super().__init__()
+        self.boundary = os.urandom(16).hex()
+        filename = upload.filename.replace('"', "%22")
+        head = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {upload.content_type}\r\n\r\n"
+        ).encode("utf-8")
+        tail = f"\r\n--{self.boundary}--\r\n".encode("ascii")
+        self.parts: list[tuple[IO[bytes], int]] = [
+            (io.BytesIO(head), len(head)),
+            (upload.body, upload.size),
+            (io.BytesIO(tail), len(tail)),
+        ]
+        self.length = len(head) + upload.size + len(tail)
+        self.position = 0
+        self.upload = upload
 
-        source = self.oxi_categories.get(key, {})
-        color = str(source.get("color") or "#808080")
-        order = int(source.get("order") or 0)
-        display_name = str(source.get("name") or category_name).strip()
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
 
-        if self.dry_run:
-            print(f"[dry-run] create category: name='{display_name}', color='{color}', order={order}")
-            return None
+    def __len__(self) -> int:
+        return self.length
 
-        created = self.baka.create_category(display_name, color, order)
-        self.categories_by_name[key] = created
-        print(f"[category] created '{created.name}' (id={created.id})")
-        return created.id
+    def readable(self) -> bool:
+        return True
 
-    def ensure_tag(self, tag_name: str, category_id: int | None) -> ManagedTag | None:
-        key = normalize_name(tag_name)
-        existing = self.tags_by_name.get(key)
-        if existing:
-            if existing.category_id != category_id:
-                if self.dry_run:
-                    print(
-                        f"[dry-run] update tag category: '{existing.name}' "
-                        f"{existing.category_id} -> {category_id}"
-                    )
-                    return existing
+    def seekable(self) -> bool:
+        return True
 
-                updated = self.baka.update_tag(existing.id, existing.name, category_id)
-                self.tags_by_name[key] = updated
-                print(f"[tag] updated '{updated.name}' (id={updated.id}) category={updated.category_id}")
-                return updated
-            return existing
+    def tell(self) -> int:
+        return self.position
 
-        if self.dry_run:
-            print(f"[dry-run] create tag: '{tag_name}' categoryId={category_id}")
-            return None
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.length
+        self.position = min(max(offset, 0), self.length)
+        return self.position
 
-        created = self.baka.create_tag(tag_name, category_id)
-        self.tags_by_name[key] = created
-        print(f"[tag] created '{created.name}' (id={created.id}) category={created.category_id}")
-        return created
+    def readinto(self, buffer: Any) -> int:
+        start = 0
+        for part, size in self.parts:
+            if self.position < start + size:
+                with self.upload.lock:
+                    if self.upload.withdrawn:
+                        raise UploadWithdrawn(f"upload of {self.upload.filename} was withdrawn")
+                    part.seek(self.position - start)
+                    chunk = part.read(min(len(buffer), start + size - self.position))
+                buffer[: len(chunk)] = chunk
+                self.position += len(chunk)
+                return len(chunk)
+            start += size
+        return 0
 
-    def migrate_post_tags(
-        self,
-        post_id: int,
-        post_tags: list[dict[str, Any]],
-        oxi_tags: list[dict[str, Any]],
-    ) -> tuple[int, int]:
-        current_post_tags = {
-            normalize_name(str(t.get("name", "")))
-            for t in post_tags
-            if str(t.get("name", "")).strip()
-        }
 
-        added_count = 0
-        discovered_count = 0
-        seen_input_tags: set[str] = set()
+class ByteBudget:
+    """
+    Caps the content bytes held by in-flight posts across worker threads. A
+    reservation larger than the whole budget is admitted once nothing else
+    is held, so oversized files run alone instead of never.
+    """
 
-        for oxi_tag in oxi_tags:
-            names = oxi_tag.get("names") or []
-            if not isinstance(names, list) or not names:
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.held = 0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, amount: int) -> Iterator[None]:
+        with self.condition:
+            while self.held and self.held + amount > self.limit:
+                self.condition.wait()
+            self.held += amount
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.held -= amount
+                self.condition.notify_all()
+
+
+class AsyncByteBudget:
+    """asyncio counterpart of `ByteBudget` for tasks on one event loop."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.held = 0
+        self.condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, amount: int) -> AsyncIterator[None]:
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.held or self.held + amount <= self.limit)
+            self.held += amount
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.held -= amount
+                self.condition.notify_all()
+
+
+def create_session(pool_size: int) -> requests.Session:
+    """
+    Session whose connection pool is large enough for `pool_size` threads to
+    share it without discarding connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Accept": "application/json"})
+    return session
+
+
+@dataclass
+class ManagedTag:
+    id: int
+    name: str
+    category_id: int | None
+
+
+@dataclass
+class ManagedCategory:
+    id: int
+    name: str
+    color: str
+    order: int
+    tag_count: int = 0
+
+
+@dataclass
+class DuplicateGroup:
+    id: int
+    type: str
+    similarity_percent: int | None
+    post_ids: list[int]
+
+
+class HttpError(RuntimeError):
+    def __init__(self, message: str, status: int) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def http_error(context: str, status: int, text: str) -> HttpError:
+    detail = text
+    try:
+        parsed = json.loads(text)
+        if isinstance(parsed, dict):
+            detail = parsed.get("description") or parsed.get("title") or json.dumps(parsed)
+    except Exception:
+        pass
+    return HttpError(f"{context} failed: HTTP {status} - {detail}", status)
+
+
+def parse_posts_page(payload: Any) -> dict[str, Any]:
+    if not isinstance(payload, dict):
+        raise RuntimeError("Bakabooru list posts returned unexpected payload.")
+    return payload
+
+
+def parse_post(post_id: int, payload: Any) -> dict[str, Any]:
+    if not isinstance(payload, dict):
+        raise RuntimeError(f"Bakabooru post {post_id} payload is invalid.")
+    return payload
+
+
+def parse_category(item: dict[str, Any]) -> ManagedCategory:
+    return ManagedCategory(
+        id=int(item["id"]),
+        name=str(item["name"]),
+        color=str(item["color"]),
+        order=int(item.get("order", 0)),
+        tag_count=int(item.get("tagCount") or 0),
+    )
+
+
+def parse_categories(payload: Any) -> list[ManagedCategory]:
+    if not isinstance(payload, list):
+        raise RuntimeError("Bakabooru categories payload is not a list.")
+    return [parse_category(item) for item in payload]
+
+
+def parse_tag(payload: dict[str, Any]) -> ManagedTag:
+    return ManagedTag(
+        id=int(payload["id"]),
+        name=str(payload["name"]),
+        category_id=(int(payload["categoryId"]) if payload.get("categoryId") is not None else None),
+    )
+
+
+def parse_tag_page(payload: dict[str, Any]) -> list[ManagedTag]:
+    items = payload.get("items") or payload.get("Items") or []
+    if not isinstance(items, list):
+        raise RuntimeError("Bakabooru tags payload has invalid 'items'.")
+    return [parse_tag(item) for item in items]
+
+
+def parse_updated_tag(tag_id: int, name: str, category_id: int | None, body: bytes) -> ManagedTag:
+    if not body:
+        # The endpoint answers 204 No Content.
+        return ManagedTag(id=tag_id, name=name, category_id=category_id)
+    return parse_tag(json.loads(body))
+
+
+def page_params(page: int, page_size: int, query: str | None, query_param: str) -> dict[str, Any]:
+    """Paging of a Bakabooru listing; posts take their filter as `tags`, tags as `query`."""
+    params: dict[str, Any] = {"page": page, "pageSize": page_size}
+    if query:
+        params[query_param] = query
+    return params
+
+
+def exact_tag(tags: list[ManagedTag], name: str) -> tuple[ManagedTag | None, bool]:
+    """
+    `find_tag` on one page of a `query` search: the tag named exactly `name`,
+    and whether to read the next page. Results are ordered by usage, so a
+    short name can sit behind many longer, busier tags that contain it.
+    """
+    key = normalize_name(name)
+    found = next((tag for tag in tags if normalize_name(tag.name) == key), None)
+    return found, found is None and len(tags) >= TAG_PAGE_SIZE
+
+
+def tag_assignment(status: int) -> tuple[bool, int] | None:
+    """(added, status) of adding a tag to a post, or None for an error status."""
+    if status in (204, 201, 200):
+        return True, status
+    if status == 409 or status < 400:
+        # 409: already assigned, so a repeated delivery is harmless.
+        return False, status
+    return None
+
+
+def parse_post_sources(post_id: int, payload: Any) -> list[str]:
+    if not isinstance(payload, list):
+        raise RuntimeError(f"Bakabooru sources payload for post {post_id} is not a list.")
+    result: list[str] = []
+    for item in payload:
+        if isinstance(item, str):
+            value = item.strip()
+            if value:
+                result.append(value)
+    return result
+
+
+def parse_libraries(payload: Any) -> list[dict[str, Any]]:
+    if not isinstance(payload, list):
+        raise RuntimeError("Bakabooru libraries payload is not a list.")
+    return payload
+
+
+def parse_duplicate_groups(payload: Any) -> list[DuplicateGroup]:
+    if not isinstance(payload, list):
+        raise RuntimeError("Bakabooru duplicate groups payload is not a list.")
+    return [
+        DuplicateGroup(
+            id=int(item["id"]),
+            type=str(item.get("type") or ""),
+            similarity_percent=(int(item["similarityPercent"]) if item.get("similarityPercent") is not None else None),
+            post_ids=[int(post["id"]) for post in item.get("posts") or []],
+        )
+        for item in payload
+    ]
+
+
+def parse_oxibooru_categories(payload: dict[str, Any]) -> dict[str, dict[str, Any]]:
+    results = payload.get("results", [])
+    if not isinstance(results, list):
+        raise RuntimeError("Oxibooru categories payload has invalid 'results'.")
+
+    mapped: dict[str, dict[str, Any]] = {}
+    for item in results:
+        name = str(item.get("name", "")).strip()
+        if not name:
+            continue
+        mapped[normalize_name(name)] = {
+            "name": name,
+            "color": str(item.get("color") or "#808080"),
+            "order": int(item.get("order") or 0),
+        }
+    return mapped
+
+
+def parse_oxibooru_posts(payload: Any) -> list[dict[str, Any]]:
+    if not isinstance(payload, dict):
+        raise RuntimeError("Oxibooru posts payload is invalid.")
+    results = payload.get("results", [])
+    if not isinstance(results, list):
+        raise RuntimeError("Oxibooru posts payload has invalid 'results'.")
+    return [item for item in results if isinstance(item, dict)]
+
+
+def parse_reverse_search(payload: Any) -> dict[str, Any]:
+    if not isinstance(payload, dict):
+        raise RuntimeError("Oxibooru reverse search payload is invalid.")
+    return payload
+
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+
+# Worth retrying for idempotent calls.
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# The server turned the request away without acting on it, so even
+# non-idempotent calls can be repeated.
+UNPROCESSED_STATUSES = frozenset({429, 503})
+
+# Longest `Retry-After` honored as given; anything longer is clamped.
+MAX_RETRY_AFTER = 600.0
+
+
+def is_retryable_status(status: int, idempotent: bool) -> bool:
+    return status in (RETRY_STATUSES if idempotent else UNPROCESSED_STATUSES)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a `Retry-After` header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def is_connect_failure(exc: Exception) -> bool:
+    """True when the request never reached the server (safe to repeat any call)."""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if aiohttp is not None and isinstance(exc, aiohttp.ClientConnectorError):
+        return True
+    reason = getattr(exc.args[0] if exc.args else None, "reason", None)
+    return isinstance(reason, NewConnectionError)
+
+
+@dataclass
+class RetryPolicy:
+    """Retry and circuit-breaker settings shared by every API client."""
+
+    max_attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    breaker_threshold: int = 5
+    breaker_cooldown: float = 30.0
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """Delay before retry number `attempt` (1-based): `Retry-After` if given, else capped exponential with jitter."""
+        if retry_after is not None:
+            return retry_after
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+class CircuitBreaker:
+    """
+    Per-host breaker shared by all clients talking to that host. After
+    `threshold` consecutive transient failures it opens for a cooldown that
+    doubles while failures continue (up to `max_cooldown`). Callers wait out
+    an open breaker instead of failing, which pauses the stage that depends
+    on the host rather than burning through the post list.
+    """
+
+    _registry: dict[str, CircuitBreaker] = {}
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def for_url(cls, url: str, policy: RetryPolicy) -> CircuitBreaker:
+        host = urlsplit(url).netloc or url
+        with cls._registry_lock:
+            breaker = cls._registry.get(host)
+            if breaker is None:
+                breaker = cls(host, policy.breaker_threshold, policy.breaker_cooldown)
+                cls._registry[host] = breaker
+            return breaker
+
+    def __init__(self, host: str, threshold: int, cooldown: float, max_cooldown: float = 300.0) -> None:
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max(max_cooldown, cooldown)
+        self.failures = 0
+        self.open_until = 0.0
+        self.next_cooldown = cooldown
+        self._lock = threading.Lock()
+
+    def pause(self) -> float:
+        """Seconds until the breaker lets requests through again (0 when closed)."""
+        with self._lock:
+            return max(0.0, self.open_until - time.monotonic())
+
+    def record(self, transient_failure: bool) -> None:
+        with self._lock:
+            if not transient_failure:
+                self.failures = 0
+                self.next_cooldown = self.cooldown
+                return
+
+            self.failures += 1
+            now = time.monotonic()
+            if self.threshold < 1 or self.failures < self.threshold or now < self.open_until:
+                return
+            self.open_until = now + self.next_cooldown
+            print(
+                f"[breaker] {self.host}: {self.failures} consecutive failures, "
+                f"pausing requests for {self.next_cooldown:.0f}s"
+            )
+            self.next_cooldown = min(self.next_cooldown * 2, self.max_cooldown)
+
+
+class RequestAttempts:
+    """
+    Retry decisions for one request, shared by `ApiClient._send` and its
+    asyncio twin so both back off and trip the breaker alike. Iterating
+    yields the breaker pause to wait out before each attempt.
+    """
+
+    def __init__(
+        self,
+        policy: RetryPolicy,
+        breaker: CircuitBreaker,
+        method: str,
+        url: str,
+        idempotent: bool | None,
+    ) -> None:
+        self.policy = policy
+        self.breaker = breaker
+        # Idempotent calls (by method unless overridden) retry on any transient
+        # error; others only when the server cannot have acted on them.
+        self.idempotent = method in IDEMPOTENT_METHODS if idempotent is None else idempotent
+        self.label = f"{method} {urlsplit(url).path}"
+        self.attempt = 0
+
+    def __iter__(self) -> Iterator[float]:
+        for self.attempt in range(1, self.policy.max_attempts + 1):
+            yield self.breaker.pause()
+
+    @property
+    def last(self) -> bool:
+        return self.attempt == self.policy.max_attempts
+
+    def is_final(self, status: int) -> bool:
+        """Whether a response with `status` is the one to return rather than retry."""
+        if self.last or not is_retryable_status(status, self.idempotent):
+            self.breaker.record(status in RETRY_STATUSES)
+            return True
+        self.breaker.record(True)
+        return False
+
+    def can_retry(self, exc: Exception) -> bool:
+        """Whether a transient error is retried; the caller re-raises it otherwise."""
+        self.breaker.record(True)
+        return not self.last and (self.idempotent or is_connect_failure(exc))
+
+    def backoff(self, reason: str, retry_after: str | None = None) -> float:
+        """Seconds to wait before the next attempt, announced on stdout."""
+        delay = self.policy.backoff(self.attempt, parse_retry_after(retry_after))
+        print(f"[retry] {self.label}: {reason}; attempt {self.attempt + 1}/{self.policy.max_attempts} in {delay:.1f}s")
+        return delay
+
+
+def request_body_size(kwargs: dict[str, Any]) -> int:
+    """Bytes a request will send, for transfer accounting."""
+    data = kwargs.get("data")
+    if data is not None:
+        return len(data) if hasattr(data, "__len__") else 0
+    if "json" in kwargs:
+        return len(json.dumps(kwargs["json"]).encode("utf-8"))
+    return 0
+
+
+class ApiClient:
+    """
+    Shared requests plumbing for the blocking clients: one pooled session per
+    remote, retries with backoff per `RetryPolicy`, and the host's
+    `CircuitBreaker`. When `metrics` is set, every attempt is counted
+    against `REMOTE`.
+    """
+
+    REMOTE = "remote"
+    TRANSIENT_ERRORS = (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    )
+
+    def __init__(
+        self,
+        api_base: str,
+        timeout: int = 60,
+        pool_size: int = 10,
+        retry: RetryPolicy | None = None,
+    ) -> None:
+        self.api_base = api_base.rstrip("/")
+        self.timeout = timeout
+        self.session = create_session(pool_size)
+        self.retry = retry or RetryPolicy()
+        self.breaker = CircuitBreaker.for_url(self.api_base, self.retry)
+        self.metrics: Metrics | None = None
+
+    def _url(self, path: str) -> str:
+        return f"{self.api_base}{with_leading_slash(path)}"
+
+    def _raise_for_status(self, response: requests.Response, context: str) -> None:
+        if response.ok:
+            return
+        raise http_error(context, response.status_code, response.text)
+
+    def _request(self, method: str, path: str, **kwargs: Any) -> Any:
+        with self._traced(method, path):
+            return self._send(method, self._url(path), **kwargs)
+
+    def _request_url(self, method: str, url: str, **kwargs: Any) -> Any:
+        """`_request` for a URL outside the API base (e.g. thumbnails)."""
+        with self._traced(method, urlsplit(url).path):
+            return self._send(method, url, **kwargs)
+
+    def _traced(self, method: str, path: str) -> Any:
+        if self.metrics is None:
+            return nullcontext()
+        return self.metrics.span(f"{self.REMOTE} {method} {path}", "http")
+
+    def _send(
+        self,
+        method: str,
+        url: str,
+        idempotent: bool | None = None,
+        consume: Callable[[requests.Response], Any] | None = None,
+        multipart: tuple[str, Upload] | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Send a request, retrying transient failures per `RequestAttempts`.
+        `consume` reads a streamed response inside the attempt, so a reset
+        mid-body is retried too, and `multipart` is re-encoded for every attempt.
+
+        Returns the final response, or what `consume` returned for it.
+        """
+        attempts = RequestAttempts(self.retry, self.breaker, method, url, idempotent)
+        for pause in attempts:
+            if pause > 0:
+                time.sleep(pause)
+            if multipart is not None:
+                body = MultipartStream(*multipart)
+                kwargs["data"] = body
+                kwargs["headers"] = {**kwargs.get("headers", {}), "Content-Type": body.content_type}
+
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if self.metrics is not None:
+                    received = response.headers.get("Content-Length")
+                    if received is None and not kwargs.get("stream"):
+                        received = len(response.content)
+                    self.metrics.record_request(self.REMOTE, request_body_size(kwargs), int(received or 0))
+                if attempts.is_final(response.status_code):
+                    if consume is None:
+                        return response
+                    with response:
+                        return consume(response)
+                response.close()
+                delay = attempts.backoff(f"HTTP {response.status_code}", response.headers.get("Retry-After"))
+            except self.TRANSIENT_ERRORS as exc:
+                if not attempts.can_retry(exc):
+                    raise
+                delay = attempts.backoff(type(exc).__name__)
+            time.sleep(delay)
+
+        raise AssertionError("unreachable")
+
+
+class BakabooruClient(ApiClient):
+    REMOTE = "bakabooru"
+
+    def __init__(
+        self,
+        api_base: str,
+        username: str | None = None,
+        password: str | None = None,
+        timeout: int = 60,
+        pool_size: int = 10,
+        retry: RetryPolicy | None = None,
+    ) -> None:
+        super().__init__(api_base, timeout=timeout, pool_size=pool_size, retry=retry)
+
+        if username and password:
+            self.login(username, password)
+
+    def login(self, username: str, password: str) -> None:
+        response = self._request(
+            "POST",
+            "/auth/login",
+            idempotent=True,
+            json={"username": username, "password": password},
+        )
+        self._raise_for_status(response, "Bakabooru login")
+
+    def get_posts_page(self, page: int, page_size: int, query: str | None = None) -> dict[str, Any]:
+        response = self._request("GET", "/posts", params=page_params(page, page_size, query, "tags"))
+        self._raise_for_status(response, "Bakabooru list posts")
+        return parse_posts_page(response.json())
+
+    def get_post_content(self, post_id: int, max_memory: int) -> IO[bytes]:
+        """Stream post content into a buffer that spills to disk beyond `max_memory` bytes."""
+
+        def download(response: requests.Response) -> IO[bytes]:
+            self._raise_for_status(response, f"Bakabooru fetch content for post {post_id}")
+            spool = tempfile.SpooledTemporaryFile(max_size=max_memory)
+            try:
+                for chunk in response.iter_content(CONTENT_CHUNK_SIZE):
+                    spool.write(chunk)
+            except BaseException:
+                spool.close()
+                raise
+            spool.seek(0)
+            return spool
+
+        return self._request("GET", f"/posts/{post_id}/content", stream=True, consume=download)
+
+    def content_source(self, post_id: int) -> tuple[str, dict[str, str]]:
+        """URL and headers (the login cookie) for an external reader of a post's content."""
+        cookies = "; ".join(f"{cookie.name}={cookie.value}" for cookie in self.session.cookies)
+        return self._url(f"/posts/{post_id}/content"), ({"Cookie": cookies} if cookies else {})
+
+    def get_post_thumbnail(self, post: dict[str, Any]) -> bytes | None:
+        """Thumbnail bytes (WebP) of a listed post, or None when it has none yet."""
+        path = thumbnail_path(post)
+        if path is None:
+            return None
+        response = self._request_url("GET", f"{site_base_from_api(self.api_base)}{path}")
+        if response.status_code == 404:
+            return None
+        self._raise_for_status(response, f"Bakabooru fetch thumbnail for post {post.get('id')}")
+        return response.content
+
+    def get_libraries(self) -> list[dict[str, Any]]:
+        response = self._request("GET", "/libraries")
+        self._raise_for_status(response, "Bakabooru list libraries")
+        return parse_libraries(response.json())
+
+    def get_duplicate_groups(self) -> list[DuplicateGroup]:
+        response = self._request("GET", "/duplicates")
+        self._raise_for_status(response, "Bakabooru list duplicate groups")
+        return parse_duplicate_groups(response.json())
+
+    def get_categories(self) -> list[ManagedCategory]:
+        response = self._request("GET", "/tagcategories")
+        self._raise_for_status(response, "Bakabooru list categories")
+        return parse_categories(response.json())
+
+    def create_category(self, name: str, color: str, order: int) -> ManagedCategory:
+        response = self._request(
+            "POST",
+            "/tagcategories",
+            json={"name": name, "color": color, "order": order},
+        )
+        self._raise_for_status(response, f"Bakabooru create category '{name}'")
+        return parse_category(response.json())
+
+    def get_tags_page(self, page: int, page_size: int, query: str | None = None) -> dict[str, Any]:
+        response = self._request("GET", "/tags", params=page_params(page, page_size, query, "query"))
+        self._raise_for_status(response, "Bakabooru list tags")
+        return response.json()
+
+    def create_tag(self, name: str, category_id: int | None) -> ManagedTag:
+        response = self._request(
+            "POST",
+            "/tags",
+            json={"name": name, "categoryId": category_id},
+        )
+        self._raise_for_status(response, f"Bakabooru create tag '{name}'")
+        return parse_tag(response.json())
+
+    def find_tag(self, name: str) -> ManagedTag | None:
+        """Look a tag up by exact (normalized) name; the server's `query` is a substring match."""
+        page = 1
+        while True:
+            found, more = exact_tag(parse_tag_page(self.get_tags_page(page, TAG_PAGE_SIZE, query=name)), name)
+            if not more:
+                return found
+            page += 1
+
+    def update_tag(self, tag_id: int, name: str, category_id: int | None) -> ManagedTag:
+        response = self._request(
+            "PUT",
+            f"/tags/{tag_id}",
+            json={"name": name, "categoryId": category_id},
+        )
+        self._raise_for_status(response, f"Bakabooru update tag '{name}'")
+        return parse_updated_tag(tag_id, name, category_id, response.content)
+
+    def add_tag_to_post(self, post_id: int, tag_name: str) -> tuple[bool, int]:
+        response = self._request(
+            "POST",
+            f"/posts/{post_id}/tags",
+            idempotent=True,
+            data=json.dumps(tag_name),
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+        )
+        outcome = tag_assignment(response.status_code)
+        if outcome is None:
+            raise http_error(f"Bakabooru add tag '{tag_name}' to post {post_id}", response.status_code, response.text)
+        return outcome
+
+    def get_post_sources(self, post_id: int) -> list[str]:
+        response = self._request("GET", f"/posts/{post_id}/sources")
+        self._raise_for_status(response, f"Bakabooru get sources for post {post_id}")
+        return parse_post_sources(post_id, response.json())
+
+    def set_post_sources(self, post_id: int, sources: list[str]) -> None:
+        response = self._request("PUT", f"/posts/{post_id}/sources", json=sources)
+        self._raise_for_status(response, f"Bakabooru set sources for post {post_id}")
+
+    def get_post(self, post_id: int) -> dict[str, Any]:
+        response = self._request("GET", f"/posts/{post_id}")
+        self._raise_for_status(response, f"Bakabooru get post {post_id}")
+        return parse_post(post_id, response.json())
+
+    def update_post_metadata(
+        self,
+        post_id: int,
+        tags_with_sources: list[dict[str, Any]] | None,
+        sources: list[str] | None,
+    ) -> None:
+        """`PUT /posts/{id}`; a `None` field is left unchanged, a list replaces the whole set."""
+        response = self._request(
+            "PUT",
+            f"/posts/{post_id}",
+            json={"tagsWithSources": tags_with_sources, "sources": sources},
+        )
+        self._raise_for_status(response, f"Bakabooru update metadata for post {post_id}")
+
+
+class OxibooruClient(ApiClient):
+    REMOTE = "oxibooru"
+
+    def __init__(
+        self,
+        api_base: str,
+        token_auth: str | None = None,
+        timeout: int = 60,
+        pool_size: int = 10,
+        retry: RetryPolicy | None = None,
+    ) -> None:
+        super().__init__(api_base, timeout=timeout, pool_size=pool_size, retry=retry)
+        if token_auth:
+            self.session.headers["Authorization"] = token_auth
+
+    def get_tag_categories(self) -> dict[str, dict[str, Any]]:
+        response = self._request("GET", "/tag-categories")
+        self._raise_for_status(response, "Oxibooru list categories")
+        return parse_oxibooru_categories(response.json())
+
+    def list_posts(self, query: str, offset: int, limit: int, fields: str) -> list[dict[str, Any]]:
+        response = self._request(
+            "GET",
+            "/posts/",
+            params={"query": query, "offset": offset, "limit": limit, "fields": fields},
+        )
+        self._raise_for_status(response, "Oxibooru list posts")
+        return parse_oxibooru_posts(response.json())
+
+    def reverse_search(self, upload: Upload) -> dict[str, Any]:
+        # A read-only search despite being a POST.
+        response = self._request(
+            "POST",
+            "/posts/reverse-search",
+            idempotent=True,
+            multipart=("content", upload),
+        )
+        self._raise_for_status(response, "Oxibooru reverse search")
+        return parse_reverse_search(response.json())
+
+
+class AsyncApiClient:
+    """
+    Shared aiohttp plumbing for the asyncio clients: one pooled session per
+    remote with a per-host connection cap and keep-alive, plus the same
+    retry, circuit-breaker and metrics behavior as `ApiClient`.
+    """
+
+    REMOTE = "remote"
+
+    def __init__(
+        self,
+        api_base: str,
+        timeout: int = 60,
+        limit_per_host: int = 100,
+        keepalive_timeout: float = 30.0,
+        headers: dict[str, str] | None = None,
+        retry: RetryPolicy | None = None,
+    ) -> None:
+        if aiohttp is None:
+            raise RuntimeError("--async requires the 'aiohttp' package (pip install aiohttp).")
+
+        self.api_base = api_base.rstrip("/")
+        self.timeout = timeout
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.headers = {"Accept": "application/json", **(headers or {})}
+        self.retry = retry or RetryPolicy()
+        self.breaker = CircuitBreaker.for_url(self.api_base, self.retry)
+        self.metrics: Metrics | None = None
+        self.session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self) -> AsyncApiClient:
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    async def open(self) -> None:
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            # Per connect and per read like `requests`, so slow but live downloads are not cut off.
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout),
+            # Default jar drops cookies set by IP-address hosts such as 127.0.0.1.
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+        )
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _url(self, path: str) -> str:
+        return f"{self.api_base}{with_leading_slash(path)}"
+
+    async def _request(self, method: str, path: str, context: str, **kwargs: Any) -> tuple[int, bytes]:
+        with self._traced(method, path):
+            return await self._send(method, self._url(path), **kwargs)
+
+    async def _request_url(self, method: str, url: str, **kwargs: Any) -> Any:
+        with self._traced(method, urlsplit(url).path):
+            return await self._send(method, url, **kwargs)
+
+    def _traced(self, method: str, path: str) -> Any:
+        if self.metrics is None:
+            return nullcontext()
+        return self.metrics.span(f"{self.REMOTE} {method} {path}", "http")
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        idempotent: bool | None = None,
+        consume: Callable[[aiohttp.ClientResponse], Awaitable[Any]] | None = None,
+        multipart: tuple[str, Upload] | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        asyncio counterpart of `ApiClient._send`. Without `consume` it returns
+        (status, body) of the final response.
+        """
+        assert self.session is not None, "client is not open"
+        transient_errors = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+        attempts = RequestAttempts(self.retry, self.breaker, method, url, idempotent)
+        for pause in attempts:
+            if pause > 0:
+                await asyncio.sleep(pause)
+            if multipart is not None:
+                body = MultipartStream(*multipart)
+                kwargs["data"] = body
+                kwargs["headers"] = {
+                    **kwargs.get("headers", {}),
+                    "Content-Type": body.content_type,
+                    "Content-Length": str(len(body)),
+                }
+
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    if attempts.is_final(response.status):
+                        if consume is None:
+                            payload = await response.read()
+                            self._record(kwargs, len(payload))
+                            return response.status, payload
+                        self._record(kwargs, response.content_length or 0)
+                        return await consume(response)
+                    self._record(kwargs, response.content_length or 0)
+                    delay = attempts.backoff(f"HTTP {response.status}", response.headers.get("Retry-After"))
+            except transient_errors as exc:
+                if not attempts.can_retry(exc):
+                    raise
+                delay = attempts.backoff(type(exc).__name__)
+            await asyncio.sleep(delay)
+
+        raise AssertionError("unreachable")
+
+    def _record(self, kwargs: dict[str, Any], received: int) -> None:
+        if self.metrics is not None:
+            self.metrics.record_request(self.REMOTE, request_body_size(kwargs), received)
+
+    async def _request_ok(self, method: str, path: str, context: str, **kwargs: Any) -> bytes:
+        status, body = await self._request(method, path, context, **kwargs)
+        if status >= 400:
+            raise http_error(context, status, body.decode("utf-8", errors="replace"))
+        return body
+
+    async def _request_json(self, method: str, path: str, context: str, **kwargs: Any) -> Any:
+        return json.loads(await self._request_ok(method, path, context, **kwargs))
+
+
+class AsyncBakabooruClient(AsyncApiClient):
+    """asyncio counterpart of `BakabooruClient` with the same method surface."""
+
+    REMOTE = "bakabooru"
+
+    async def login(self, username: str, password: str) -> None:
+        await self._request_ok(
+            "POST",
+            "/auth/login",
+            "Bakabooru login",
+            idempotent=True,
+            json={"username": username, "password": password},
+        )
+
+    async def get_posts_page(self, page: int, page_size: int, query: str | None = None) -> dict[str, Any]:
+        payload = await self._request_json(
+            "GET",
+            "/posts",
+            "Bakabooru list posts",
+            params=page_params(page, page_size, query, "tags"),
+        )
+        return parse_posts_page(payload)
+
+    async def get_post_content(self, post_id: int, max_memory: int) -> IO[bytes]:
+        async def download(response: aiohttp.ClientResponse) -> IO[bytes]:
+            if response.status >= 400:
+                raise http_error(
+                    f"Bakabooru fetch content for post {post_id}",
+                    response.status,
+                    await response.text(errors="replace"),
+                )
+            spool = tempfile.SpooledTemporaryFile(max_size=max_memory)
+            try:
+                async for chunk in response.content.iter_chunked(CONTENT_CHUNK_SIZE):
+                    spool.write(chunk)
+            except BaseException:
+                spool.close()
+                raise
+            spool.seek(0)
+            return spool
+
+        return await self._request(
+            "GET", f"/posts/{post_id}/content", f"Bakabooru fetch content for post {post_id}", consume=download
+        )
+
+    def content_source(self, post_id: int) -> tuple[str, dict[str, str]]:
+        """URL and headers (the login cookie) for an external reader of a post's content."""
+        jar = self.session.cookie_jar if self.session is not None else []
+        cookies = "; ".join(f"{morsel.key}={morsel.value}" for morsel in jar)
+        return self._url(f"/posts/{post_id}/content"), ({"Cookie": cookies} if cookies else {})
+
+    async def get_post_thumbnail(self, post: dict[str, Any]) -> bytes | None:
+        path = thumbnail_path(post)
+        if path is None:
+            return None
+        status, body = await self._request_url("GET", f"{site_base_from_api(self.api_base)}{path}")
+        if status == 404:
+            return None
+        if status >= 400:
+            raise http_error(
+                f"Bakabooru fetch thumbnail for post {post.get('id')}",
+                status,
+                body.decode("utf-8", errors="replace"),
+            )
+        return body
+
+    async def get_libraries(self) -> list[dict[str, Any]]:
+        return parse_libraries(await self._request_json("GET", "/libraries", "Bakabooru list libraries"))
+
+    async def get_duplicate_groups(self) -> list[DuplicateGroup]:
+        return parse_duplicate_groups(
+            await self._request_json("GET", "/duplicates", "Bakabooru list duplicate groups")
+        )
+
+    async def get_categories(self) -> list[ManagedCategory]:
+        return parse_categories(await self._request_json("GET", "/tagcategories", "Bakabooru list categories"))
+
+    async def create_category(self, name: str, color: str, order: int) -> ManagedCategory:
+        payload = await self._request_json(
+            "POST",
+            "/tagcategories",
+            f"Bakabooru create category '{name}'",
+            json={"name": name, "color": color, "order": order},
+        )
+        return parse_category(payload)
+
+    async def get_tags_page(self, page: int, page_size: int, query: str | None = None) -> dict[str, Any]:
+        params = page_params(page, page_size, query, "query")
+        return await self._request_json("GET", "/tags", "Bakabooru list tags", params=params)
+
+    async def create_tag(self, name: str, category_id: int | None) -> ManagedTag:
+        payload = await self._request_json(
+            "POST",
+            "/tags",
+            f"Bakabooru create tag '{name}'",
+            json={"name": name, "categoryId": category_id},
+        )
+        return parse_tag(payload)
+
+    async def find_tag(self, name: str) -> ManagedTag | None:
+        page = 1
+        while True:
+            found, more = exact_tag(parse_tag_page(await self.get_tags_page(page, TAG_PAGE_SIZE, query=name)), name)
+            if not more:
+                return found
+            page += 1
+
+    async def update_tag(self, tag_id: int, name: str, category_id: int | None) -> ManagedTag:
+        body = await self._request_ok(
+            "PUT",
+            f"/tags/{tag_id}",
+            f"Bakabooru update tag '{name}'",
+            json={"name": name, "categoryId": category_id},
+        )
+        return parse_updated_tag(tag_id, name, category_id, body)
+
+    async def add_tag_to_post(self, post_id: int, tag_name: str) -> tuple[bool, int]:
+        context = f"Bakabooru add tag '{tag_name}' to post {post_id}"
+        status, body = await self._request(
+            "POST",
+            f"/posts/{post_id}/tags",
+            context,
+            idempotent=True,
+            data=json.dumps(tag_name),
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+        )
+        outcome = tag_assignment(status)
+        if outcome is None:
+            raise http_error(context, status, body.decode("utf-8", errors="replace"))
+        return outcome
+
+    async def get_post_sources(self, post_id: int) -> list[str]:
+        payload = await self._request_json(
+            "GET",
+            f"/posts/{post_id}/sources",
+            f"Bakabooru get sources for post {post_id}",
+        )
+        return parse_post_sources(post_id, payload)
+
+    async def set_post_sources(self, post_id: int, sources: list[str]) -> None:
+        await self._request_ok(
+            "PUT",
+            f"/posts/{post_id}/sources",
+            f"Bakabooru set sources for post {post_id}",
+            json=sources,
+        )
+
+    async def get_post(self, post_id: int) -> dict[str, Any]:
+        payload = await self._request_json("GET", f"/posts/{post_id}", f"Bakabooru get post {post_id}")
+        return parse_post(post_id, payload)
+
+    async def update_post_metadata(
+        self,
+        post_id: int,
+        tags_with_sources: list[dict[str, Any]] | None,
+        sources: list[str] | None,
+    ) -> None:
+        await self._request_ok(
+            "PUT",
+            f"/posts/{post_id}",
+            f"Bakabooru update metadata for post {post_id}",
+            json={"tagsWithSources": tags_with_sources, "sources": sources},
+        )
+
+
+class AsyncOxibooruClient(AsyncApiClient):
+    """asyncio counterpart of `OxibooruClient` with the same method surface."""
+
+    REMOTE = "oxibooru"
+
+    def __init__(
+        self,
+        api_base: str,
+        token_auth: str | None = None,
+        timeout: int = 60,
+        limit_per_host: int = 100,
+        keepalive_timeout: float = 30.0,
+        retry: RetryPolicy | None = None,
+    ) -> None:
+        super().__init__(
+            api_base,
+            timeout=timeout,
+            limit_per_host=limit_per_host,
+            keepalive_timeout=keepalive_timeout,
+            headers={"Authorization": token_auth} if token_auth else None,
+            retry=retry,
+        )
+
+    async def get_tag_categories(self) -> dict[str, dict[str, Any]]:
+        return parse_oxibooru_categories(
+            await self._request_json("GET", "/tag-categories", "Oxibooru list categories")
+        )
+
+    async def reverse_search(self, upload: Upload) -> dict[str, Any]:
+        payload = await self._request_json(
+            "POST",
+            "/posts/reverse-search",
+            "Oxibooru reverse search",
+            idempotent=True,
+            multipart=("content", upload),
+        )
+        return parse_reverse_search(payload)
+
+
+class ReplicaLoad:
+    """
+    Replica choice and hedge timing for a set of Oxibooru replicas: a search
+    goes to the replica with the fewest searches in flight (closed breakers
+    first, then the lowest latency average), and is hedged once it has run
+    longer than the `quantile` of recent search latencies.
+    """
+
+    def __init__(self, breakers: list[CircuitBreaker], quantile: float) -> None:
+        self.breakers = breakers
+        self.quantile = quantile
+        self.in_flight = [0] * len(breakers)
+        self.average = [0.0] * len(breakers)
+        self.samples: deque[float] = deque(maxlen=HEDGE_WINDOW)
+        self.lock = threading.Lock()
+
+    def acquire(self, exclude: int | None = None) -> int:
+        with self.lock:
+            candidates = [index for index in range(len(self.breakers)) if index != exclude]
+            index = min(
+                candidates,
+                key=lambda i: (self.breakers[i].pause() > 0, self.in_flight[i], self.average[i]),
+            )
+            self.in_flight[index] += 1
+            return index
+
+    def release(self, index: int, seconds: float | None) -> None:
+        """`seconds` is the latency of a completed search, None for a failed or cancelled one."""
+        with self.lock:
+            self.in_flight[index] -= 1
+            if seconds is not None:
+                average = self.average[index]
+                self.average[index] = seconds if average == 0 else 0.8 * average + 0.2 * seconds
+                self.samples.append(seconds)
+
+    @contextmanager
+    def searching(self, index: int) -> Iterator[None]:
+        """Hold an `acquire`d replica for one search and release it with the search's latency."""
+        started = time.monotonic()
+        elapsed: float | None = None
+        try:
+            yield
+            elapsed = time.monotonic() - started
+        finally:
+            self.release(index, elapsed)
+
+    def hedge_delay(self) -> float | None:
+        """Seconds to wait before hedging, or None when hedging is off or not warmed up yet."""
+        if self.quantile <= 0 or len(self.breakers) < 2:
+            return None
+        with self.lock:
+            if len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+
+
+class HedgedSearch:
+    """
+    Decisions of one reverse search on a replica set, shared by both replica
+    classes: the replica to try first, how long to wait before hedging, the
+    replica to hedge to, and which finished search answers.
+    """
+
+    def __init__(self, load: ReplicaLoad, metrics: Metrics | None) -> None:
+        self.load = load
+        self.metrics = metrics
+        self.first = load.acquire()
+        self.delay = load.hedge_delay()
+        self.error: Exception | None = None
+
+    def hedge(self) -> int:
+        second = self.load.acquire(exclude=self.first)
+        if self.metrics is not None:
+            self.metrics.inc("hedged_searches")
+        return second
+
+    def answers(self, index: int, search: Future | asyncio.Future) -> bool:
+        """Whether a finished search's result is the answer; a failure is kept for `failure`."""
+        exc = search.exception()
+        if exc is not None:
+            self.error = self.error or exc
+            return False
+        if index != self.first and self.metrics is not None:
+            self.metrics.inc("hedge_wins")
+        return True
+
+    def failure(self) -> Exception:
+        """The error to raise once every search has failed."""
+        assert self.error is not None
+        return self.error
+
+
+class OxibooruReplicas:
+    """
+    Several `OxibooruClient`s behind the client's method surface. Reverse
+    searches are spread by `ReplicaLoad` and hedged: when the first replica
+    has not answered by the latency threshold, the same search is sent to
+    another one and whichever succeeds first is returned. Every other call
+    goes to the first replica.
+
+    A blocking request cannot be interrupted, so the winner withdraws the
+    upload: a loser still sending it fails its next read, which aborts the
+    request, and one already waiting for its answer runs out on the hedge
+    pool with the answer dropped. Searches only go to the pool while it has
+    a free thread, so lingering losers never queue new searches behind them.
+    """
+
+    REMOTE = "oxibooru"
+
+    def __init__(self, clients: list[OxibooruClient], hedge_quantile: float, max_workers: int) -> None:
+        self.clients = clients
+        self.load = ReplicaLoad([client.breaker for client in clients], hedge_quantile)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self.slots = threading.Semaphore(max_workers)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.clients[0], name)
+
+    @property
+    def metrics(self) -> Metrics | None:
+        return self.clients[0].metrics
+
+    @metrics.setter
+    def metrics(self, value: Metrics | None) -> None:
+        for client in self.clients:
+            client.metrics = value
+
+    def _search(self, index: int, upload: Upload) -> dict[str, Any]:
+        with self.load.searching(index):
+            return self.clients[index].reverse_search(upload)
+
+    def _pooled_search(self, index: int, upload: Upload) -> dict[str, Any]:
+        try:
+            return self._search(index, upload)
+        finally:
+            self.slots.release()
+
+    def reverse_search(self, upload: Upload) -> dict[str, Any]:
+        search = HedgedSearch(self.load, self.metrics)
+        # Only searches that take a free pool thread are hedged.
+        if search.delay is None or not self.slots.acquire(blocking=False):
+            return self._search(search.first, upload)
+
+        pending = {self.pool.submit(self._pooled_search, search.first, upload): search.first}
+        done, _ = wait(pending, timeout=search.delay)
+        if not done and self.slots.acquire(blocking=False):
+            second = search.hedge()
+            pending[self.pool.submit(self._pooled_search, second, upload)] = second
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if search.answers(pending.pop(future), future):
+                        return future.result()
+        finally:
+            if pending:
+                # The caller closes the upload once this returns.
+                upload.withdraw()
+        raise search.failure()
+
+
+class AsyncOxibooruReplicas:
+    """asyncio counterpart of `OxibooruReplicas`; the losing search is cancelled."""
+
+    REMOTE = "oxibooru"
+
+    def __init__(self, clients: list[AsyncOxibooruClient], hedge_quantile: float) -> None:
+        self.clients = clients
+        self.load = ReplicaLoad([client.breaker for client in clients], hedge_quantile)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.clients[0], name)
+
+    @property
+    def metrics(self) -> Metrics | None:
+        return self.clients[0].metrics
+
+    @metrics.setter
+    def metrics(self, value: Metrics | None) -> None:
+        for client in self.clients:
+            client.metrics = value
+
+    async def __aenter__(self) -> AsyncOxibooruReplicas:
+        for client in self.clients:
+            await client.open()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        for client in self.clients:
+            await client.close()
+
+    async def _search(self, index: int, upload: Upload) -> dict[str, Any]:
+        with self.load.searching(index):
+            return await self.clients[index].reverse_search(upload)
+
+    async def reverse_search(self, upload: Upload) -> dict[str, Any]:
+        search = HedgedSearch(self.load, self.metrics)
+        if search.delay is None:
+            return await self._search(search.first, upload)
+
+        pending = {asyncio.ensure_future(self._search(search.first, upload)): search.first}
+        done, _ = await asyncio.wait(pending, timeout=search.delay)
+        if not done:
+            second = search.hedge()
+            pending[asyncio.ensure_future(self._search(second, upload))] = second
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if search.answers(pending.pop(task), task):
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        raise search.failure()
+
+
+class BlockingClientAdapter:
+    """
+    Expose an async client's coroutines as blocking calls for code that runs on
+    a worker thread (the `Migrator` writer), while the requests themselves
+    still go through the event loop's pooled session.
+    """
+
+    def __init__(self, client: AsyncApiClient, loop: asyncio.AbstractEventLoop) -> None:
+        self._client = client
+        self._loop = loop
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            return asyncio.run_coroutine_threadsafe(attr(*args, **kwargs), self._loop).result()
+
+        return call
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for one stage (Bakabooru reads, Bakabooru writes or
+    Oxibooru reverse search). After every window of completed calls it checks
+    the window's p95 latency and error rate: within both targets, and with
+    the limit actually reached, the limit grows by one; otherwise it is
+    halved. The latency target is `latency_factor` times a baseline that
+    tracks the lowest window p95 (drifting up 5% per window so one lucky
+    window or a change in file sizes doesn't pin it), i.e. relative to the
+    remote's uncongested latency.
+
+    `slot` gates blocking callers and `slot_async` callers on one event loop;
+    a limiter is only ever used in one of the two modes.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maximum: int,
+        initial: int = 2,
+        latency_factor: float = 2.0,
+        max_error_rate: float = 0.05,
+        window: int = 20,
+    ) -> None:
+        self.name = name
+        self.maximum = maximum
+        self.limit = max(1, min(maximum, initial))
+        self.latency_factor = latency_factor
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.baseline: float | None = None
+        self._condition = threading.Condition()
+        self._async_condition: asyncio.Condition | None = None
+
+    def _start(self) -> None:
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _finish(self, latency: float, ok: bool) -> None:
+        self.in_flight -= 1
+        self.latencies.append(latency)
+        if not ok:
+            self.errors += 1
+        if len(self.latencies) >= max(self.window, self.limit):
+            self._adjust()
+
+    def _adjust(self) -> None:
+        ordered = sorted(self.latencies)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        error_rate = self.errors / len(ordered)
+        self.baseline = p95 if self.baseline is None else min(self.baseline * 1.05, p95)
+        target = self.baseline * self.latency_factor
+
+        if p95 > target or error_rate > self.max_error_rate:
+            previous, self.limit = self.limit, max(1, self.limit // 2)
+            if self.limit != previous:
+                print(
+                    f"[adaptive] {self.name} limit {previous} -> {self.limit} "
+                    f"(p95 {p95:.2f}s vs target {target:.2f}s, errors {error_rate:.0%})"
+                )
+        elif self.peak_in_flight >= self.limit:
+            self.limit = min(self.maximum, self.limit + 1)
+
+        self.latencies = []
+        self.errors = 0
+        self.peak_in_flight = self.in_flight
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self._start()
+        started = time.monotonic()
+        ok = True
+        try:
+            yield
+        except Exception:
+            ok = False
+            raise
+        finally:
+            with self._condition:
+                self._finish(time.monotonic() - started, ok)
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def slot_async(self) -> AsyncIterator[None]:
+        if self._async_condition is None:
+            self._async_condition = asyncio.Condition()
+        condition = self._async_condition
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < self.limit)
+            self._start()
+        started = time.monotonic()
+        ok = True
+        try:
+            yield
+        except Exception:
+            ok = False
+            raise
+        finally:
+            async with condition:
+                self._finish(time.monotonic() - started, ok)
+                condition.notify_all()
+
+
+BAKABOORU_READ_METHODS = (
+    "get_posts_page",
+    "get_post_content",
+    "get_post_thumbnail",
+    "get_post",
+    "get_post_sources",
+    "get_categories",
+    "get_tags_page",
+    "find_tag",
+)
+BAKABOORU_WRITE_METHODS = (
+    "create_category",
+    "create_tag",
+    "update_tag",
+    "add_tag_to_post",
+    "set_post_sources",
+    "update_post_metadata",
+)
+OXIBOORU_SEARCH_METHODS = ("reverse_search",)
+
+
+class AdaptiveClient:
+    """
+    Wrap a client (blocking or async) so that every method named in
+    `limiters` runs inside that stage's `AdaptiveLimiter`; everything else
+    passes straight through.
+    """
+
+    def __init__(self, client: Any, limiters: dict[str, AdaptiveLimiter]) -> None:
+        self._client = client
+        self._limiters = limiters
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            return attr
+
+        if asyncio.iscoroutinefunction(attr):
+
+            async def call_async(*args: Any, **kwargs: Any) -> Any:
+                async with limiter.slot_async():
+                    return await attr(*args, **kwargs)
+
+            return call_async
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            with limiter.slot():
+                return attr(*args, **kwargs)
+
+        return call
+
+
+def build_limiters(args: argparse.Namespace) -> dict[str, AdaptiveLimiter]:
+    return {
+        name: AdaptiveLimiter(
+            name,
+            maximum=max(1, args.workers),
+            latency_factor=args.adaptive_latency_factor,
+            max_error_rate=args.adaptive_max_error_rate,
+        )
+        for name in ("baka-read", "baka-write", "oxi-search")
+    }
+
+
+def limit_clients(baka: Any, oxi: Any, limiters: dict[str, AdaptiveLimiter] | None) -> tuple[Any, Any]:
+    """Put the per-stage limiters around the two clients (no-op without `--adaptive-concurrency`)."""
+    if limiters is None:
+        return baka, oxi
+    baka_limits = {
+        **{name: limiters["baka-read"] for name in BAKABOORU_READ_METHODS},
+        **{name: limiters["baka-write"] for name in BAKABOORU_WRITE_METHODS},
+    }
+    oxi_limits = {name: limiters["oxi-search"] for name in OXIBOORU_SEARCH_METHODS}
+    return AdaptiveClient(baka, baka_limits), AdaptiveClient(oxi, oxi_limits)
+
+
+def register_limit_gauges(metrics: Metrics, limiters: dict[str, AdaptiveLimiter] | None) -> None:
+    """Expose each stage's current limit on the progress line and in the Prometheus textfile."""
+    for name, limiter in (limiters or {}).items():
+        metrics.register_gauge(f"limit_{name}", lambda limiter=limiter: limiter.limit)
+
+
+def select_reverse_search_match(
+    reverse_result: dict[str, Any],
+    max_similar_distance: float,
+) -> tuple[dict[str, Any] | None, str, float | None]:
+    """
+    Pick the most reliable reverse-search candidate.
+
+    Returns: (post, match_kind, distance)
+      - match_kind: "exact", "similar", "none", "too_far"
+    """
+    exact = reverse_result.get("exactPost")
+    if isinstance(exact, dict):
+        return exact, "exact", 0.0
+
+    similar_posts = reverse_result.get("similarPosts") or []
+    if not isinstance(similar_posts, list) or not similar_posts:
+        return None, "none", None
+
+    candidates: list[tuple[float, dict[str, Any]]] = []
+    for item in similar_posts:
+        if not isinstance(item, dict):
+            continue
+        post = item.get("post")
+        if not isinstance(post, dict):
+            continue
+
+        distance_raw = item.get("distance")
+        try:
+            distance = float(distance_raw)
+        except (TypeError, ValueError):
+            continue
+
+        candidates.append((distance, post))
+
+    if not candidates:
+        return None, "none", None
+
+    candidates.sort(key=lambda pair: pair[0])
+    best_distance, best_post = candidates[0]
+    if best_distance > max_similar_distance:
+        return None, "too_far", best_distance
+
+    print("Found non-exact similar match with distance =", best_distance)
+    return best_post, "similar", best_distance
+
+
+def selection_rank(selection: tuple[dict[str, Any] | None, str, float | None]) -> tuple[int, float]:
+    """Sort key of a `select_reverse_search_match` result: best first."""
+    _, match_kind, distance = selection
+    order = {"exact": 0, "similar": 1, "too_far": 2}
+    return order.get(match_kind, 3), distance if distance is not None else 0.0
+
+
+class TagCatalogue:
+    """
+    Every Bakabooru tag by normalized name. Names are interned and entries are
+    bare (id, category id) tuples rather than `ManagedTag` objects, which keeps
+    a catalogue of hundreds of thousands of tags small. The server stores tag
+    names normalized, so the key doubles as the name.
+    """
+
+    def __init__(self, rows: Iterable[tuple[str, int, int | None]] = ()) -> None:
+        self._entries: dict[str, tuple[int, int | None]] = {
+            sys.intern(name): (tag_id, category_id) for name, tag_id, category_id in rows
+        }
+        # Loaded from a `TagSnapshot`: entries may carry names renamed since.
+        self.from_snapshot = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> ManagedTag | None:
+        entry = self._entries.get(key)
+        return ManagedTag(id=entry[0], name=key, category_id=entry[1]) if entry else None
+
+    def add(self, tag: ManagedTag) -> None:
+        self._entries[sys.intern(normalize_name(tag.name))] = (tag.id, tag.category_id)
+
+    def rows(self) -> Iterator[tuple[str, int, int | None]]:
+        for name, (tag_id, category_id) in self._entries.items():
+            yield name, tag_id, category_id
+
+    def matches(self, total: int, categories: Iterable[ManagedCategory]) -> bool:
+        """
+        Cheap staleness check against the server: same tag count, and the same
+        number of tags in every category (catches creations, deletions and
+        re-categorizations without listing the tags).
+        """
+        expected = Counter({c.id: c.tag_count for c in categories if c.tag_count})
+        uncategorized = total - sum(expected.values())
+        if uncategorized:
+            expected[None] = uncategorized
+        actual = Counter(category_id for _, category_id in self._entries.values())
+        return len(self._entries) == total and actual == expected
+
+    def covers(self, tags: Iterable[ManagedTag]) -> bool:
+        """Whether every tag in `tags` is here with the same id and category (spots renames among them)."""
+        return all(self._entries.get(normalize_name(tag.name)) == (tag.id, tag.category_id) for tag in tags)
+
+
+def load_tag_catalogue(
+    baka: BakabooruClient,
+    categories: Iterable[ManagedCategory],
+    snapshot: TagSnapshot | None = None,
+    workers: int = TAG_CATALOGUE_WORKERS,
+) -> TagCatalogue:
+    """
+    Reuse `snapshot` when it still matches the server (counts, and the first
+    page of busiest tags); otherwise fetch the catalogue and store the result
+    in the snapshot.
+
+    The server lists tags by usage, so pages fetched by offset shift when
+    usage changes mid-fetch, dropping or repeating tags. A fetch only counts
+    when it holds exactly `totalCount` tags, both before and after; otherwise
+    it is repeated, and after `TAG_CATALOGUE_ATTEMPTS` used for this run
+    without being saved.
+    """
+    started = time.monotonic()
+    first = baka.get_tags_page(1, TAG_PAGE_SIZE)
+    total = read_page_total(first)
+    if snapshot is not None and total is not None:
+        cached = snapshot.load()
+        if cached.matches(total, categories) and cached.covers(parse_tag_page(first)):
+            print(f"[tags] {len(cached)} tags from snapshot {snapshot.path}")
+            cached.from_snapshot = True
+            return cached
+        if len(cached):
+            print(f"[tags] snapshot is stale ({len(cached)} tags, server has {total}); reloading")
+
+    attempt = 1
+    while True:
+        catalogue, pages = fetch_tag_catalogue(baka, first, total, workers)
+        if total is None:
+            break
+        first = baka.get_tags_page(1, TAG_PAGE_SIZE)
+        settled = read_page_total(first)
+        if len(catalogue) == total == settled:
+            break
+        if attempt == TAG_CATALOGUE_ATTEMPTS:
+            print(f"[tags] listing kept changing ({len(catalogue)} tags fetched, server has {settled}); not saving a snapshot")
+            return catalogue
+        print(f"[tags] listing changed while fetching ({len(catalogue)} tags fetched, server has {settled}); fetching again")
+        total = settled
+        attempt += 1
+
+    print(f"[tags] fetched {len(catalogue)} tags in {pages} pages ({time.monotonic() - started:.1f}s)")
+    if snapshot is not None:
+        snapshot.save(catalogue)
+    return catalogue
+
+
+def fetch_tag_catalogue(
+    baka: BakabooruClient,
+    first: dict[str, Any],
+    total: int | None,
+    workers: int,
+) -> tuple[TagCatalogue, int]:
+    """One pass over `/tags` from an already fetched first page, `total` deciding how many pages run in parallel."""
+    catalogue = TagCatalogue()
+    items = parse_tag_page(first)
+    for tag in items:
+        catalogue.add(tag)
+    page_count = -(-total // TAG_PAGE_SIZE) if total is not None else 1
+    if page_count > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tags") as executor:
+            for items in executor.map(
+                lambda page: parse_tag_page(baka.get_tags_page(page, TAG_PAGE_SIZE)),
+                range(2, page_count + 1),
+            ):
+                for tag in items:
+                    catalogue.add(tag)
+    # Tags created while paging (or a server without totalCount) spill past the counted pages.
+    page = page_count
+    while len(items) == TAG_PAGE_SIZE:
+        page += 1
+        items = parse_tag_page(baka.get_tags_page(page, TAG_PAGE_SIZE))
+        for tag in items:
+            catalogue.add(tag)
+    return catalogue, page
+
+
+class Migrator:
+    """
+    Write side of the migration: mirrors Oxibooru categories and tags into
+    Bakabooru and merges them onto posts.
+
+    With a `shard`, several processes migrate concurrently. Bakabooru does not
+    enforce unique category names, so only shard 0 creates categories (all of
+    Oxibooru's, up front) and the others wait for them to appear. Tag names
+    are unique server-side, so a shard that loses a creation race adopts the
+    winner's tag instead.
+
+    Only Oxibooru's category table is needed (`oxi_categories`), so a plan can
+    be applied without contacting Oxibooru.
+    """
+
+    # How long a non-owning shard waits for shard 0 to create a category.
+    CATEGORY_WAIT = 120.0
+    CATEGORY_POLL_INTERVAL = 2.0
+
+    def __init__(
+        self,
+        baka: BakabooruClient,
+        oxi_categories: dict[str, dict[str, Any]],
+        dry_run: bool = False,
+        legacy_writes: bool = False,
+        shard: tuple[int, int] | None = None,
+        tag_snapshot: TagSnapshot | None = None,
+    ) -> None:
+        self.baka = baka
+        self.dry_run = dry_run
+        self.legacy_writes = legacy_writes
+        self.shard = shard
+        self.owns_categories = shard is None or shard[0] == 0
+
+        self.oxi_categories = oxi_categories
+        self.categories_by_name: dict[str, ManagedCategory] = {
+            normalize_name(c.name): c for c in self.baka.get_categories()
+        }
+        if shard is not None and self.owns_categories:
+            self.prepare_categories()
+        self.tag_snapshot = tag_snapshot
+        self.tags_by_name = load_tag_catalogue(self.baka, self.categories_by_name.values(), tag_snapshot)
+
+    def prepare_categories(self) -> None:
+        """Create every Oxibooru category up front, so shards waiting on the owner are not held up."""
+        for _key, source in sorted(self.oxi_categories.items(), key=lambda item: (item[1]["order"], item[0])):
+            self.ensure_category(source["name"])
+
+    def _wait_for_category(self, key: str) -> ManagedCategory | None:
+        print(f"[category] waiting for shard 0 to create '{key}'")
+        deadline = time.monotonic() + self.CATEGORY_WAIT
+        while True:
+            for category in self.baka.get_categories():
+                self.categories_by_name.setdefault(normalize_name(category.name), category)
+            found = self.categories_by_name.get(key)
+            if found is not None or time.monotonic() >= deadline:
+                return found
+            time.sleep(self.CATEGORY_POLL_INTERVAL)
+
+    def ensure_category(self, category_name: str | None) -> int | None:
+        if not category_name or not category_name.strip():
+            return None
+
+        key = normalize_name(category_name)
+        existing = self.categories_by_name.get(key)
+        if existing:
+            return existing.id
+
+        if not self.owns_categories and not self.dry_run:
+            existing = self._wait_for_category(key)
+            if existing:
+                return existing.id
+            print(f"[category] '{category_name}' not created by the owning shard in time; creating categories here")
+            # Shard 0 is evidently not running; don't stall on every other category too.
+            self.owns_categories = True
+
+        created = self._new_category(category_name)
+        if created is None:
+            return None
+        self.categories_by_name[key] = created
+        return created.id
+
+    def _new_category(self, category_name: str) -> ManagedCategory | None:
+        """Create a category styled like its Oxibooru counterpart. Touches no shared state."""
+        source = self.oxi_categories.get(normalize_name(category_name), {})
+        color = str(source.get("color") or "#808080")
+        order = int(source.get("order") or 0)
+        display_name = str(source.get("name") or category_name).strip()
+
+        if self.dry_run:
+            print(f"[dry-run] create category: name='{display_name}', color='{color}', order={order}")
+            return None
+
+        created = self.baka.create_category(display_name, color, order)
+        print(f"[category] created '{created.name}' (id={created.id})")
+        return created
+
+    def category_id(self, category_name: str | None) -> int | None:
+        """Id of an already known category (None when missing, e.g. in a dry run)."""
+        if not category_name or not category_name.strip():
+            return None
+        existing = self.categories_by_name.get(normalize_name(category_name))
+        return existing.id if existing else None
+
+    def ensure_tag(self, tag_name: str, category_id: int | None) -> ManagedTag | None:
+        key = normalize_name(tag_name)
+        existing = self.tags_by_name.get(key)
+        if existing and existing.category_id == category_id:
+            return existing
+
+        tag = self._sync_tag(tag_name, category_id, existing)
+        if tag is not None:
+            self._remember(tag)
+        return tag
+
+    def _remember(self, tag: ManagedTag) -> None:
+        self.tags_by_name.add(tag)
+        if self.tag_snapshot is not None:
+            self.tag_snapshot.put(tag)
+
+    def _sync_tag(self, tag_name: str, category_id: int | None, existing: ManagedTag | None) -> ManagedTag | None:
+        """
+        Create `tag_name`, or move `existing` into `category_id`. Touches no
+        shared state, so `prepare_tags` can run it from worker threads.
+        """
+        if existing is not None and self.tags_by_name.from_snapshot:
+            # A snapshot entry may be a tag renamed since; never move one by a stale id.
+            existing = self.baka.find_tag(tag_name)
+            if existing is not None and existing.category_id == category_id:
+                return existing
+
+        if existing is None:
+            if self.dry_run:
+                print(f"[dry-run] create tag: '{tag_name}' categoryId={category_id}")
+                return None
+
+            if self.shard is not None:
+                # Another shard may have created it since our catalogue was loaded;
+                # a lookup is cheaper than a conflicting create.
+                existing = self.baka.find_tag(tag_name)
+
+        if existing is None:
+            try:
+                created = self.baka.create_tag(tag_name, category_id)
+            except HttpError as exc:
+                # 409, or a unique-index violation surfacing as 5xx, when another
+                # process created the tag since our catalogue was loaded.
+                if exc.status != 409 and exc.status < 500:
+                    raise
+                existing = self.baka.find_tag(tag_name)
+                if existing is None:
+                    raise
+                print(f"[tag] '{existing.name}' (id={existing.id}) was created concurrently; reusing it")
+            else:
+                print(f"[tag] created '{created.name}' (id={created.id}) category={created.category_id}")
+                return created
+
+        if existing.category_id == category_id:
+            return existing
+        if self.dry_run:
+            print(
+                f"[dry-run] update tag category: '{existing.name}' "
+                f"{existing.category_id} -> {category_id}"
+            )
+            return existing
+
+        updated = self.baka.update_tag(existing.id, existing.name, category_id)
+        print(f"[tag] updated '{updated.name}' (id={updated.id}) category={updated.category_id}")
+        return updated
+
+    def prepare_tags(self, tags: dict[str, str | None], executor: ThreadPoolExecutor) -> set[str]:
+        """
+        Create every missing category and tag in `tags` (normalized tag name ->
+        Oxibooru category name) and fix stale tag categories, fanned out over
+        `executor`, so that the per-post writes afterwards need no tag requests.
+
+        Returns the names of tags that could not be created or updated.
+        """
+        missing_categories = {
+            normalize_name(name): name
+            for name in tags.values()
+            if name and name.strip() and normalize_name(name) not in self.categories_by_name
+        }
+        for key, created in zip(missing_categories, executor.map(self._new_category, missing_categories.values())):
+            if created is not None:
+                self.categories_by_name[key] = created
+
+        futures: dict[Future, str] = {}
+        for name, category_name in tags.items():
+            category_id = self.category_id(category_name)
+            existing = self.tags_by_name.get(name)
+            if existing is None or existing.category_id != category_id:
+                futures[executor.submit(self._sync_tag, name, category_id, existing)] = name
+
+        failed: set[str] = set()
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                tag = future.result()
+            except Exception as exc:
+                failed.add(name)
+                print(f"[error] tag '{name}': {exc}", file=sys.stderr)
+                continue
+            if tag is not None:
+                self._remember(tag)
+        return failed
+
+    def migrate_post(
+        self,
+        post_id: int,
+        post_tags: list[dict[str, Any]],
+        oxi_post: dict[str, Any],
+    ) -> tuple[int, list[str], int, list[str]]:
+        """
+        Copy tags and sources of a matched Oxibooru post onto a Bakabooru post.
+
+        Returns (discovered tag count, tags added, discovered source count, sources added).
+        """
+        oxi_tags = oxi_post.get("tags") or []
+        if self.legacy_writes:
+            discovered_tags, added_tags = self.migrate_post_tags(post_id, post_tags, oxi_tags)
+            discovered_sources, added_sources = self.migrate_post_sources(post_id, oxi_post)
+            return discovered_tags, added_tags, discovered_sources, added_sources
+        return self.migrate_post_metadata(post_id, oxi_post)
+
+    def migrate_post_metadata(
+        self,
+        post_id: int,
+        oxi_post: dict[str, Any],
+    ) -> tuple[int, list[str], int, list[str]]:
+        """
+        Merge Oxibooru tags and sources into the post locally and write them
+        with a single `PUT /posts/{id}` (one server transaction), instead of
+        one request per tag plus a sources round trip.
+
+        The post is read first because the listing carries no tags/sources and
+        the update replaces the full tag set, so existing links (any source)
+        must be sent back unchanged.
+        """
+        oxi_tags = extract_oxibooru_tags(oxi_post.get("tags") or [])
+        oxi_sources = extract_oxibooru_sources(oxi_post)
+        for tag_name, category_name in oxi_tags:
+            self.ensure_tag(tag_name, self.ensure_category(category_name))
+        return self.write_post_metadata(post_id, oxi_tags, oxi_sources)
+
+    def write_post_metadata(
+        self,
+        post_id: int,
+        oxi_tags: list[tuple[str, str | None]],
+        oxi_sources: list[str],
+    ) -> tuple[int, list[str], int, list[str]]:
+        """
+        Merge already existing tags and the sources into the post. Touches no
+        shared state, so planned posts can be written from worker threads.
+        """
+        if not oxi_tags and not oxi_sources:
+            return 0, [], 0, []
+
+        current = self.baka.get_post(post_id)
+        current_links = [
+            {"name": str(t.get("name", "")), "source": int(t.get("source") or POST_TAG_SOURCE_MANUAL)}
+            for t in current.get("tags") or []
+            if str(t.get("name", "")).strip()
+        ]
+        manual_names = {
+            normalize_name(link["name"]) for link in current_links if link["source"] == POST_TAG_SOURCE_MANUAL
+        }
+        tags_to_add = [name for name, _ in oxi_tags if name not in manual_names]
+
+        current_sources = [str(x).strip() for x in current.get("sources") or [] if str(x).strip()]
+        current_lookup = set(current_sources)
+        sources_to_add = [x for x in oxi_sources if x.strip() not in current_lookup]
+
+        if not tags_to_add and not sources_to_add:
+            return len(oxi_tags), [], len(oxi_sources), []
+
+        if self.dry_run:
+            for tag_name in tags_to_add:
+                print(f"[dry-run] add tag '{tag_name}' to post {post_id}")
+            for source in sources_to_add:
+                print(f"[dry-run] add source to post {post_id}: {source}")
+            return len(oxi_tags), tags_to_add, len(oxi_sources), sources_to_add
+
+        self.baka.update_post_metadata(
+            post_id,
+            tags_with_sources=(
+                current_links + [{"name": name, "source": POST_TAG_SOURCE_MANUAL} for name in tags_to_add]
+                if tags_to_add
+                else None
+            ),
+            sources=(current_sources + sources_to_add) if sources_to_add else None,
+        )
+        for tag_name in tags_to_add:
+            print(f"[post:{post_id}] +tag '{tag_name}'")
+        for source in sources_to_add:
+            print(f"[post:{post_id}] +source '{source}'")
+        return len(oxi_tags), tags_to_add, len(oxi_sources), sources_to_add
+
+    def migrate_post_tags(
+        self,
+        post_id: int,
+        post_tags: list[dict[str, Any]],
+        oxi_tags: list[dict[str, Any]],
+    ) -> tuple[int, list[str]]:
+        """Returns (discovered tag count, names of tags added to the post)."""
+        current_post_tags = {
+            normalize_name(str(t.get("name", "")))
+            for t in post_tags
+            if str(t.get("name", "")).strip()
+        }
+
+        added_tags: list[str] = []
+        discovered_count = 0
+
+        for canonical_name, category_name in extract_oxibooru_tags(oxi_tags):
+            discovered_count += 1
+            category_id = self.ensure_category(category_name)
+            self.ensure_tag(canonical_name, category_id)
+
+            if canonical_name in current_post_tags:
+                continue
+
+            if self.dry_run:
+                print(f"[dry-run] add tag '{canonical_name}' to post {post_id}")
+                added_tags.append(canonical_name)
+                current_post_tags.add(canonical_name)
+                continue
+
+            added, status = self.baka.add_tag_to_post(post_id, canonical_name)
+            if added:
+                print(f"[post:{post_id}] +tag '{canonical_name}'")
+                added_tags.append(canonical_name)
+                current_post_tags.add(canonical_name)
+            elif status == 409:
+                current_post_tags.add(canonical_name)
+
+        return discovered_count, added_tags
+
+    def migrate_post_sources(self, post_id: int, oxi_post: dict[str, Any]) -> tuple[int, list[str]]:
+        """Returns (discovered source count, sources added to the post)."""
+        oxi_sources = extract_oxibooru_sources(oxi_post)
+        discovered_count = len(oxi_sources)
+        if discovered_count == 0:
+            return 0, []
+
+        current_sources = self.baka.get_post_sources(post_id)
+        current_lookup = {s.strip() for s in current_sources}
+        to_add = [s for s in oxi_sources if s.strip() not in current_lookup]
+        if not to_add:
+            return discovered_count, []
+
+        if self.dry_run:
+            for source in to_add:
+                print(f"[dry-run] add source to post {post_id}: {source}")
+            return discovered_count, to_add
+
+        merged_sources = current_sources + to_add
+        self.baka.set_post_sources(post_id, merged_sources)
+        for source in to_add:
+            print(f"[post:{post_id}] +source '{source}'")
+        return discovered_count, to_add
+
+
+def extract_oxibooru_tags(oxi_tags: list[dict[str, Any]]) -> list[tuple[str, str | None]]:
+    """
+    Normalized (canonical tag name, category name) pairs of an Oxibooru post,
+    deduplicated in input order. The first alias is the canonical name.
+    """
+    result: list[tuple[str, str | None]] = []
+    seen: set[str] = set()
+    for oxi_tag in oxi_tags:
+        names = oxi_tag.get("names") or []
+        if not isinstance(names, list) or not names:
+            continue
+
+        canonical_name = str(names[0]).strip()
+        if not canonical_name:
+            continue
+
+        canonical_name = normalize_name(canonical_name)
+        if canonical_name in seen:
+            continue
+        seen.add(canonical_name)
+
+        category_name = oxi_tag.get("category")
+        result.append((canonical_name, str(category_name) if category_name else None))
+    return result
+
+
+def extract_oxibooru_sources(oxi_post: dict[str, Any]) -> list[str]:
+    """
+    Oxibooru post has a single `source` field, but we normalize into list and
+    support multi-line values.
+    """
+    raw = oxi_post.get("source")
+    if raw is None:
+        return []
+
+    if isinstance(raw, str):
+        candidates = raw.splitlines()
+    elif isinstance(raw, list):
+        candidates = [x for x in raw if isinstance(x, str)]
+    else:
+        return []
+
+    result: list[str] = []
+    seen: set[str] = set()
+    for item in candidates:
+        value = item.strip()
+        if not value:
+            continue
+        key = value.lower()
+        if key in seen:
+            continue
+        seen.add(key)
+        result.append(value)
+    return result
+
+
+# Shards may share the journal and caches; wait for another process's write
+# instead of failing with "database is locked".
+SQLITE_BUSY_TIMEOUT = 30.0
+
+
+class MigrationJournal:
+    """
+    SQLite checkpoint of per-post outcomes, keyed by post id and content hash.
+
+    Completed posts (anything but "failed") are loaded into memory on open so
+    a rerun can skip them with a dict lookup; failures and posts whose content
+    hash changed are processed again. Writes are committed in batches and on
+    `close()`.
+    """
+
+    COMPLETED_OUTCOMES = ("exact", "similar", "none", "too_far")
+
+    def __init__(self, path: str, commit_every: int = 200, commit_interval: float = 5.0) -> None:
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.connection = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS post_outcomes (
+                post_id INTEGER PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                outcome TEXT NOT NULL,
+                distance REAL,
+                tags TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                error TEXT,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        self.connection.execute("CREATE TABLE IF NOT EXISTS run_state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.connection.commit()
+
+        self.completed: dict[int, str] = {}
+        placeholders = ",".join("?" for _ in self.COMPLETED_OUTCOMES)
+        for post_id, content_hash in self.connection.execute(
+            f"SELECT post_id, content_hash FROM post_outcomes WHERE outcome IN ({placeholders})",
+            self.COMPLETED_OUTCOMES,
+        ):
+            self.completed[int(post_id)] = str(content_hash)
+
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def is_completed(self, post_id: int, content_hash: str) -> bool:
+        return self.completed.get(post_id) == content_hash
+
+    def record(
+        self,
+        post_id: int,
+        content_hash: str,
+        outcome: str,
+        distance: float | None = None,
+        tags: list[str] | None = None,
+        sources: list[str] | None = None,
+        error: str | None = None,
+    ) -> None:
+        self.connection.execute(
+            """
+            INSERT OR REPLACE INTO post_outcomes
+                (post_id, content_hash, outcome, distance, tags, sources, error, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
+            """,
+            (
+                post_id,
+                content_hash,
+                outcome,
+                distance,
+                json.dumps(tags or []),
+                json.dumps(sources or []),
+                error,
+            ),
+        )
+        if outcome in self.COMPLETED_OUTCOMES:
+            self.completed[post_id] = content_hash
+        else:
+            self.completed.pop(post_id, None)
+
+        self._uncommitted += 1
+        if (
+            self._uncommitted >= self.commit_every
+            or time.monotonic() - self._last_commit >= self.commit_interval
+        ):
+            self.flush()
+
+    def get_state(self, key: str) -> str | None:
+        row = self.connection.execute("SELECT value FROM run_state WHERE key = ?", (key,)).fetchone()
+        return str(row[0]) if row is not None else None
+
+    def set_state(self, key: str, value: str) -> None:
+        """Store a resume marker (e.g. the `--follow` watermark), committed together with pending outcomes."""
+        self.connection.execute("INSERT OR REPLACE INTO run_state (key, value) VALUES (?, ?)", (key, value))
+        self.flush()
+
+    def flush(self) -> None:
+        self.connection.commit()
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
+
+
+@dataclass
+class PlannedPost:
+    post_id: int
+    content_hash: str
+    match_kind: str
+    distance: float | None
+    oxibooru_post_id: int | None
+    # Everything the Oxibooru post carries; add_* is what the plan run found missing.
+    tags: list[tuple[str, str | None]]
+    sources: list[str]
+    add_tags: list[str]
+    add_sources: list[str]
+
+
+def parse_planned_post(item: dict[str, Any]) -> PlannedPost:
+    return PlannedPost(
+        post_id=int(item["post_id"]),
+        content_hash=str(item.get("content_hash") or ""),
+        match_kind=str(item["match"]),
+        distance=float(item["distance"]) if item.get("distance") is not None else None,
+        oxibooru_post_id=int(item["oxibooru_post_id"]) if item.get("oxibooru_post_id") is not None else None,
+        tags=[(str(name), str(category) if category else None) for name, category in item.get("tags") or []],
+        sources=[str(x) for x in item.get("sources") or []],
+        add_tags=[str(x) for x in item.get("add_tags") or []],
+        add_sources=[str(x) for x in item.get("add_sources") or []],
+    )
+
+
+class MigrationPlan:
+    """
+    JSON Lines record of a `--plan` run: Oxibooru's category table, then one
+    line per decided post with its match and the tags/sources it implies.
+    `--apply` replays it without contacting Oxibooru or downloading anything.
+    Plans of several shards can be concatenated into one file.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")
+
+    def _write(self, item: dict[str, Any]) -> None:
+        self.file.write(json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def write_categories(self, categories: dict[str, dict[str, Any]]) -> None:
+        self._write({"type": "categories", "version": self.VERSION, "categories": categories})
+
+    def record(self, match: PostMatch, applied: tuple[list[str], list[str]]) -> None:
+        oxi_post = match.matched_post or {}
+        tags, sources = applied
+        self._write(
+            {
+                "type": "post",
+                "post_id": match.post_id,
+                "content_hash": match.content_hash,
+                "match": match.match_kind,
+                "distance": match.distance,
+                "oxibooru_post_id": oxi_post.get("id"),
+                "tags": extract_oxibooru_tags(oxi_post.get("tags") or []) if match.matched_post else [],
+                "sources": extract_oxibooru_sources(oxi_post) if match.matched_post else [],
+                "add_tags": tags,
+                "add_sources": sources,
+            }
+        )
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_plan(path: str) -> Iterator[dict[str, Any]]:
+    with open(path, encoding="utf-8") as handle:
+        for line_number, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as exc:
+                raise RuntimeError(f"{path}:{line_number}: invalid plan line ({exc})") from None
+            if item.get("type") == "categories" and item.get("version") != MigrationPlan.VERSION:
+                raise RuntimeError(f"{path}:{line_number}: unsupported plan version {item.get('version')}")
+            yield item
+
+
+def scan_plan(path: str) -> tuple[dict[str, dict[str, Any]], dict[str, str | None], int]:
+    """First pass over a plan: (Oxibooru categories, tag name -> category name, planned post count)."""
+    categories: dict[str, dict[str, Any]] = {}
+    tags: dict[str, str | None] = {}
+    posts = 0
+    for item in read_plan(path):
+        if item.get("type") == "categories":
+            categories.update(item.get("categories") or {})
+        elif item.get("type") == "post":
+            posts += 1
+            for name, category in item.get("tags") or []:
+                tags[str(name)] = str(category) if category else None
+    return categories, tags, posts
+
+
+class ReverseSearchCache:
+    """
+    On-disk cache of `select_reverse_search_match` results keyed by Bakabooru
+    content hash, so duplicate files and reruns skip the download and upload.
+
+    Positive results ("exact"/"similar") are kept until evicted. Negative
+    results ("none"/"too_far") expire after `negative_ttl` seconds so posts
+    added to Oxibooru later are eventually found. The table is bounded to
+    `max_entries` rows with least-recently-used eviction. Entries that depend
+    on the similarity threshold are dropped when `max_similar_distance`
+    differs from the value the cache was filled with.
+    """
+
+    NEGATIVE_KINDS = ("none", "too_far")
+    THRESHOLD_KINDS = ("similar", "too_far")
+
+    def __init__(
+        self,
+        path: str,
+        max_similar_distance: float,
+        negative_ttl: float,
+        max_entries: int,
+        commit_interval: float = 5.0,
+    ) -> None:
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.commit_interval = commit_interval
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS matches (
+                content_hash TEXT PRIMARY KEY,
+                match_kind TEXT NOT NULL,
+                distance REAL,
+                matched_post TEXT,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ix_matches_last_used ON matches (last_used)")
+
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'max_similar_distance'").fetchone()
+        if row is not None and float(row[0]) != max_similar_distance:
+            placeholders = ",".join("?" for _ in self.THRESHOLD_KINDS)
+            dropped = self.connection.execute(
+                f"DELETE FROM matches WHERE match_kind IN ({placeholders})",
+                self.THRESHOLD_KINDS,
+            ).rowcount
+            print(
+                f"[cache] --max-similar-distance changed ({row[0]} -> {max_similar_distance}); "
+                f"dropped {dropped} threshold-dependent entries"
+            )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('max_similar_distance', ?)",
+            (repr(max_similar_distance),),
+        )
+        self.connection.commit()
+
+        self.entry_count = int(self.connection.execute("SELECT COUNT(*) FROM matches").fetchone()[0])
+        if self.entry_count > self.max_entries:
+            self._evict()
+            self.connection.commit()
+        self._last_commit = time.monotonic()
+
+    def clear(self) -> None:
+        with self._lock:
+            self.connection.execute("DELETE FROM matches")
+            self.connection.commit()
+            self.entry_count = 0
+
+    def get(self, content_hash: str) -> tuple[dict[str, Any] | None, str, float | None] | None:
+        if not content_hash:
+            return None
+
+        now = time.time()
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT match_kind, distance, matched_post, created_at FROM matches WHERE content_hash = ?",
+                (content_hash,),
+            ).fetchone()
+            if row is None:
+                return None
+
+            match_kind, distance, matched_post, created_at = row
+            if match_kind in self.NEGATIVE_KINDS and now - float(created_at) > self.negative_ttl:
+                self.connection.execute("DELETE FROM matches WHERE content_hash = ?", (content_hash,))
+                self.entry_count -= 1
+                self._maybe_commit()
+                return None
+
+            self.connection.execute("UPDATE matches SET last_used = ? WHERE content_hash = ?", (now, content_hash))
+            self._maybe_commit()
+
+        post = json.loads(matched_post) if matched_post else None
+        return post, str(match_kind), (float(distance) if distance is not None else None)
+
+    def put(
+        self,
+        content_hash: str,
+        matched_post: dict[str, Any] | None,
+        match_kind: str,
+        distance: float | None,
+    ) -> None:
+        if not content_hash:
+            return
+        if match_kind in self.NEGATIVE_KINDS and self.negative_ttl <= 0:
+            return
+
+        now = time.time()
+        with self._lock:
+            exists = self.connection.execute(
+                "SELECT 1 FROM matches WHERE content_hash = ?",
+                (content_hash,),
+            ).fetchone()
+            self.connection.execute(
+                """
+                INSERT OR REPLACE INTO matches (content_hash, match_kind, distance, matched_post, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    content_hash,
+                    match_kind,
+                    distance,
+                    json.dumps(matched_post) if matched_post is not None else None,
+                    now,
+                    now,
+                ),
+            )
+            if exists is None:
+                self.entry_count += 1
+            if self.entry_count > self.max_entries:
+                self._evict()
+            self._maybe_commit()
+
+    def _evict(self) -> None:
+        # Trim to 90% so eviction runs once per batch of inserts, not per insert.
+        target = int(self.max_entries * 0.9)
+        self.connection.execute(
+            """
+            DELETE FROM matches WHERE content_hash IN (
+                SELECT content_hash FROM matches ORDER BY last_used ASC LIMIT ?
+            )
+            """,
+            (max(0, self.entry_count - target),),
+        )
+        self.entry_count = int(self.connection.execute("SELECT COUNT(*) FROM matches").fetchone()[0])
+
+    def _maybe_commit(self) -> None:
+        if time.monotonic() - self._last_commit >= self.commit_interval:
+            self.connection.commit()
+            self._last_commit = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+class OxibooruChecksumIndex:
+    """
+    Local copy of Oxibooru's checksum -> post mapping, holding only what the
+    migration needs (id, tags, source), so exact matches resolve with a SHA-1
+    lookup instead of a reverse-search upload.
+
+    `refresh` only fetches posts with ids above the highest one indexed, so
+    tag edits on already indexed Oxibooru posts need `rebuild` to show up.
+    """
+
+    FIELDS = "id,checksum,tags,source"
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS posts (
+                checksum BLOB PRIMARY KEY,
+                post_id INTEGER NOT NULL,
+                post TEXT NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ix_posts_post_id ON posts (post_id)")
+        self.connection.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self.connection.execute("SELECT COUNT(*) FROM posts").fetchone()[0])
+
+    def rebuild(self) -> None:
+        with self._lock:
+            self.connection.execute("DELETE FROM posts")
+            self.connection.commit()
+
+    def refresh(self, oxi: OxibooruClient, page_size: int = OXIBOORU_INDEX_PAGE_SIZE) -> int:
+        """Fetch Oxibooru posts newer than the index by id cursor; returns how many were added."""
+        with self._lock:
+            after_id = int(self.connection.execute("SELECT COALESCE(MAX(post_id), 0) FROM posts").fetchone()[0])
+
+        added = 0
+        while True:
+            posts = oxi.list_posts(f"id:{after_id + 1}.. sort:id,asc", 0, page_size, self.FIELDS)
+            rows: list[tuple[bytes, int, str]] = []
+            for post in posts:
+                try:
+                    checksum = bytes.fromhex(str(post.get("checksum") or ""))
+                except ValueError:
+                    continue
+                if not checksum:
+                    continue
+                entry = {"id": post.get("id"), "tags": post.get("tags") or [], "source": post.get("source")}
+                rows.append((checksum, int(post["id"]), json.dumps(entry, separators=(",", ":"))))
+
+            with self._lock:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO posts (checksum, post_id, post) VALUES (?, ?, ?)",
+                    rows,
+                )
+                self.connection.commit()
+            added += len(rows)
+
+            if posts:
+                after_id = max(after_id, max(int(post["id"]) for post in posts))
+            print(f"[index] fetched {len(posts)} Oxibooru posts (up to id {after_id})")
+            if len(posts) < page_size:
+                return added
+
+    def get(self, checksum: bytes) -> dict[str, Any] | None:
+        with self._lock:
+            row = self.connection.execute("SELECT post FROM posts WHERE checksum = ?", (checksum,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+
+class TagSnapshot:
+    """
+    On-disk copy of the Bakabooru tag catalogue, reused at startup for as long
+    as `TagCatalogue.matches` the server. Tags the run creates or moves to
+    another category are written back, so the snapshot stays current across
+    runs (and across shards sharing the file).
+    """
+
+    def __init__(self, path: str, commit_every: int = 200) -> None:
+        self.path = path
+        self.commit_every = commit_every
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self.connection = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tags (
+                name TEXT PRIMARY KEY,
+                tag_id INTEGER NOT NULL,
+                category_id INTEGER
+            ) WITHOUT ROWID
+            """
+        )
+        self.connection.commit()
+
+    def load(self) -> TagCatalogue:
+        with self._lock:
+            return TagCatalogue(self.connection.execute("SELECT name, tag_id, category_id FROM tags"))
+
+    def save(self, catalogue: TagCatalogue) -> None:
+        with self._lock:
+            self.connection.execute("DELETE FROM tags")
+            self.connection.executemany(
+                "INSERT INTO tags (name, tag_id, category_id) VALUES (?, ?, ?)",
+                catalogue.rows(),
+            )
+            self.connection.commit()
+            self._uncommitted = 0
+
+    def put(self, tag: ManagedTag) -> None:
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tags (name, tag_id, category_id) VALUES (?, ?, ?)",
+                (normalize_name(tag.name), tag.id, tag.category_id),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self.connection.commit()
+                self._uncommitted = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+class Histogram:
+    """Latency histogram (seconds) with geometric buckets from 1 ms to ~2 min, as Prometheus exports them."""
+
+    BUCKETS = tuple(round(0.001 * 1.5**power, 6) for power in range(30)) + (float("inf"),)
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate by linear interpolation inside the bucket, like PromQL's
+        `histogram_quantile`, narrowed to the observed min/max.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.BUCKETS, self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                low, high = max(lower, self.min), min(bound, self.max)
+                return low + (high - low) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = bound
+        return self.max
+
+    def merge(self, other: Histogram) -> None:
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @classmethod
+    def from_dict(cls, payload: dict[str, Any]) -> Histogram:
+        histogram = cls()
+        counts = [int(value) for value in payload["counts"]]
+        if len(counts) != len(cls.BUCKETS):
+            raise RuntimeError("Histogram buckets in the report do not match this version.")
+        histogram.counts = counts
+        histogram.count = sum(counts)
+        histogram.total = float(payload["sum"])
+        histogram.min = float(payload.get("min", 0.0))
+        histogram.max = float(payload["max"])
+        return histogram
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "min": round(self.min, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+            # Per bucket (last one unbounded), so shard reports can be merged exactly.
+            "counts": list(self.counts),
+        }
+
+
+class Metrics:
+    """
+    Run-wide counters, per-stage latency histograms, per-remote request and
+    byte counts, and gauges (callables sampled on read, e.g. adaptive
+    limits). Safe to update from worker threads and the event loop.
+
+    Stages: list, download, thumbnail, hash, jxl_decode, downscale,
+    reverse_search, write.
+    """
+
+    def __init__(self, max_posts: int | None = None) -> None:
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.fixed_elapsed: float | None = None
+        self.max_posts = max_posts
+        self.counters: dict[str, int] = {}
+        self.stages: dict[str, Histogram] = {}
+        self.requests: dict[str, int] = {}
+        self.transfer: dict[tuple[str, str], int] = {}
+        self.gauges: dict[str, Callable[[], float]] = {}
+        self.total_posts: int | None = None
+        self.tracer: TraceRecorder | None = None
+
+    def inc(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self.counters.get(name, 0)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            finished = time.monotonic()
+            self.observe(stage, finished - started)
+            if self.tracer is not None:
+                self.tracer.span(stage, "stage", started, finished)
+
+    def span(self, name: str, category: str) -> Any:
+        """Trace-only span (no histogram); free when tracing is off."""
+        if self.tracer is None:
+            return nullcontext()
+        return self.tracer.timed(name, category)
+
+    def record_request(self, remote: str, sent: int, received: int) -> None:
+        with self._lock:
+            self.requests[remote] = self.requests.get(remote, 0) + 1
+            for direction, amount in (("out", sent), ("in", received)):
+                key = (remote, direction)
+                self.transfer[key] = self.transfer.get(key, 0) + amount
+
+    def set_total(self, total: int | None) -> None:
+        """Posts the run expects to scan (the listing's total, capped by `--max-posts`)."""
+        if total is not None and self.max_posts is not None:
+            total = min(total, self.max_posts)
+        self.total_posts = total
+
+    def register_gauge(self, name: str, read: Callable[[], float]) -> None:
+        self.gauges[name] = read
+
+    def elapsed(self) -> float:
+        if self.fixed_elapsed is not None:
+            return self.fixed_elapsed
+        return time.monotonic() - self.started
+
+    @classmethod
+    def from_report(cls, report: dict[str, Any]) -> Metrics:
+        """Rebuild a finished run from its `report()` (gauges are not restored)."""
+        metrics = cls()
+        metrics.fixed_elapsed = float(report["elapsed_seconds"])
+        metrics.total_posts = report.get("total_posts")
+        metrics.counters = {name: int(value) for name, value in report.get("counters", {}).items()}
+        metrics.stages = {name: Histogram.from_dict(data) for name, data in report.get("stages", {}).items()}
+        metrics.requests = {remote: int(value) for remote, value in report.get("requests", {}).items()}
+        for key, amount in report.get("bytes", {}).items():
+            remote, _, direction = key.rpartition("_")
+            metrics.transfer[(remote, direction)] = int(amount)
+        return metrics
+
+    def merge(self, other: Metrics) -> None:
+        """Fold in another shard's finished run; elapsed time is the longest shard's."""
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        for stage, histogram in other.stages.items():
+            if stage in self.stages:
+                self.stages[stage].merge(histogram)
+            else:
+                self.stages[stage] = histogram
+        for remote, value in other.requests.items():
+            self.requests[remote] = self.requests.get(remote, 0) + value
+        for key, amount in other.transfer.items():
+            self.transfer[key] = self.transfer.get(key, 0) + amount
+        totals = [total for total in (self.total_posts, other.total_posts) if total is not None]
+        self.total_posts = sum(totals) if totals else None
+        self.fixed_elapsed = max(self.elapsed(), other.elapsed())
+
+    def posts_per_second(self) -> float:
+        elapsed = self.elapsed()
+        return self.get("scanned") / elapsed if elapsed > 0 else 0.0
+
+    def progress_line(self) -> str:
+        scanned = self.get("scanned")
+        rate = self.posts_per_second()
+        line = f"[progress] {scanned}"
+        if self.total_posts:
+            remaining = max(0, self.total_posts - scanned)
+            line += f"/{self.total_posts} posts ({scanned / self.total_posts:.1%})"
+            if rate > 0:
+                line += f", ETA {format_duration(remaining / rate)}"
+        else:
+            line += " posts"
+        line += f", {rate:.1f} posts/s, matched {self.get('matched')}, failed {self.get('failed')}"
+        with self._lock:
+            slowest = sorted(self.stages.items(), key=lambda item: item[1].total, reverse=True)[:3]
+            stage_text = " ".join(f"{name}={histogram.quantile(0.95):.2f}s" for name, histogram in slowest)
+        if stage_text:
+            line += f" | p95 {stage_text}"
+        if self.gauges:
+            line += " | " + " ".join(f"{name}={read():g}" for name, read in self.gauges.items())
+        return line
+
+    def report(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "elapsed_seconds": round(self.elapsed(), 3),
+                "posts_per_second": round(self.counters.get("scanned", 0) / max(self.elapsed(), 1e-9), 3),
+                "total_posts": self.total_posts,
+                "counters": dict(sorted(self.counters.items())),
+                "stages": {name: histogram.to_dict() for name, histogram in sorted(self.stages.items())},
+                "requests": dict(sorted(self.requests.items())),
+                "bytes": {
+                    f"{remote}_{direction}": amount for (remote, direction), amount in sorted(self.transfer.items())
+                },
+                "gauges": {name: read() for name, read in self.gauges.items()},
+            }
+
+    def prometheus(self) -> str:
+        """Text exposition format, for node_exporter's textfile collector."""
+        prefix = "bakabooru_migration"
+        # Run counters include signed byte tallies (saved_bytes), so they are gauges.
+        lines = [f"# TYPE {prefix}_count gauge"]
+        with self._lock:
+            lines.extend(f'{prefix}_count{{name="{name}"}} {value}' for name, value in sorted(self.counters.items()))
+            lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.BUCKETS, histogram.counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.total:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines.append(f"# TYPE {prefix}_requests_total counter")
+            lines.extend(
+                f'{prefix}_requests_total{{remote="{remote}"}} {value}' for remote, value in sorted(self.requests.items())
+            )
+            lines.append(f"# TYPE {prefix}_bytes_total counter")
+            lines.extend(
+                f'{prefix}_bytes_total{{remote="{remote}",direction="{direction}"}} {value}'
+                for (remote, direction), value in sorted(self.transfer.items())
+            )
+        lines.append(f"# TYPE {prefix}_posts_per_second gauge")
+        lines.append(f"{prefix}_posts_per_second {self.posts_per_second():.3f}")
+        if self.total_posts is not None:
+            lines.append(f"# TYPE {prefix}_posts_total gauge")
+            lines.append(f"{prefix}_posts_total {self.total_posts}")
+        for name, read in self.gauges.items():
+            metric = f"{prefix}_{name.replace('-', '_').replace('.', '_')}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {read():g}")
+        return "\n".join(lines) + "\n"
+
+
+def write_atomically(path: str, text: str) -> None:
+    target = Path(path)
+    partial = target.with_name(f".{target.name}.tmp")
+    partial.write_text(text, encoding="utf-8")
+    os.replace(partial, target)
+
+
+class ProgressReporter:
+    """
+    Background thread that prints `Metrics.progress_line` every `interval`
+    seconds and, when `prometheus_path` is set, rewrites that textfile.
+    """
+
+    def __init__(self, metrics: Metrics, interval: float, prometheus_path: str | None = None) -> None:
+        self.metrics = metrics
+        self.interval = interval
+        self.prometheus_path = prometheus_path
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+
+    def __enter__(self) -> ProgressReporter:
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.publish(print_line=False)
+
+    def publish(self, print_line: bool = True) -> None:
+        if print_line:
+            print(self.metrics.progress_line(), flush=True)
+        if self.prometheus_path:
+            try:
+                write_atomically(self.prometheus_path, self.metrics.prometheus())
+            except OSError as exc:
+                print(f"[metrics] cannot write {self.prometheus_path}: {exc}", file=sys.stderr)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.publish()
+
+
+# Post whose work the current thread or task is doing, for trace spans.
+TRACE_POST: ContextVar[int | None] = ContextVar("trace_post", default=None)
+
+
+@contextmanager
+def traced_post(post_id: int) -> Iterator[None]:
+    token = TRACE_POST.set(post_id)
+    try:
+        yield
+    finally:
+        TRACE_POST.reset(token)
+
+
+class TraceRecorder:
+    """
+    Streams spans to `path` in Chrome trace-event format (chrome://tracing,
+    Perfetto). Spans run on one lane per thread; under asyncio every post
+    gets its own lane, since its stages interleave with other posts on the
+    event loop thread. Spans carry the post they were recorded for.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.handle = open(path, "w", encoding="utf-8")
+        self.handle.write("[")
+        self.separator = "\n"
+        self.lock = threading.Lock()
+        self.origin = time.monotonic()
+        self.pid = os.getpid()
+        self.lanes: set[int] = set()
+        self._write({"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "migrate_oxibooru_tags"}})
+
+    def _lane(self, post_id: int | None) -> tuple[int, str]:
+        try:
+            in_task = asyncio.current_task() is not None
+        except RuntimeError:
+            in_task = False
+        if in_task and post_id is not None:
+            return post_id, f"post {post_id}"
+        thread = threading.current_thread()
+        return thread.ident or 0, thread.name
+
+    def _write(self, event: dict[str, Any]) -> None:
+        self.handle.write(self.separator + json.dumps(event, separators=(",", ":")))
+        self.separator = ",\n"
+
+    def span(self, name: str, category: str, started: float, finished: float) -> None:
+        post_id = TRACE_POST.get()
+        lane, lane_name = self._lane(post_id)
+        event: dict[str, Any] = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((started - self.origin) * 1e6, 1),
+            "dur": round((finished - started) * 1e6, 1),
+            "pid": self.pid,
+            "tid": lane,
+        }
+        if post_id is not None:
+            event["args"] = {"post": post_id}
+        with self.lock:
+            if lane not in self.lanes:
+                self.lanes.add(lane)
+                self._write({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": lane, "args": {"name": lane_name}})
+            self._write(event)
+
+    @contextmanager
+    def timed(self, name: str, category: str) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.span(name, category, started, time.monotonic())
+
+    def close(self) -> None:
+        with self.lock:
+            self.handle.write("\n]\n")
+            self.handle.close()
+
+
+class RunProfiler:
+    """
+    cProfile over every thread of the run (match workers, the writer,
+    prefetchers). From Python 3.12 one profiler sees all threads through
+    `sys.monitoring`, which also allows only one active profiler; before
+    that cProfile only sees the thread that enabled it, so every thread
+    started while active gets its own.
+    """
+
+    def __init__(self) -> None:
+        self.profiles: list[cProfile.Profile] = []
+        self.lock = threading.Lock()
+        self.per_thread = sys.version_info < (3, 12)
+
+    def _start_thread(self, *_: Any) -> None:
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Another profiler is active; leave this thread unprofiled.
+            return
+        with self.lock:
+            self.profiles.append(profile)
+
+    def __enter__(self) -> RunProfiler:
+        main = cProfile.Profile()
+        main.enable()
+        self.profiles.append(main)
+        if self.per_thread:
+            threading.setprofile(self._start_thread)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self.per_thread:
+            threading.setprofile(None)
+        self.profiles[0].disable()
+
+    def report(self, path: str, limit: int = 30) -> None:
+        """Save the merged stats to `path` and print this script's hottest functions."""
+        stats: pstats.Stats | None = None
+        for profile in self.profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        if stats is None:
+            print("[profile] no samples collected", file=sys.stderr)
+            return
+        stats.dump_stats(path)
+        print(f"\n=== Profile (cumulative; full stats in {path}) ===")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(re.escape(Path(__file__).name), limit)
+
+
+@dataclass
+class PostMatch:
+    post_id: int
+    content_hash: str
+    post_tags: list[dict[str, Any]]
+    match_kind: str
+    matched_post: dict[str, Any] | None = None
+    distance: float | None = None
+    from_cache: bool = False
+    uploaded_bytes: int = 0
+    saved_bytes: int = 0
+    jxl_cache_hit: bool = False
+    from_index: bool = False
+    propagated_from: int | None = None
+
+
+@dataclass
+class PostFailure:
+    post_id: int
+    content_hash: str
+    error: Exception
+
+
+class InlineExecutor:
+    """
+    Executor stand-in that runs work on the calling thread, so the sequential
+    mode shares the exact code path of the pipelined mode.
+    """
+
+    def submit(self, fn: Any, *args: Any, **kwargs: Any) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+        return future
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False) -> None:
+        return None
+
+
+def read_page_items(page_payload: dict[str, Any]) -> list[dict[str, Any]]:
+    items = page_payload.get("items") or page_payload.get("Items") or []
+    if not isinstance(items, list):
+        raise RuntimeError("Bakabooru posts payload has invalid 'items'.")
+    return items
+
+
+def read_page_total(page_payload: dict[str, Any]) -> int | None:
+    total = page_payload.get("totalCount", page_payload.get("TotalCount"))
+    return int(total) if isinstance(total, int) else None
+
+
+def build_scan_query(
+    after_id: int,
+    user_query: str | None = None,
+    media_types: str = SCAN_MEDIA_TYPES,
+    sort: str = "id_asc",
+) -> str:
+    """
+    Server-side search for one keyset page: only `media_types` posts with id
+    above the cursor, in id order. Our directives come last so they win over
+    any conflicting `sort:`/`id:` in the user's query.
+    """
+    parts = [user_query.strip()] if user_query and user_query.strip() else []
+    parts.extend([f"type:{media_types}", f"id:>{after_id}", f"sort:{sort}"])
+    return " ".join(parts)
+
+
+def scan_media_types(args: argparse.Namespace) -> str:
+    return f"{SCAN_MEDIA_TYPES},video" if args.video_frames > 0 else SCAN_MEDIA_TYPES
+
+
+def parse_shard(value: str) -> tuple[int, int] | None:
+    """`I/N` -> (I, N) with 0 <= I < N, or None when malformed."""
+    index, separator, count = value.partition("/")
+    try:
+        shard = (int(index), int(count))
+    except ValueError:
+        return None
+    if not separator or shard[1] < 1 or not 0 <= shard[0] < shard[1]:
+        return None
+    return shard
+
+
+def in_shard(post: dict[str, Any], shard: tuple[int, int] | None) -> bool:
+    """Deterministic partition by post id, so shards never overlap whatever their page boundaries."""
+    return shard is None or int(post["id"]) % shard[1] == shard[0]
+
+
+def shard_total(total: int | None, shard: tuple[int, int] | None) -> int | None:
+    if total is None or shard is None:
+        return total
+    return -(-total // shard[1])
+
+
+def shard_page(cursor: int, items: list[dict[str, Any]], shard: tuple[int, int] | None) -> list[dict[str, Any]]:
+    """The posts of one listed page that belong to `shard`, logged against the cursor."""
+    mine = [post for post in items if in_shard(post, shard)]
+    print(f"[posts after id {cursor}] fetched {len(items)} posts" + (f", {len(mine)} in shard" if shard else ""))
+    return mine
+
+
+def iter_post_pages(
+    baka: BakabooruClient,
+    after_id: int,
+    page_size: int,
+    user_query: str | None = None,
+    metrics: Metrics | None = None,
+    shard: tuple[int, int] | None = None,
+    count_total: bool = True,
+    media_types: str = SCAN_MEDIA_TYPES,
+) -> Iterator[list[dict[str, Any]]]:
+    """
+    Walk the library with an id cursor instead of page offsets, so every page
+    costs the same and imports/deletions don't shift what is left to scan.
+    The first page's total becomes the progress ETA's denominator. With a
+    `shard`, every shard walks the full listing and keeps only its posts.
+    """
+    metrics = metrics or Metrics()
+    cursor = after_id
+    while True:
+        with metrics.time("list"):
+            page_payload = baka.get_posts_page(page=1, page_size=page_size, query=build_scan_query(cursor, user_query, media_types))
+        if cursor == after_id and count_total:
+            metrics.set_total(shard_total(read_page_total(page_payload), shard))
+        items = read_page_items(page_payload)
+        if not items:
+            return
+
+        mine = shard_page(cursor, items, shard)
+        if mine:
+            yield mine
+
+        if len(items) < page_size:
+            return
+        cursor = int(items[-1]["id"])
+
+
+# Orderings `--priority` applies within `--priority-window` listed posts.
+PRIORITY_KEYS: dict[str, Callable[[dict[str, Any]], Any]] = {
+    # Cheapest upload and download first.
+    "smallest": lambda post: int(post.get("sizeBytes") or 0),
+    # JXL needs a djxl decode before it can be searched.
+    "jxl-last": lambda post: is_jxl_content_type(str(post.get("contentType") or "")),
+}
+# `untagged` is a separate listing pass (`tag-count:0`) before everything else.
+PRIORITY_POLICIES = ("untagged", *PRIORITY_KEYS)
+
+
+def parse_priority(value: str | None) -> list[str] | None:
+    """Comma-separated `PRIORITY_POLICIES` -> list, or None when malformed."""
+    if not value:
+        return []
+    policy = [part.strip() for part in value.split(",") if part.strip()]
+    if any(part not in PRIORITY_POLICIES for part in policy) or len(set(policy)) != len(policy):
+        return None
+    return policy
+
+
+def priority_queries(user_query: str | None, policy: list[str]) -> list[str | None]:
+    """One listing query per pass: untagged posts (where a match adds the most) first."""
+    if "untagged" not in policy:
+        return [user_query]
+    base = user_query.strip() if user_query else ""
+    return [f"{base} tag-count:0".strip(), f"{base} tag-count:>0".strip()]
+
+
+def priority_key(policy: list[str]) -> Callable[[dict[str, Any]], tuple[Any, ...]] | None:
+    keys = [PRIORITY_KEYS[name] for name in policy if name in PRIORITY_KEYS]
+    if not keys:
+        return None
+    return lambda post: tuple(key(post) for key in keys)
+
+
+class PostIdSet:
+    """Set of post ids as a bitmap: a library of a million posts costs 125 KB."""
+
+    def __init__(self) -> None:
+        self.bits = bytearray()
+
+    def add(self, post_id: int) -> None:
+        index = post_id >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index + 1 - len(self.bits)))
+        self.bits[index] |= 1 << (post_id & 7)
+
+    def __contains__(self, post_id: int) -> bool:
+        index = post_id >> 3
+        return index < len(self.bits) and bool(self.bits[index] & (1 << (post_id & 7)))
+
+
+class PriorityWindow:
+    """
+    Sliding-window reordering of the listing: up to `size` posts are held
+    back and the best by `key` is released whenever a new one arrives, so
+    memory stays bounded while cheap posts still overtake expensive ones.
+    """
+
+    def __init__(self, key: Callable[[dict[str, Any]], Any], size: int, page_size: int) -> None:
+        self.key = key
+        self.size = size
+        self.page_size = page_size
+        self.heap: list[tuple[Any, int, dict[str, Any]]] = []
+        self.sequence = 0
+
+    def push(self, items: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        released: list[dict[str, Any]] = []
+        for post in items:
+            # The sequence number keeps listing order among equal keys.
+            heapq.heappush(self.heap, (self.key(post), self.sequence, post))
+            self.sequence += 1
+            if len(self.heap) > self.size:
+                released.append(heapq.heappop(self.heap)[2])
+        return released
+
+    def drain(self) -> Iterator[list[dict[str, Any]]]:
+        while self.heap:
+            count = min(self.page_size, len(self.heap))
+            yield [heapq.heappop(self.heap)[2] for _ in range(count)]
+
+
+class ScanSchedule:
+    """
+    The `--priority` plan of a scan, shared by both listing runners: one
+    listing pass per query, posts an earlier pass already listed dropped
+    from later ones, and the sliding window's reordering.
+    """
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.queries = priority_queries(args.query, args.priority)
+        key = priority_key(args.priority)
+        self.window = PriorityWindow(key, args.priority_window, args.page_size) if key is not None else None
+        # Posts tagged during the untagged pass show up again in the tagged one.
+        self.done = PostIdSet() if len(self.queries) > 1 else None
+
+    @property
+    def passes(self) -> int:
+        return len(self.queries)
+
+    def count_queries(self) -> list[str]:
+        """Scan queries whose totals make up the progress total when there are several passes."""
+        if self.passes == 1:
+            return []
+        return [build_scan_query(self.args.after_id, query, scan_media_types(self.args)) for query in self.queries]
+
+    def set_total(self, metrics: Metrics, totals: list[int | None]) -> None:
+        metrics.set_total(sum(shard_total(total, self.args.shard) or 0 for total in totals))
+
+    def pass_kwargs(self, query: str | None) -> dict[str, Any]:
+        """Arguments of `iter_post_pages` (or its asyncio twin) for one pass."""
+        return {
+            "after_id": self.args.after_id,
+            "page_size": self.args.page_size,
+            "user_query": query,
+            "shard": self.args.shard,
+            "count_total": self.passes == 1,
+            "media_types": scan_media_types(self.args),
+        }
+
+    def admit(self, number: int, items: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Posts of pass `number` that are released now, in priority order."""
+        if self.done is not None:
+            if number:
+                items = [post for post in items if int(post["id"]) not in self.done]
+            else:
+                for post in items:
+                    self.done.add(int(post["id"]))
+        return self.window.push(items) if self.window is not None else items
+
+    def drain(self) -> Iterator[list[dict[str, Any]]]:
+        """What the window still holds at the end of a pass."""
+        if self.window is not None:
+            yield from self.window.drain()
+
+
+def iter_scheduled_pages(
+    baka: BakabooruClient,
+    args: argparse.Namespace,
+    metrics: Metrics,
+) -> Iterator[list[dict[str, Any]]]:
+    """`iter_post_pages` in `--priority` order (plain listing order without a policy)."""
+    schedule = ScanSchedule(args)
+    totals = [
+        read_page_total(baka.get_posts_page(page=1, page_size=1, query=query)) for query in schedule.count_queries()
+    ]
+    if totals:
+        schedule.set_total(metrics, totals)
+    for number, query in enumerate(schedule.queries):
+        for items in iter_post_pages(baka, metrics=metrics, **schedule.pass_kwargs(query)):
+            released = schedule.admit(number, items)
+            if released:
+                yield released
+        yield from schedule.drain()
+
+
+_PAGES_DONE = object()
+
+
+def prefetch_pages(pages: Iterator[list[dict[str, Any]]], stop: threading.Event) -> Iterator[list[dict[str, Any]]]:
+    """
+    Run the listing generator on a background thread, fetching the next page
+    while the consumer works through the current one (never more than one ahead).
+    """
+    buffer: queue.Queue = queue.Queue()
+    slot = threading.Semaphore(1)
+
+    def produce() -> None:
+        try:
+            while True:
+                while not slot.acquire(timeout=0.5):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                items = next(pages, None)
+                if items is None:
+                    buffer.put(_PAGES_DONE)
+                    return
+                buffer.put(items)
+        except BaseException as exc:
+            buffer.put(exc)
+
+    thread = threading.Thread(target=produce, name="page-prefetch", daemon=True)
+    thread.start()
+    while True:
+        item = buffer.get()
+        slot.release()
+        if item is _PAGES_DONE:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def upload_filename(post: dict[str, Any]) -> str:
+    post_id = int(post["id"])
+    relative_path = str(post.get("relativePath") or f"post_{post_id}")
+    return Path(relative_path).name or f"post_{post_id}"
+
+
+def prepare_upload(
+    post: dict[str, Any],
+    original: IO[bytes],
+    decoder: JxlDecoder,
+    max_memory: int,
+) -> Upload:
+    """Upload for a post's downloaded content, decoding JXL when needed."""
+    content_type = str(post.get("contentType") or "")
+    filename = upload_filename(post)
+
+    if is_jxl_content_type(content_type):
+        with original:
+            decoded = decoder.decode(original, str(post.get("contentHash") or ""), max_memory)
+        return Upload(decoded, stream_size(decoded), f"{Path(filename).stem}.jpg", "image/jpeg")
+
+    return Upload(
+        original,
+        stream_size(original),
+        filename,
+        content_type if content_type else "application/octet-stream",
+    )
+
+
+def cached_jxl_upload(post: dict[str, Any], decoder: JxlDecoder) -> Upload | None:
+    """Previously decoded upload for a JXL post, so its original needn't be downloaded."""
+    if not is_jxl_content_type(str(post.get("contentType") or "")):
+        return None
+    decoded = decoder.cached(str(post.get("contentHash") or ""))
+    if decoded is None:
+        return None
+    return Upload(decoded, stream_size(decoded), f"{Path(upload_filename(post)).stem}.jpg", "image/jpeg")
+
+
+def downscale_upload(upload: Upload, max_edge: int) -> Upload | None:
+    """
+    JPEG copy of an upload whose longest edge is at most `max_edge`, or None
+    when the image is already that small or Pillow cannot read it.
+    """
+    try:
+        with Image.open(upload.body) as image:
+            if max(image.size) <= max_edge:
+                return None
+            image.draft("RGB", (max_edge, max_edge))
+            small = image.convert("RGB")
+            small.thumbnail((max_edge, max_edge))
+            out = io.BytesIO()
+            small.save(out, "JPEG", quality=90)
+    except (OSError, ValueError):
+        return None
+    finally:
+        upload.body.seek(0)
+    return Upload.from_bytes(out.getvalue(), f"{Path(upload.filename).stem}.jpg", "image/jpeg")
+
+
+def thumbnail_upload(post: dict[str, Any], thumbnail: bytes | None) -> Upload | None:
+    if not thumbnail:
+        return None
+    stem = Path(str(post.get("relativePath") or "")).stem or f"post_{post['id']}"
+    return Upload.from_bytes(thumbnail, f"{stem}.webp", "image/webp")
+
+
+class GroupMatchSharing:
+    """
+    One reverse search per Bakabooru duplicate group. The first member to be
+    matched becomes the group's representative; the others wait for its
+    result instead of searching. An accepted match is applied to every
+    member. "No match" is only shared within exact groups (identical
+    content); members of perceptual groups then search for themselves, as
+    they do when the representative fails.
+    """
+
+    def __init__(self, groups: list[DuplicateGroup], min_similarity: int) -> None:
+        self.group_of: dict[int, int] = {}
+        self.exact: set[int] = set()
+        for group in groups:
+            if group.type == "exact":
+                self.exact.add(group.id)
+            elif (group.similarity_percent or 0) < min_similarity:
                 continue
+            for post_id in group.post_ids:
+                # A post in several groups shares with the first one listed.
+                self.group_of.setdefault(post_id, group.id)
+        self.results: dict[int, Future] = {}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(set(self.group_of.values()))
+
+    def claim(self, post_id: int) -> tuple[Future, bool, bool] | None:
+        """(the group's result future, whether the caller owns it, exact group), or None outside groups."""
+        group_id = self.group_of.get(post_id)
+        if group_id is None:
+            return None
+        with self.lock:
+            future = self.results.get(group_id)
+            owner = future is None
+            if owner:
+                future = self.results[group_id] = Future()
+        return future, owner, group_id in self.exact
+
+    @staticmethod
+    def propagate(post: dict[str, Any], shared: PostMatch | None, exact: bool) -> PostMatch | None:
+        if shared is None or (shared.matched_post is None and not exact):
+            return None
+        return PostMatch(
+            post_id=int(post["id"]),
+            content_hash=str(post.get("contentHash") or ""),
+            post_tags=post.get("tags") or [],
+            match_kind=shared.match_kind,
+            matched_post=shared.matched_post,
+            distance=shared.distance,
+            propagated_from=shared.post_id,
+        )
+
+
+@dataclass
+class MatchUploads:
+    """The content held while one post is matched; `close` releases whatever is left."""
+
+    original: IO[bytes] | None = None
+    full: Upload | None = None
+    small: Upload | None = None
+    jxl_cache_hit: bool = False
+
+    def take_original(self) -> IO[bytes] | None:
+        """Hand the downloaded original over to a loader, which then owns it."""
+        original, self.original = self.original, None
+        return original
+
+    def close(self) -> None:
+        if self.original is not None:
+            self.original.close()
+        for upload in (self.small, self.full):
+            if upload is not None:
+                upload.close()
+
+
+class FrameSearch:
+    """The best match so far across a video post's frames."""
+
+    def __init__(self, post: dict[str, Any]) -> None:
+        self.post = post
+        self.best: tuple[dict[str, Any] | None, str, float | None] = (None, "none", None)
+        self.uploaded = 0
+
+    def upload(self, index: int, frame: bytes) -> Upload:
+        upload = Upload.from_bytes(frame, f"{self.post['id']}-frame{index}.jpg", "image/jpeg")
+        self.uploaded += upload.size
+        return upload
+
+    def add(self, selection: tuple[dict[str, Any] | None, str, float | None]) -> bool:
+        """Keep `selection` if it beats the best so far; returns whether the search can stop."""
+        if selection_rank(selection) < selection_rank(self.best):
+            self.best = selection
+        return self.best[1] == "exact"
+
+
+class PostMatcher:
+    """
+    Read-only half of a post migration: download, decode, reverse search and
+    candidate selection. `match` is safe to call from worker threads;
+    `match_async` is the asyncio variant and expects the async clients.
+
+    With `upload_mode` "thumbnail" or "downscale" a small image is searched
+    first (reverse search is perceptual) and the full file is only uploaded
+    when that finds no acceptable match.
+
+    Content is held in spooled buffers of at most `spool_memory` bytes in
+    memory each, and every post reserves its share of `budget` (a
+    `ByteBudget`, or `AsyncByteBudget` for `match_async`) while in flight.
+
+    With an `index`, the original is hashed after download and an indexed
+    checksum is taken as the exact match without uploading anything. With
+    `groups`, members of a Bakabooru duplicate group reuse one search.
+    With `video`, video posts are searched by a few frames read over HTTP
+    ranges, and the best match across frames is taken. With `library`,
+    originals are read from disk where possible instead of downloaded.
+
+    Stage latencies (download, thumbnail, hash, jxl_decode, downscale,
+    reverse_search and the whole match) are observed on `metrics`.
+    """
+
+    def __init__(
+        self,
+        baka: BakabooruClient | AsyncBakabooruClient,
+        oxi: OxibooruClient | AsyncOxibooruClient,
+        max_similar_distance: float,
+        cache: ReverseSearchCache | None = None,
+        upload_mode: str = "full",
+        downscale_max_edge: int = 512,
+        jxl_decoder: JxlDecoder | None = None,
+        spool_memory: int = 16 * 1024 * 1024,
+        budget: ByteBudget | AsyncByteBudget | None = None,
+        index: OxibooruChecksumIndex | None = None,
+        metrics: Metrics | None = None,
+        groups: GroupMatchSharing | None = None,
+        video: VideoFrameExtractor | None = None,
+        library: LibraryFiles | None = None,
+    ) -> None:
+        self.baka = baka
+        self.oxi = oxi
+        self.max_similar_distance = max_similar_distance
+        self.cache = cache
+        self.upload_mode = upload_mode
+        self.downscale_max_edge = downscale_max_edge
+        self.jxl_decoder = jxl_decoder or JxlDecoder(max_processes=os.cpu_count() or 1)
+        self.spool_memory = spool_memory
+        self.budget = budget
+        self.index = index
+        self.metrics = metrics or Metrics()
+        self.groups = groups
+        self.video = video
+        self.library = library
+
+    def _reservation(self, post: dict[str, Any]) -> int:
+        """In-memory bytes a post may hold: its spooled content, twice for JXL (original + decoded)."""
+        if self.video is not None and is_video_content_type(str(post.get("contentType") or "")):
+            # Only one extracted frame is held at a time, never the video.
+            return CONTENT_CHUNK_SIZE
+        held = min(int(post.get("sizeBytes") or 0), self.spool_memory)
+        if is_jxl_content_type(str(post.get("contentType") or "")):
+            held *= 2
+        return held
+
+    def _cached_match(self, post: dict[str, Any]) -> PostMatch | None:
+        if self.cache is None:
+            return None
+        cached = self.cache.get(str(post.get("contentHash") or ""))
+        if cached is None:
+            return None
+        matched_post, match_kind, distance = cached
+        return self._build_match(post, matched_post, match_kind, distance, from_cache=True)
+
+    def _select(self, reverse_result: dict[str, Any]) -> tuple[dict[str, Any] | None, str, float | None]:
+        return select_reverse_search_match(
+            reverse_result=reverse_result,
+            max_similar_distance=self.max_similar_distance,
+        )
+
+    def _finish(
+        self,
+        post: dict[str, Any],
+        selection: tuple[dict[str, Any] | None, str, float | None],
+        uploaded_bytes: int,
+        saved_bytes: int,
+        jxl_cache_hit: bool,
+        from_index: bool = False,
+    ) -> PostMatch:
+        matched_post, match_kind, distance = selection
+        if self.cache is not None:
+            self.cache.put(str(post.get("contentHash") or ""), matched_post, match_kind, distance)
+        match = self._build_match(post, matched_post, match_kind, distance)
+        match.uploaded_bytes = uploaded_bytes
+        match.saved_bytes = saved_bytes
+        match.jxl_cache_hit = jxl_cache_hit
+        match.from_index = from_index
+        return match
+
+    def _lookup(self, post: dict[str, Any]) -> tuple[PostMatch | None, tuple[Future, bool, bool] | None]:
+        """The cached match, or else the post's duplicate-group claim (None outside groups)."""
+        cached = self._cached_match(post)
+        if cached is not None or self.groups is None:
+            return cached, None
+        return None, self.groups.claim(int(post["id"]))
+
+    def _indexed_match(self, post: dict[str, Any], checksum: str) -> PostMatch | None:
+        indexed = self.index.get(checksum)
+        if indexed is None:
+            return None
+        return self._finish(post, (indexed, "exact", 0.0), 0, 0, False, from_index=True)
+
+    def _small_match(
+        self,
+        post: dict[str, Any],
+        uploads: MatchUploads,
+        selection: tuple[dict[str, Any] | None, str, float | None],
+    ) -> PostMatch | None:
+        """The small upload's match, if it is good enough to skip the full upload."""
+        if selection[1] not in ("exact", "similar"):
+            return None
+        small_bytes = uploads.small.size
+        full_size = uploads.full.size if uploads.full else int(post.get("sizeBytes") or 0)
+        return self._finish(post, selection, small_bytes, full_size - small_bytes, uploads.jxl_cache_hit)
+
+    def _full_match(
+        self,
+        post: dict[str, Any],
+        uploads: MatchUploads,
+        selection: tuple[dict[str, Any] | None, str, float | None],
+    ) -> PostMatch:
+        small_bytes = uploads.small.size if uploads.small is not None else 0
+        return self._finish(post, selection, small_bytes + uploads.full.size, -small_bytes, uploads.jxl_cache_hit)
+
+    def _original(self, post: dict[str, Any]) -> IO[bytes]:
+        if self.library is not None:
+            with self.metrics.time("local_read"):
+                local = self.library.open(post)
+            if local is not None:
+                self.metrics.inc("local_reads")
+                return local
+        with self.metrics.time("download"):
+            return self.baka.get_post_content(int(post["id"]), self.spool_memory)
+
+    async def _original_async(self, post: dict[str, Any]) -> IO[bytes]:
+        if self.library is not None:
+            with self.metrics.time("local_read"):
+                local = await asyncio.get_running_loop().run_in_executor(None, self.library.open, post)
+            if local is not None:
+                self.metrics.inc("local_reads")
+                return local
+        with self.metrics.time("download"):
+            return await self.baka.get_post_content(int(post["id"]), self.spool_memory)
+
+    def _load_full(self, post: dict[str, Any], original: IO[bytes] | None = None) -> tuple[Upload, bool]:
+        """
+        Full upload for a post and whether it came from the decoded-JXL cache.
+        Takes ownership of an already downloaded `original`.
+        """
+        cached = cached_jxl_upload(post, self.jxl_decoder)
+        if cached is not None:
+            if original is not None:
+                original.close()
+            return cached, True
+        if original is None:
+            original = self._original(post)
+        if not is_jxl_content_type(str(post.get("contentType") or "")):
+            return prepare_upload(post, original, self.jxl_decoder, self.spool_memory), False
+        with self.metrics.time("jxl_decode"):
+            return prepare_upload(post, original, self.jxl_decoder, self.spool_memory), False
+
+    async def _load_full_async(
+        self,
+        post: dict[str, Any],
+        original: IO[bytes] | None = None,
+    ) -> tuple[Upload, bool]:
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, cached_jxl_upload, post, self.jxl_decoder)
+        if cached is not None:
+            if original is not None:
+                original.close()
+            return cached, True
+        if original is None:
+            original = await self._original_async(post)
+        if is_jxl_content_type(str(post.get("contentType") or "")):
+            with self.metrics.time("jxl_decode"):
+                upload = await loop.run_in_executor(
+                    None, prepare_upload, post, original, self.jxl_decoder, self.spool_memory
+                )
+            return upload, False
+        return prepare_upload(post, original, self.jxl_decoder, self.spool_memory), False
+
+    @staticmethod
+    def _build_match(
+        post: dict[str, Any],
+        matched_post: dict[str, Any] | None,
+        match_kind: str,
+        distance: float | None,
+        from_cache: bool = False,
+    ) -> PostMatch:
+        return PostMatch(
+            post_id=int(post["id"]),
+            content_hash=str(post.get("contentHash") or ""),
+            post_tags=post.get("tags") or [],
+            match_kind=match_kind,
+            matched_post=matched_post,
+            distance=distance,
+            from_cache=from_cache,
+        )
+
+    def match(self, post: dict[str, Any]) -> PostMatch:
+        cached, claim = self._lookup(post)
+        if cached is not None:
+            return cached
+        if claim is None:
+            return self._match_own(post)
+        future, owner, exact = claim
+        if not owner:
+            shared = GroupMatchSharing.propagate(post, future.result(), exact)
+            return shared if shared is not None else self._match_own(post)
+        try:
+            match = self._match_own(post)
+        except BaseException:
+            future.set_result(None)
+            raise
+        future.set_result(match)
+        return match
+
+    def _match_own(self, post: dict[str, Any]) -> PostMatch:
+        with self.metrics.time("match"):
+            if self.budget is None:
+                return self._match_uploads(post)
+            with self.budget.reserve(self._reservation(post)):
+                return self._match_uploads(post)
+
+    def _video_source(self, post: dict[str, Any]) -> tuple[str, dict[str, str]]:
+        local = self.library.path(post) if self.library is not None else None
+        if local is not None:
+            return str(local), {}
+        return self.baka.content_source(int(post["id"]))
+
+    def _match_video(self, post: dict[str, Any]) -> PostMatch:
+        url, headers = self._video_source(post)
+        with self.metrics.time("video_probe"):
+            offsets = self.video.offsets(url, headers)
+        frames = FrameSearch(post)
+        for index, offset in enumerate(offsets):
+            with self.metrics.time("video_frame"):
+                frame = self.video.frame(url, headers, offset)
+            with self.metrics.time("reverse_search"):
+                selection = self._select(self.oxi.reverse_search(frames.upload(index, frame)))
+            if frames.add(selection):
+                break
+        return self._finish(post, frames.best, frames.uploaded, 0, False)
+
+    def _match_uploads(self, post: dict[str, Any]) -> PostMatch:
+        if self.video is not None and is_video_content_type(str(post.get("contentType") or "")):
+            return self._match_video(post)
+        uploads = MatchUploads()
+        try:
+            if self.index is not None:
+                uploads.original = self._original(post)
+                with self.metrics.time("hash"):
+                    checksum = sha1_of(uploads.original)
+                indexed = self._indexed_match(post, checksum)
+                if indexed is not None:
+                    return indexed
+
+            if self.upload_mode == "thumbnail":
+                with self.metrics.time("thumbnail"):
+                    uploads.small = thumbnail_upload(post, self.baka.get_post_thumbnail(post))
+            elif self.upload_mode == "downscale":
+                uploads.full, uploads.jxl_cache_hit = self._load_full(post, uploads.take_original())
+                with self.metrics.time("downscale"):
+                    uploads.small = downscale_upload(uploads.full, self.downscale_max_edge)
+
+            if uploads.small is not None:
+                with self.metrics.time("reverse_search"):
+                    selection = self._select(self.oxi.reverse_search(uploads.small))
+                small_match = self._small_match(post, uploads, selection)
+                if small_match is not None:
+                    return small_match
+
+            if uploads.full is None:
+                uploads.full, uploads.jxl_cache_hit = self._load_full(post, uploads.take_original())
+            with self.metrics.time("reverse_search"):
+                selection = self._select(self.oxi.reverse_search(uploads.full))
+            return self._full_match(post, uploads, selection)
+        finally:
+            uploads.close()
+
+    async def match_async(self, post: dict[str, Any]) -> PostMatch:
+        """Same flow as `match`; JXL decoding and downscaling run off the event loop."""
+        cached, claim = self._lookup(post)
+        if cached is not None:
+            return cached
+        if claim is None:
+            return await self._match_own_async(post)
+        future, owner, exact = claim
+        if not owner:
+            shared = GroupMatchSharing.propagate(post, await asyncio.wrap_future(future), exact)
+            return shared if shared is not None else await self._match_own_async(post)
+        try:
+            match = await self._match_own_async(post)
+        except BaseException:
+            future.set_result(None)
+            raise
+        future.set_result(match)
+        return match
+
+    async def _match_own_async(self, post: dict[str, Any]) -> PostMatch:
+        with self.metrics.time("match"):
+            if self.budget is None:
+                return await self._match_uploads_async(post)
+            async with self.budget.reserve(self._reservation(post)):
+                return await self._match_uploads_async(post)
+
+    async def _match_video_async(self, post: dict[str, Any]) -> PostMatch:
+        loop = asyncio.get_running_loop()
+        url, headers = await loop.run_in_executor(None, self._video_source, post)
+        with self.metrics.time("video_probe"):
+            offsets = await loop.run_in_executor(None, self.video.offsets, url, headers)
+        frames = FrameSearch(post)
+        for index, offset in enumerate(offsets):
+            with self.metrics.time("video_frame"):
+                frame = await loop.run_in_executor(None, self.video.frame, url, headers, offset)
+            with self.metrics.time("reverse_search"):
+                selection = self._select(await self.oxi.reverse_search(frames.upload(index, frame)))
+            if frames.add(selection):
+                break
+        return self._finish(post, frames.best, frames.uploaded, 0, False)
+
+    async def _match_uploads_async(self, post: dict[str, Any]) -> PostMatch:
+        if self.video is not None and is_video_content_type(str(post.get("contentType") or "")):
+            return await self._match_video_async(post)
+        loop = asyncio.get_running_loop()
+        uploads = MatchUploads()
+        try:
+            if self.index is not None:
+                uploads.original = await self._original_async(post)
+                with self.metrics.time("hash"):
+                    checksum = await loop.run_in_executor(None, sha1_of, uploads.original)
+                indexed = self._indexed_match(post, checksum)
+                if indexed is not None:
+                    return indexed
+
+            if self.upload_mode == "thumbnail":
+                with self.metrics.time("thumbnail"):
+                    uploads.small = thumbnail_upload(post, await self.baka.get_post_thumbnail(post))
+            elif self.upload_mode == "downscale":
+                uploads.full, uploads.jxl_cache_hit = await self._load_full_async(post, uploads.take_original())
+                with self.metrics.time("downscale"):
+                    uploads.small = await loop.run_in_executor(
+                        None, downscale_upload, uploads.full, self.downscale_max_edge
+                    )
+
+            if uploads.small is not None:
+                with self.metrics.time("reverse_search"):
+                    selection = self._select(await self.oxi.reverse_search(uploads.small))
+                small_match = self._small_match(post, uploads, selection)
+                if small_match is not None:
+                    return small_match
+
+            if uploads.full is None:
+                uploads.full, uploads.jxl_cache_hit = await self._load_full_async(post, uploads.take_original())
+            with self.metrics.time("reverse_search"):
+                selection = self._select(await self.oxi.reverse_search(uploads.full))
+            return self._full_match(post, uploads, selection)
+        finally:
+            uploads.close()
+
+
+def apply_post_match(migrator: Migrator, match: PostMatch, metrics: Metrics) -> tuple[list[str], list[str]]:
+    """
+    Write half of a post migration. Must run on a single thread.
+
+    Returns (tags added, sources added).
+    """
+    if match.from_cache:
+        metrics.inc("search_cache_hits")
+    if match.from_index:
+        metrics.inc("index_hits")
+    if match.jxl_cache_hit:
+        metrics.inc("jxl_cache_hits")
+    if match.propagated_from is not None:
+        metrics.inc("group_propagated")
+    metrics.inc("uploaded_bytes", match.uploaded_bytes)
+    metrics.inc("saved_bytes", match.saved_bytes)
+    if not match.matched_post:
+        if match.match_kind == "too_far":
+            metrics.inc("too_far_similar")
+        return [], []
+
+    metrics.inc("matched")
+    if match.match_kind == "exact":
+        metrics.inc("exact_matched")
+    elif match.match_kind == "similar":
+        metrics.inc("similar_matched")
+        if match.distance is not None:
+            print(f"[post:{match.post_id}] using similar match (distance={match.distance:.6f})")
+    if match.propagated_from is not None:
+        print(f"[post:{match.post_id}] using match of duplicate post {match.propagated_from}")
+
+    with traced_post(match.post_id), metrics.time("write"):
+        discovered, added, discovered_sources, added_sources = migrator.migrate_post(
+            post_id=match.post_id,
+            post_tags=match.post_tags,
+            oxi_post=match.matched_post,
+        )
+    metrics.inc("discovered_tags", discovered)
+    metrics.inc("added_tags", len(added))
+    metrics.inc("discovered_sources", discovered_sources)
+    metrics.inc("added_sources", len(added_sources))
+    return added, added_sources
+
+
+def record_outcome(
+    journal: MigrationJournal | None,
+    result: PostMatch | PostFailure,
+    applied: tuple[list[str], list[str]],
+    plan: MigrationPlan | None = None,
+) -> None:
+    if plan is not None and isinstance(result, PostMatch):
+        plan.record(result, applied)
+    if journal is None:
+        return
+    if isinstance(result, PostFailure):
+        journal.record(result.post_id, result.content_hash, "failed", error=str(result.error))
+        return
+    tags, sources = applied
+    journal.record(
+        result.post_id,
+        result.content_hash,
+        result.match_kind,
+        distance=result.distance,
+        tags=tags,
+        sources=sources,
+    )
+
+
+def should_skip_post(
+    post: dict[str, Any],
+    journal: MigrationJournal | None,
+    metrics: Metrics,
+    video: bool = False,
+) -> bool:
+    """Listing-level filters shared by both runners; updates skip counters."""
+    if not is_supported_content_type(str(post.get("contentType") or ""), video):
+        metrics.inc("skipped_type")
+        return True
+    if journal is not None and journal.is_completed(int(post["id"]), str(post.get("contentHash") or "")):
+        metrics.inc("skipped_journal")
+        return True
+    return False
+
+
+def run_migration(
+    baka: BakabooruClient,
+    matcher: PostMatcher,
+    migrator: Migrator,
+    args: argparse.Namespace,
+    metrics: Metrics,
+    journal: MigrationJournal | None = None,
+    plan: MigrationPlan | None = None,
+    pages: Iterator[list[dict[str, Any]]] | None = None,
+    completed: set[int] | None = None,
+    failed: set[int] | None = None,
+) -> int:
+    """
+    Drive the scan as a bounded pipeline:
+      listing (one page prefetched) -> match workers -> single writer (this thread)
 
-            canonical_name = str(names[0]).strip()
-            if not canonical_name:
-                continue
+    With `--workers 1` everything runs inline on the calling thread. Otherwise
+    at most `--workers * 2` posts are in flight, so memory stays flat no matter
+    how large the library is. Counters are only touched by the writer.
+    `pages` replaces the library listing (`--follow` feeds newly imported posts)
+    and `completed` and `failed`, when given, collect the ids of posts that
+    were applied or skipped and of those that failed.
+    """
+    workers = max(1, args.workers)
+    max_posts = args.max_posts if args.max_posts > 0 else None
+    max_in_flight = workers * 2
+    stop = threading.Event()
+    completed = set() if completed is None else completed
+    failed = set() if failed is None else failed
 
-            canonical_name = normalize_name(canonical_name)
-            if canonical_name in seen_input_tags:
-                continue
-            seen_input_tags.add(canonical_name)
-            discovered_count += 1
+    if pages is None:
+        pages = iter_scheduled_pages(baka, args, metrics)
+    executor: ThreadPoolExecutor | InlineExecutor
+    if workers > 1:
+        pages = prefetch_pages(pages, stop)
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="match")
+    else:
+        executor = InlineExecutor()
 
-            category_name = oxi_tag.get("category")
-            category_id = self.ensure_category(str(category_name) if category_name else None)
-            self.ensure_tag(canonical_name, category_id)
+    def run_match(post: dict[str, Any]) -> PostMatch | PostFailure:
+        post_id = int(post["id"])
+        try:
+            with traced_post(post_id):
+                return matcher.match(post)
+        except Exception as exc:
+            return PostFailure(post_id=post_id, content_hash=str(post.get("contentHash") or ""), error=exc)
 
-            if canonical_name in current_post_tags:
-                continue
+    def settle(future: Future) -> bool:
+        """Apply one finished match. Returns False when the run must abort."""
+        result = future.result()
+        if isinstance(result, PostMatch):
+            try:
+                record_outcome(journal, result, apply_post_match(migrator, result, metrics), plan)
+                completed.add(result.post_id)
+                return True
+            except Exception as exc:
+                result = PostFailure(post_id=result.post_id, content_hash=result.content_hash, error=exc)
 
-            if self.dry_run:
-                print(f"[dry-run] add tag '{canonical_name}' to post {post_id}")
-                added_count += 1
-                current_post_tags.add(canonical_name)
-                continue
+        record_outcome(journal, result, ([], []))
+        failed.add(result.post_id)
+        metrics.inc("failed")
+        print(f"[error] post {result.post_id}: {result.error}", file=sys.stderr)
+        return not args.fail_fast
 
-            added, status = self.baka.add_tag_to_post(post_id, canonical_name)
-            if added:
-                print(f"[post:{post_id}] +tag '{canonical_name}'")
-                added_count += 1
-                current_post_tags.add(canonical_name)
-            elif status == 409:
-                current_post_tags.add(canonical_name)
+    pending: set[Future] = set()
 
-        return discovered_count, added_count
+    def drain(until: int) -> bool:
+        nonlocal pending
+        while len(pending) > until:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if not settle(future):
+                    return False
+        return True
 
-    def migrate_post_sources(self, post_id: int, oxi_post: dict[str, Any]) -> tuple[int, int]:
-        oxi_sources = extract_oxibooru_sources(oxi_post)
-        discovered_count = len(oxi_sources)
-        if discovered_count == 0:
-            return 0, 0
+    exit_code = 0
+    try:
+        for items in pages:
+            for post in items:
+                if max_posts is not None and metrics.get("scanned") >= max_posts:
+                    break
 
-        current_sources = self.baka.get_post_sources(post_id)
-        current_lookup = {s.strip() for s in current_sources}
-        to_add = [s for s in oxi_sources if s.strip() not in current_lookup]
-        if not to_add:
-            return discovered_count, 0
+                metrics.inc("scanned")
+                if should_skip_post(post, journal, metrics, video=args.video_frames > 0):
+                    completed.add(int(post["id"]))
+                    continue
 
-        if self.dry_run:
-            for source in to_add:
-                print(f"[dry-run] add source to post {post_id}: {source}")
-            return discovered_count, len(to_add)
+                metrics.inc("processed")
+                pending.add(executor.submit(run_match, post))
+                if not drain(max_in_flight - 1):
+                    exit_code = 1
+                    break
 
-        merged_sources = current_sources + to_add
-        self.baka.set_post_sources(post_id, merged_sources)
-        for source in to_add:
-            print(f"[post:{post_id}] +source '{source}'")
-        return discovered_count, len(to_add)
+            if exit_code or (max_posts is not None and metrics.get("scanned") >= max_posts):
+                break
 
+        if exit_code == 0 and not drain(0):
+            exit_code = 1
+        if exit_code == 0 and max_posts is not None and metrics.get("scanned") >= max_posts:
+            print("[done] reached --max-posts limit")
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
 
-def extract_oxibooru_sources(oxi_post: dict[str, Any]) -> list[str]:
+    return exit_code
+
+
+async def iter_post_pages_async(
+    baka: AsyncBakabooruClient,
+    after_id: int,
+    page_size: int,
+    user_query: str | None = None,
+    metrics: Metrics | None = None,
+    shard: tuple[int, int] | None = None,
+    count_total: bool = True,
+    media_types: str = SCAN_MEDIA_TYPES,
+) -> Any:
+    """Async keyset listing that requests the next page before yielding the current one."""
+    metrics = metrics or Metrics()
+
+    async def fetch_page(cursor: int) -> dict[str, Any]:
+        with metrics.time("list"):
+            return await baka.get_posts_page(page=1, page_size=page_size, query=build_scan_query(cursor, user_query, media_types))
+
+    def fetch(cursor: int) -> asyncio.Future:
+        return asyncio.ensure_future(fetch_page(cursor))
+
+    cursor = after_id
+    next_fetch = fetch(cursor)
+    try:
+        while True:
+            page_payload = await next_fetch
+            if cursor == after_id and count_total:
+                metrics.set_total(shard_total(read_page_total(page_payload), shard))
+            items = read_page_items(page_payload)
+            if not items:
+                return
+
+            mine = shard_page(cursor, items, shard)
+            has_more = len(items) >= page_size
+            if has_more:
+                cursor = int(items[-1]["id"])
+                next_fetch = fetch(cursor)
+            if mine:
+                yield mine
+
+            if not has_more:
+                return
+    finally:
+        if not next_fetch.done():
+            next_fetch.cancel()
+
+
+async def iter_scheduled_pages_async(
+    baka: AsyncBakabooruClient,
+    args: argparse.Namespace,
+    metrics: Metrics,
+) -> Any:
+    """asyncio counterpart of `iter_scheduled_pages`."""
+    schedule = ScanSchedule(args)
+    totals = [
+        read_page_total(await baka.get_posts_page(page=1, page_size=1, query=query))
+        for query in schedule.count_queries()
+    ]
+    if totals:
+        schedule.set_total(metrics, totals)
+    for number, query in enumerate(schedule.queries):
+        pages = iter_post_pages_async(baka, metrics=metrics, **schedule.pass_kwargs(query))
+        try:
+            async for items in pages:
+                released = schedule.admit(number, items)
+                if released:
+                    yield released
+        finally:
+            await pages.aclose()
+        for items in schedule.drain():
+            yield items
+
+
+async def run_migration_async(
+    baka: AsyncBakabooruClient,
+    matcher: PostMatcher,
+    migrator: Migrator,
+    writer: ThreadPoolExecutor,
+    args: argparse.Namespace,
+    metrics: Metrics,
+    journal: MigrationJournal | None = None,
+    plan: MigrationPlan | None = None,
+    pages: AsyncIterator[list[dict[str, Any]]] | None = None,
+    completed: set[int] | None = None,
+    failed: set[int] | None = None,
+) -> int:
     """
-    Oxibooru post has a single `source` field, but we normalize into list and
-    support multi-line values.
+    asyncio counterpart of `run_migration`. Up to `--workers` posts are matched
+    concurrently on the event loop; writes are handed to the single `writer`
+    thread, which keeps `Migrator` state and the write counters single-threaded.
     """
-    raw = oxi_post.get("source")
-    if raw is None:
+    loop = asyncio.get_running_loop()
+    max_posts = args.max_posts if args.max_posts > 0 else None
+    max_in_flight = max(1, args.workers)
+    completed = set() if completed is None else completed
+    failed = set() if failed is None else failed
+
+    async def run_match(post: dict[str, Any]) -> PostMatch | PostFailure:
+        try:
+            with traced_post(int(post["id"])):
+                return await matcher.match_async(post)
+        except Exception as exc:
+            return PostFailure(post_id=int(post["id"]), content_hash=str(post.get("contentHash") or ""), error=exc)
+
+    async def settle(task: asyncio.Task) -> bool:
+        result = task.result()
+        if isinstance(result, PostMatch):
+            try:
+                applied = await loop.run_in_executor(writer, apply_post_match, migrator, result, metrics)
+                record_outcome(journal, result, applied, plan)
+                completed.add(result.post_id)
+                return True
+            except Exception as exc:
+                result = PostFailure(post_id=result.post_id, content_hash=result.content_hash, error=exc)
+
+        record_outcome(journal, result, ([], []))
+        failed.add(result.post_id)
+        metrics.inc("failed")
+        print(f"[error] post {result.post_id}: {result.error}", file=sys.stderr)
+        return not args.fail_fast
+
+    pending: set[asyncio.Task] = set()
+
+    async def drain(until: int) -> bool:
+        nonlocal pending
+        while len(pending) > until:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not await settle(task):
+                    return False
+        return True
+
+    if pages is None:
+        pages = iter_scheduled_pages_async(baka, args, metrics)
+    exit_code = 0
+    try:
+        async for items in pages:
+            for post in items:
+                if max_posts is not None and metrics.get("scanned") >= max_posts:
+                    break
+
+                metrics.inc("scanned")
+                if should_skip_post(post, journal, metrics, video=args.video_frames > 0):
+                    completed.add(int(post["id"]))
+                    continue
+
+                metrics.inc("processed")
+                pending.add(asyncio.ensure_future(run_match(post)))
+                if not await drain(max_in_flight - 1):
+                    exit_code = 1
+                    break
+
+            if exit_code or (max_posts is not None and metrics.get("scanned") >= max_posts):
+                break
+
+        if exit_code == 0 and not await drain(0):
+            exit_code = 1
+        if exit_code == 0 and max_posts is not None and metrics.get("scanned") >= max_posts:
+            print("[done] reached --max-posts limit")
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await pages.aclose()
+
+    return exit_code
+
+
+def parse_import_date(value: Any) -> float:
+    """Epoch seconds of a .NET timestamp (up to 7 fractional digits; UTC when it has no offset)."""
+    match = re.fullmatch(r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?(Z|[+-]\d\d:\d\d)?", str(value or "").strip())
+    if match is None:
+        raise RuntimeError(f"Unrecognized Bakabooru import date {value!r}")
+    base, fraction, zone = match.groups()
+    moment = datetime.fromisoformat(base + (zone if zone and zone != "Z" else "+00:00"))
+    return moment.timestamp() + (float(fraction) if fraction else 0.0)
+
+
+def import_position(post: dict[str, Any]) -> tuple[float, int]:
+    return parse_import_date(post.get("importDate")), int(post["id"])
+
+
+def build_follow_query(user_query: str | None = None, media_types: str = SCAN_MEDIA_TYPES) -> str:
+    """Newest imports first; like `build_scan_query`, our directives come last."""
+    parts = [user_query.strip()] if user_query and user_query.strip() else []
+    parts.extend([f"type:{media_types}", "sort:import-date_desc"])
+    return " ".join(parts)
+
+
+class FollowWatermark:
+    """
+    How far `--follow` has got in Bakabooru's import order: the newest
+    (import date, id) handed to the pipeline.
+
+    Import dates are taken before a scan's insert commits, so a slow batch can
+    become visible behind posts that are already past the watermark. Polls
+    therefore look `LOOKBACK` seconds below it and skip the posts they have
+    already seen there.
+
+    `failures` counts the failed attempts of posts the watermark is held on,
+    so that one which keeps failing is passed after `FOLLOW_MAX_ATTEMPTS`.
+    """
+
+    LOOKBACK = 600.0
+
+    def __init__(self, import_date: str, post_id: int) -> None:
+        self.import_date = import_date
+        self.post_id = post_id
+        self.position = (parse_import_date(import_date), post_id)
+        self.recent: dict[int, float] = {}
+        self.failures: dict[int, int] = {}
+        # (totalCount, newest id) of the last poll; unchanged means nothing to do.
+        self.signature: tuple[int | None, int | None] | None = None
+
+    @classmethod
+    def from_json(cls, text: str) -> FollowWatermark:
+        payload = json.loads(text)
+        watermark = cls(str(payload["importDate"]), int(payload["id"]))
+        watermark.failures = {int(post_id): int(count) for post_id, count in payload.get("failures", {}).items()}
+        return watermark
+
+    def to_json(self) -> str:
+        payload: dict[str, Any] = {"importDate": self.import_date, "id": self.post_id}
+        if self.failures:
+            payload["failures"] = {str(post_id): count for post_id, count in self.failures.items()}
+        return json.dumps(payload)
+
+    def is_new(self, post: dict[str, Any]) -> bool:
+        position = import_position(post)
+        if position > self.position:
+            return True
+        return position[0] >= self.position[0] - self.LOOKBACK and position[1] not in self.recent
+
+    def reaches_past(self, post: dict[str, Any]) -> bool:
+        """Whether posts listed after `post` can no longer be new."""
+        return parse_import_date(post.get("importDate")) < self.position[0] - self.LOOKBACK
+
+    def record_failures(self, post_ids: Iterable[int]) -> set[int]:
+        """Count one more failed attempt of each post; returns those out of attempts."""
+        exhausted: set[int] = set()
+        for post_id in post_ids:
+            self.failures[post_id] = self.failures.get(post_id, 0) + 1
+            if self.failures[post_id] >= FOLLOW_MAX_ATTEMPTS:
+                exhausted.add(post_id)
+        return exhausted
+
+    def advance(self, posts: list[dict[str, Any]]) -> None:
+        for post in posts:
+            position = import_position(post)
+            self.recent[position[1]] = position[0]
+            self.failures.pop(position[1], None)
+            if position > self.position:
+                self.position = position
+                self.import_date = str(post.get("importDate"))
+                self.post_id = position[1]
+        horizon = self.position[0] - self.LOOKBACK
+        self.recent = {post_id: at for post_id, at in self.recent.items() if at >= horizon}
+
+
+def follow_signature(page_payload: dict[str, Any]) -> tuple[int | None, int | None]:
+    items = read_page_items(page_payload)
+    return read_page_total(page_payload), (int(items[0]["id"]) if items else None)
+
+
+class FollowPoll:
+    """
+    One `--follow` poll of the newest-first listing, shared by both runners:
+    whether the listing changed since the last poll, which page to read
+    next, and the new posts found on the way.
+    """
+
+    def __init__(self, watermark: FollowWatermark, args: argparse.Namespace) -> None:
+        self.watermark = watermark
+        self.args = args
+        self.query = build_follow_query(args.query, scan_media_types(args))
+        self.signature: tuple[int | None, int | None] | None = None
+        self.found: dict[int, dict[str, Any]] = {}
+
+    def changed(self, head_payload: dict[str, Any]) -> bool:
+        """Whether the one-post head of the listing differs from the last poll's."""
+        self.signature = follow_signature(head_payload)
+        return self.signature != self.watermark.signature
+
+    def read(self, page: int, items: list[dict[str, Any]]) -> int | None:
+        """Collect the new posts of listing page `page`; returns the next page to read, None when done."""
+        for post in items:
+            if self.watermark.reaches_past(post):
+                return None
+            if self.watermark.is_new(post):
+                self.found[int(post["id"])] = post
+        return page + 1 if len(items) >= self.args.page_size else None
+
+    def new_posts(self) -> list[dict[str, Any]]:
+        """The posts found, oldest first; the listing counts as seen from now on."""
+        self.watermark.signature = self.signature
+        return sorted((post for post in self.found.values() if in_shard(post, self.args.shard)), key=import_position)
+
+
+def poll_new_posts(
+    baka: BakabooruClient,
+    watermark: FollowWatermark,
+    args: argparse.Namespace,
+    metrics: Metrics,
+) -> list[dict[str, Any]]:
+    """
+    Posts imported past the watermark, oldest first. An idle poll is a single
+    one-post request; the listing is only walked when its head or total changed.
+    """
+    poll = FollowPoll(watermark, args)
+    with metrics.time("list"):
+        head = baka.get_posts_page(page=1, page_size=1, query=poll.query)
+    if not poll.changed(head):
         return []
 
-    if isinstance(raw, str):
-        candidates = raw.splitlines()
-    elif isinstance(raw, list):
-        candidates = [x for x in raw if isinstance(x, str)]
-    else:
+    page: int | None = 1
+    while page is not None:
+        with metrics.time("list"):
+            items = read_page_items(baka.get_posts_page(page=page, page_size=args.page_size, query=poll.query))
+        page = poll.read(page, items)
+    return poll.new_posts()
+
+
+async def poll_new_posts_async(
+    baka: AsyncBakabooruClient,
+    watermark: FollowWatermark,
+    args: argparse.Namespace,
+    metrics: Metrics,
+) -> list[dict[str, Any]]:
+    poll = FollowPoll(watermark, args)
+    with metrics.time("list"):
+        head = await baka.get_posts_page(page=1, page_size=1, query=poll.query)
+    if not poll.changed(head):
         return []
 
-    result: list[str] = []
-    seen: set[str] = set()
-    for item in candidates:
-        value = item.strip()
-        if not value:
+    page: int | None = 1
+    while page is not None:
+        with metrics.time("list"):
+            items = read_page_items(await baka.get_posts_page(page=page, page_size=args.page_size, query=poll.query))
+        page = poll.read(page, items)
+    return poll.new_posts()
+
+
+def follow_state_key(args: argparse.Namespace) -> str:
+    return "follow_watermark" + (f":{args.shard[0]}/{args.shard[1]}" if args.shard else "")
+
+
+def load_follow_watermark(args: argparse.Namespace, journal: MigrationJournal | None) -> FollowWatermark | None:
+    stored = journal.get_state(follow_state_key(args)) if journal is not None else None
+    if stored is None:
+        return None
+    watermark = FollowWatermark.from_json(stored)
+    print(f"[follow] resuming after post {watermark.post_id} (imported {watermark.import_date})")
+    return watermark
+
+
+def save_follow_watermark(args: argparse.Namespace, journal: MigrationJournal | None, watermark: FollowWatermark) -> None:
+    if journal is not None:
+        journal.set_state(follow_state_key(args), watermark.to_json())
+
+
+def completed_prefix(posts: list[dict[str, Any]], completed: set[int]) -> list[dict[str, Any]]:
+    """
+    The leading posts (in import order) that completed. The watermark must not
+    pass a post that --max-posts cut off or that was still in flight, or it is
+    never retried.
+    """
+    for index, post in enumerate(posts):
+        if int(post["id"]) not in completed:
+            return posts[:index]
+    return posts
+
+
+def advance_follow_watermark(
+    watermark: FollowWatermark,
+    posts: list[dict[str, Any]],
+    completed: set[int],
+    failed: set[int],
+) -> None:
+    """
+    Move the watermark over the settled head of one poll's posts. A failed post
+    holds it until it has failed `FOLLOW_MAX_ATTEMPTS` times; without that cap
+    one broken post would have every later one re-run on each poll.
+    """
+    exhausted = watermark.record_failures(failed)
+    for post_id in sorted(exhausted):
+        print(f"[follow] giving up on post {post_id} after {FOLLOW_MAX_ATTEMPTS} failed attempts")
+    done = completed_prefix(posts, completed | exhausted)
+    watermark.advance(done)
+    if len(done) < len(posts):
+        # Make the next poll walk the listing even if its head is unchanged.
+        watermark.signature = None
+        print(f"[follow] {len(posts) - len(done)} posts from post {posts[len(done)]['id']} on will be retried")
+
+
+@dataclass
+class FollowBatch:
+    """One poll's new posts on their way through the pipeline, which fills `completed` and `failed`."""
+
+    posts: list[dict[str, Any]]
+    completed: set[int] = field(default_factory=set)
+    failed: set[int] = field(default_factory=set)
+
+    @classmethod
+    def start(cls, posts: list[dict[str, Any]], metrics: Metrics) -> FollowBatch:
+        print(f"[follow] {len(posts)} new posts")
+        metrics.set_total(metrics.get("scanned") + len(posts))
+        return cls(posts)
+
+    def finish(self, watermark: FollowWatermark, args: argparse.Namespace, journal: MigrationJournal | None) -> None:
+        advance_follow_watermark(watermark, self.posts, self.completed, self.failed)
+        save_follow_watermark(args, journal, watermark)
+
+
+def reached_max_posts(args: argparse.Namespace, metrics: Metrics) -> bool:
+    return args.max_posts > 0 and metrics.get("scanned") >= args.max_posts
+
+
+def newest_import(page_payload: dict[str, Any]) -> FollowWatermark:
+    items = read_page_items(page_payload)
+    if not items:
+        # Empty library: everything that shows up later is new.
+        return FollowWatermark("1970-01-01T00:00:00Z", 0)
+    return FollowWatermark(str(items[0].get("importDate")), int(items[0]["id"]))
+
+
+def finish_initial_scan(
+    exit_code: int,
+    watermark: FollowWatermark,
+    args: argparse.Namespace,
+    metrics: Metrics,
+    journal: MigrationJournal | None,
+) -> bool:
+    """Store the watermark after `--follow`'s library scan; returns whether to go on polling."""
+    if exit_code or reached_max_posts(args, metrics):
+        # A scan cut short by --max-posts is not done; the next run repeats it.
+        return False
+    save_follow_watermark(args, journal, watermark)
+    return True
+
+
+def follow(
+    baka: BakabooruClient,
+    matcher: PostMatcher,
+    migrator: Migrator,
+    args: argparse.Namespace,
+    metrics: Metrics,
+    journal: MigrationJournal | None = None,
+    plan: MigrationPlan | None = None,
+) -> int:
+    """
+    `--follow`: migrate the library once (unless a stored watermark says this
+    was done), then poll every `--poll-interval` seconds for new imports and
+    push them through the same pipeline. Runs until interrupted or --max-posts.
+    """
+    watermark = load_follow_watermark(args, journal)
+    if watermark is None:
+        # Taken before the scan, so posts imported while it runs are picked up
+        # afterwards; what is already listed is the scan's job.
+        watermark = newest_import(
+            baka.get_posts_page(page=1, page_size=1, query=build_follow_query(args.query, scan_media_types(args)))
+        )
+        watermark.advance(poll_new_posts(baka, watermark, args, metrics))
+        exit_code = run_migration(baka, matcher, migrator, args, metrics, journal, plan)
+        if not finish_initial_scan(exit_code, watermark, args, metrics, journal):
+            return exit_code
+
+    print(f"[follow] polling for imports after post {watermark.post_id} every {args.poll_interval:g}s")
+    while not reached_max_posts(args, metrics):
+        time.sleep(args.poll_interval)
+        posts = poll_new_posts(baka, watermark, args, metrics)
+        if not posts:
             continue
-        key = value.lower()
-        if key in seen:
+
+        batch = FollowBatch.start(posts, metrics)
+        exit_code = run_migration(
+            baka,
+            matcher,
+            migrator,
+            args,
+            metrics,
+            journal,
+            plan,
+            pages=iter([posts]),
+            completed=batch.completed,
+            failed=batch.failed,
+        )
+        batch.finish(watermark, args, journal)
+        if exit_code:
+            return exit_code
+    return 0
+
+
+async def follow_async(
+    baka: AsyncBakabooruClient,
+    matcher: PostMatcher,
+    migrator: Migrator,
+    writer: ThreadPoolExecutor,
+    args: argparse.Namespace,
+    metrics: Metrics,
+    journal: MigrationJournal | None = None,
+    plan: MigrationPlan | None = None,
+) -> int:
+    """asyncio counterpart of `follow`."""
+
+    async def single_page(posts: list[dict[str, Any]]) -> AsyncIterator[list[dict[str, Any]]]:
+        yield posts
+
+    watermark = load_follow_watermark(args, journal)
+    if watermark is None:
+        watermark = newest_import(
+            await baka.get_posts_page(page=1, page_size=1, query=build_follow_query(args.query, scan_media_types(args)))
+        )
+        watermark.advance(await poll_new_posts_async(baka, watermark, args, metrics))
+        exit_code = await run_migration_async(baka, matcher, migrator, writer, args, metrics, journal, plan)
+        if not finish_initial_scan(exit_code, watermark, args, metrics, journal):
+            return exit_code
+
+    print(f"[follow] polling for imports after post {watermark.post_id} every {args.poll_interval:g}s")
+    while not reached_max_posts(args, metrics):
+        await asyncio.sleep(args.poll_interval)
+        posts = await poll_new_posts_async(baka, watermark, args, metrics)
+        if not posts:
             continue
-        seen.add(key)
-        result.append(value)
-    return result
+
+        batch = FollowBatch.start(posts, metrics)
+        exit_code = await run_migration_async(
+            baka,
+            matcher,
+            migrator,
+            writer,
+            args,
+            metrics,
+            journal,
+            plan,
+            pages=single_page(posts),
+            completed=batch.completed,
+            failed=batch.failed,
+        )
+        batch.finish(watermark, args, journal)
+        if exit_code:
+            return exit_code
+    return 0
+
+
+async def main_async(
+    args: argparse.Namespace,
+    metrics: Metrics,
+    journal: MigrationJournal | None,
+    cache: ReverseSearchCache | None,
+    index: OxibooruChecksumIndex | None,
+    plan: MigrationPlan | None = None,
+    tag_snapshot: TagSnapshot | None = None,
+) -> int:
+    baka = AsyncBakabooruClient(
+        api_base=args.bakabooru_api,
+        timeout=args.timeout,
+        limit_per_host=args.max_connections_per_host,
+        keepalive_timeout=args.keepalive_timeout,
+        retry=retry_policy(args),
+    )
+    oxi = async_oxibooru_client(args)
+    baka.metrics = oxi.metrics = metrics
+    async with baka, oxi:
+        if args.bakabooru_username and args.bakabooru_password:
+            await baka.login(args.bakabooru_username, args.bakabooru_password)
+        groups = group_sharing(args, await baka.get_duplicate_groups()) if args.duplicate_groups else None
+        library = library_files(args, await baka.get_libraries()) if args.library_root_map is not None else None
+
+        limiters = build_limiters(args) if args.adaptive_concurrency else None
+        register_limit_gauges(metrics, limiters)
+        baka, oxi = limit_clients(baka, oxi, limiters)
+        loop = asyncio.get_running_loop()
+        writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+        try:
+            migrator = await loop.run_in_executor(
+                writer,
+                lambda: Migrator(
+                    baka=BlockingClientAdapter(baka, loop),
+                    oxi_categories=BlockingClientAdapter(oxi, loop).get_tag_categories(),
+                    dry_run=args.dry_run,
+                    legacy_writes=args.legacy_writes,
+                    shard=args.shard,
+                    tag_snapshot=tag_snapshot,
+                ),
+            )
+            if plan is not None:
+                plan.write_categories(migrator.oxi_categories)
+            matcher = PostMatcher(
+                baka,
+                oxi,
+                args.max_similar_distance,
+                cache,
+                upload_mode=args.upload_mode,
+                downscale_max_edge=args.downscale_max_edge,
+                jxl_decoder=JxlDecoder(args.jxl_processes, args.jxl_cache),
+                spool_memory=args.spool_memory_mb * 1024 * 1024,
+                budget=AsyncByteBudget(args.inflight_budget_mb * 1024 * 1024),
+                index=index,
+                metrics=metrics,
+                groups=groups,
+                video=video_extractor(args),
+                library=library,
+            )
+            if args.follow:
+                return await follow_async(baka, matcher, migrator, writer, args, metrics, journal, plan)
+            return await run_migration_async(baka, matcher, migrator, writer, args, metrics, journal, plan)
+        finally:
+            # The writer may still be blocked on a request that needs this loop.
+            await asyncio.to_thread(writer.shutdown, True)
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Migrate tags/categories from Oxibooru to Bakabooru using reverse image search."
     )
-    parser.add_argument("--bakabooru-api", default=DEFAULT_BAKABOORU_API, help="Bakabooru API base URL.")
-    parser.add_argument("--oxibooru-api", default=DEFAULT_OXIBOORU_API, help="Oxibooru API base URL.")
-    parser.add_argument("--bakabooru-username", default=None, help="Bakabooru username (optional).")
-    parser.add_argument("--bakabooru-password", default=None, help="Bakabooru password (optional).")
+    parser.add_argument("--bakabooru-api", default=DEFAULT_BAKABOORU_API, help="Bakabooru API base URL.")
+    parser.add_argument(
+        "--oxibooru-api",
+        default=DEFAULT_OXIBOORU_API,
+        help=(
+            "Oxibooru API base URL. Several comma-separated replica URLs spread reverse searches by load "
+            "and hedge slow ones; other calls use the first."
+        ),
+    )
+    parser.add_argument(
+        "--hedge-quantile",
+        type=float,
+        default=0.95,
+        help=(
+            "With several --oxibooru-api replicas, send a duplicate reverse search to another replica once "
+            "one has run longer than this quantile of recent search latencies (0 = never hedge)."
+        ),
+    )
+    parser.add_argument("--bakabooru-username", default=None, help="Bakabooru username (optional).")
+    parser.add_argument("--bakabooru-password", default=None, help="Bakabooru password (optional).")
+    parser.add_argument(
+        "--oxibooru-auth-header",
+        default=None,
+        help="Optional Oxibooru Authorization header value (e.g. 'Token <base64>' or 'Basic <base64>').",
+    )
+    parser.add_argument("--page-size", type=int, default=100, help="Bakabooru posts page size.")
+    parser.add_argument(
+        "--after-id",
+        type=int,
+        default=0,
+        help="Only scan Bakabooru posts with an id greater than this (resume point).",
+    )
+    parser.add_argument(
+        "--query",
+        default=None,
+        help="Extra Bakabooru search query applied server-side (e.g. '-favorite:true tag-count:0').",
+    )
+    parser.add_argument("--max-posts", type=int, default=0, help="Stop after processing this many posts (0 = no limit).")
+    parser.add_argument(
+        "--priority",
+        default=None,
+        help=(
+            "Comma-separated scheduling policy so that a time-boxed run adds the most tags first: "
+            "'untagged' (a tag-count:0 pass before the rest), 'smallest' (by file size), 'jxl-last' "
+            "(skip decodes until later), e.g. 'untagged,smallest'. Default: listing (id) order."
+        ),
+    )
+    parser.add_argument(
+        "--duplicate-groups",
+        action="store_true",
+        help=(
+            "Reverse-search one post per unresolved Bakabooru duplicate group and apply its match "
+            "to the other members."
+        ),
+    )
+    parser.add_argument(
+        "--group-min-similarity",
+        type=int,
+        default=90,
+        help="Minimum similarity percent of a perceptual duplicate group for --duplicate-groups (exact groups always share).",
+    )
+    parser.add_argument(
+        "--priority-window",
+        type=int,
+        default=2000,
+        help="Listed posts held back for --priority reordering by size/format (bounds memory).",
+    )
+    parser.add_argument(
+        "--max-similar-distance",
+        type=float,
+        default=0.05,
+        help="Accept similar reverse-search match only when distance is <= this value.",
+    )
+    parser.add_argument(
+        "--upload-mode",
+        choices=UPLOAD_MODES,
+        default="full",
+        help=(
+            "What to reverse-search first: the original file, the Bakabooru thumbnail, or a local "
+            "downscale (Pillow). Non-full modes fall back to the original when nothing matches."
+        ),
+    )
+    parser.add_argument(
+        "--downscale-max-edge",
+        type=int,
+        default=512,
+        help="Longest edge in pixels for --upload-mode downscale.",
+    )
+    parser.add_argument(
+        "--jxl-processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Maximum concurrent djxl decoder processes.",
+    )
+    parser.add_argument(
+        "--library-root-map",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="SERVER=LOCAL[,...]",
+        help=(
+            "Read post files directly from Bakabooru's library folders (memory-mapped) instead of over HTTP, "
+            "falling back to HTTP per file. Optional comma-separated SERVER=LOCAL prefixes translate the "
+            "library paths Bakabooru reports, e.g. when it runs in a container."
+        ),
+    )
+    parser.add_argument(
+        "--library-verify-hash",
+        action="store_true",
+        help="With --library-root-map, check each file against Bakabooru's content hash (needs 'xxhash').",
+    )
+    parser.add_argument(
+        "--video-frames",
+        type=int,
+        default=0,
+        help=(
+            "Also migrate video posts by reverse-searching this many frames each, extracted by "
+            "ffmpeg over HTTP range requests (0 = skip videos)."
+        ),
+    )
+    parser.add_argument(
+        "--video-processes",
+        type=int,
+        default=max(1, (os.cpu_count() or 1) // 2),
+        help="Maximum concurrent ffprobe/ffmpeg processes for --video-frames.",
+    )
+    parser.add_argument(
+        "--video-timeout",
+        type=int,
+        default=120,
+        help="Seconds before one ffprobe/ffmpeg call for a video post is abandoned.",
+    )
+    parser.add_argument(
+        "--jxl-cache",
+        default=None,
+        help="Directory for decoded JXL->JPEG files, keyed by content hash (reused across runs).",
+    )
+    parser.add_argument(
+        "--spool-memory-mb",
+        type=int,
+        default=16,
+        help="Per-file content kept in memory; larger files spill to a temporary file.",
+    )
+    parser.add_argument(
+        "--inflight-budget-mb",
+        type=int,
+        default=512,
+        help="In-memory content budget shared by all in-flight posts (new downloads wait beyond it).",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Do not write changes to Bakabooru.")
+    parser.add_argument(
+        "--legacy-writes",
+        action="store_true",
+        help="Add tags one request at a time and sources via /sources instead of one metadata update per post.",
+    )
+    parser.add_argument(
+        "--plan",
+        default=None,
+        metavar="PLAN.jsonl",
+        help=(
+            "Dry run that records every match decision and the tag, category and source changes it "
+            "implies to this JSON Lines file, for review and a later --apply."
+        ),
+    )
+    parser.add_argument(
+        "--apply",
+        default=None,
+        metavar="PLAN.jsonl",
+        help=(
+            "Execute a --plan file: create its categories and tags up front, then write the posts in "
+            "parallel batches. Oxibooru is not contacted and no content is downloaded."
+        ),
+    )
+    parser.add_argument(
+        "--apply-batch-size",
+        type=int,
+        default=500,
+        help="Posts written per --apply batch (the journal is committed after each batch).",
+    )
+    parser.add_argument("--fail-fast", action="store_true", help="Abort on first per-post failure.")
+    parser.add_argument(
+        "--estimate",
+        type=int,
+        default=0,
+        metavar="N",
+        help=(
+            "Dry-run the full match path on a random sample of N posts and extrapolate match rates, "
+            "tags added, transfer and runtime of the whole scan with 95%% confidence intervals. "
+            "--search-cache is not used, so cached results neither skew the estimate nor get filled by it."
+        ),
+    )
+    parser.add_argument(
+        "--trace",
+        default=None,
+        help=(
+            "Write per-post spans (listing, download, decode, reverse search, every HTTP call) to this "
+            "file in Chrome trace-event format, for chrome://tracing or Perfetto."
+        ),
+    )
     parser.add_argument(
-        "--oxibooru-auth-header",
+        "--profile",
         default=None,
-        help="Optional Oxibooru Authorization header value (e.g. 'Token <base64>' or 'Basic <base64>').",
+        help="Run under cProfile (all threads), save the stats to this file and print the script's hot spots.",
     )
-    parser.add_argument("--page-size", type=int, default=100, help="Bakabooru posts page size.")
-    parser.add_argument("--start-page", type=int, default=1, help="Bakabooru start page.")
-    parser.add_argument("--max-posts", type=int, default=0, help="Stop after processing this many posts (0 = no limit).")
+    parser.add_argument("--timeout", type=int, default=60, help="HTTP timeout in seconds.")
     parser.add_argument(
-        "--max-similar-distance",
+        "--adaptive-concurrency",
+        action="store_true",
+        help=(
+            "Let Bakabooru reads, Bakabooru writes and Oxibooru searches each find their own in-flight "
+            "limit (AIMD on p95 latency and error rate), up to --workers."
+        ),
+    )
+    parser.add_argument(
+        "--adaptive-latency-factor",
+        type=float,
+        default=2.0,
+        help="Back off when a stage's p95 latency exceeds this multiple of its lowest observed p95.",
+    )
+    parser.add_argument(
+        "--adaptive-max-error-rate",
         type=float,
         default=0.05,
-        help="Accept similar reverse-search match only when distance is <= this value.",
+        help="Back off when more than this fraction of a stage's calls fail.",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=4,
+        help="Retries per request for transient failures (429/5xx, connection resets, timeouts).",
+    )
+    parser.add_argument(
+        "--retry-max-delay",
+        type=float,
+        default=30.0,
+        help="Upper bound in seconds for the exponential backoff between retries.",
+    )
+    parser.add_argument(
+        "--breaker-threshold",
+        type=int,
+        default=5,
+        help="Consecutive transient failures that pause all requests to a host (0 disables).",
+    )
+    parser.add_argument(
+        "--breaker-cooldown",
+        type=float,
+        default=30.0,
+        help="Initial pause in seconds once a host's breaker opens; doubles while failures continue.",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=10.0,
+        help="Seconds between progress lines (rate, ETA, slowest stages); 0 disables them.",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        default=None,
+        help="Write counters, stage latency histograms and per-remote traffic as JSON here at the end.",
+    )
+    parser.add_argument(
+        "--prometheus-textfile",
+        default=None,
+        help="Keep this node_exporter textfile updated with the run's metrics (every --progress-interval).",
+    )
+    parser.add_argument(
+        "--shard",
+        default=None,
+        help=(
+            "Only migrate posts with id %% N == I, given as I/N (0 <= I < N), so N processes or hosts "
+            "can split one run. Shard 0 creates the tag categories. --max-posts applies per shard."
+        ),
+    )
+    parser.add_argument(
+        "--spawn-shards",
+        type=int,
+        default=0,
+        help="Coordinate N local shard processes (--shard 0/N .. N-1/N) and merge their summaries.",
+    )
+    parser.add_argument(
+        "--merge-reports",
+        nargs="+",
+        default=None,
+        metavar="REPORT",
+        help="Merge --metrics-json reports of separate shard runs into one summary and exit.",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help=(
+            "Keep running: after the library scan, poll for newly imported posts (by import date and id) "
+            "and migrate them as they arrive. With --journal the watermark survives restarts."
+        ),
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between --follow polls; an idle poll is a single one-post listing request.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of posts downloaded/reverse-searched concurrently (1 = sequential).",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Use asyncio clients (requires aiohttp); --workers then caps in-flight posts, not threads.",
+    )
+    parser.add_argument(
+        "--max-connections-per-host",
+        type=int,
+        default=100,
+        help="Connection pool cap per remote host in --async mode.",
+    )
+    parser.add_argument(
+        "--keepalive-timeout",
+        type=float,
+        default=30.0,
+        help="Seconds an idle pooled connection is kept open in --async mode.",
+    )
+    parser.add_argument(
+        "--journal",
+        default=None,
+        help="SQLite checkpoint file. Posts already completed with the same content hash are skipped; failures are retried.",
+    )
+    parser.add_argument(
+        "--search-cache",
+        default=None,
+        help="SQLite file caching reverse-search results by content hash (disabled when omitted).",
+    )
+    parser.add_argument(
+        "--search-cache-negative-ttl",
+        type=float,
+        default=72.0,
+        help="Hours to keep cached 'none'/'too_far' results (0 = never cache them).",
+    )
+    parser.add_argument(
+        "--search-cache-max-entries",
+        type=int,
+        default=500_000,
+        help="Maximum cached results; least recently used entries are evicted beyond this.",
+    )
+    parser.add_argument("--search-cache-clear", action="store_true", help="Empty the search cache before the run.")
+    parser.add_argument(
+        "--oxibooru-index",
+        default=None,
+        help=(
+            "SQLite index of Oxibooru checksums (created if missing). Exact matches are resolved "
+            "locally by SHA-1; only misses are reverse-searched."
+        ),
+    )
+    parser.add_argument(
+        "--oxibooru-index-rebuild",
+        action="store_true",
+        help="Re-fetch the whole Oxibooru listing (picks up tag edits on already indexed posts).",
+    )
+    parser.add_argument(
+        "--tag-snapshot",
+        default=None,
+        help=(
+            "SQLite copy of the Bakabooru tag catalogue (created if missing). Reused at startup while "
+            "the server's tag count and per-category counts match it; tags the run creates are added."
+        ),
+    )
+    parser.add_argument(
+        "--oxibooru-index-skip-refresh",
+        action="store_true",
+        help="Use the index as is instead of fetching Oxibooru posts added since the last run.",
     )
-    parser.add_argument("--dry-run", action="store_true", help="Do not write changes to Bakabooru.")
-    parser.add_argument("--fail-fast", action="store_true", help="Abort on first per-post failure.")
-    parser.add_argument("--timeout", type=int, default=60, help="HTTP timeout in seconds.")
     return parser.parse_args()
 
 
@@ -623,203 +5730,851 @@ def main() -> int:
     if args.page_size < 1:
         print("Invalid --page-size", file=sys.stderr)
         return 2
-    if args.start_page < 1:
-        print("Invalid --start-page", file=sys.stderr)
+    if args.after_id < 0:
+        print("Invalid --after-id", file=sys.stderr)
         return 2
     if args.max_similar_distance < 0 or args.max_similar_distance > 1:
         print("Invalid --max-similar-distance (expected 0..1).", file=sys.stderr)
         return 2
+    if args.workers < 1:
+        print("Invalid --workers", file=sys.stderr)
+        return 2
+    if args.adaptive_latency_factor <= 1:
+        print("Invalid --adaptive-latency-factor (must be > 1)", file=sys.stderr)
+        return 2
+    if not 0 <= args.adaptive_max_error_rate < 1:
+        print("Invalid --adaptive-max-error-rate", file=sys.stderr)
+        return 2
+    if args.max_retries < 0:
+        print("Invalid --max-retries", file=sys.stderr)
+        return 2
+    if args.retry_max_delay <= 0 or args.breaker_cooldown <= 0:
+        print("Invalid --retry-max-delay/--breaker-cooldown", file=sys.stderr)
+        return 2
+    if args.breaker_threshold < 0:
+        print("Invalid --breaker-threshold", file=sys.stderr)
+        return 2
+    if args.progress_interval < 0:
+        print("Invalid --progress-interval", file=sys.stderr)
+        return 2
+    if args.merge_reports:
+        return merge_reports(args.merge_reports, args.metrics_json)
+    if args.shard is not None:
+        args.shard = parse_shard(args.shard)
+        if args.shard is None:
+            print("Invalid --shard (expected I/N with 0 <= I < N)", file=sys.stderr)
+            return 2
+    if args.spawn_shards < 0 or (args.spawn_shards and args.shard is not None):
+        print("Invalid --spawn-shards (a positive count, not combined with --shard)", file=sys.stderr)
+        return 2
+    if args.plan and (args.apply or args.spawn_shards):
+        print("--plan cannot be combined with --apply or --spawn-shards (plan each --shard separately).", file=sys.stderr)
+        return 2
+    if args.apply and (args.shard is not None or args.spawn_shards or args.use_async):
+        print("--apply cannot be combined with --shard, --spawn-shards or --async.", file=sys.stderr)
+        return 2
+    if args.apply_batch_size < 1:
+        print("Invalid --apply-batch-size", file=sys.stderr)
+        return 2
+    priority = parse_priority(args.priority)
+    if priority is None:
+        print(f"Invalid --priority (expected a comma-separated subset of {', '.join(PRIORITY_POLICIES)})", file=sys.stderr)
+        return 2
+    args.priority = priority
+    if args.priority_window < 1:
+        print("Invalid --priority-window", file=sys.stderr)
+        return 2
+    if not 0 <= args.group_min_similarity <= 100:
+        print("Invalid --group-min-similarity (expected a percent)", file=sys.stderr)
+        return 2
+    if args.follow and args.apply:
+        print("--follow cannot be combined with --apply.", file=sys.stderr)
+        return 2
+    if args.estimate < 0:
+        print("Invalid --estimate", file=sys.stderr)
+        return 2
+    if args.estimate and (
+        args.plan or args.apply or args.follow or args.shard is not None or args.spawn_shards or args.use_async
+    ):
+        print(
+            "--estimate cannot be combined with --plan, --apply, --follow, --shard, --spawn-shards or --async.",
+            file=sys.stderr,
+        )
+        return 2
+    if args.poll_interval <= 0:
+        print("Invalid --poll-interval", file=sys.stderr)
+        return 2
+    if args.spool_memory_mb < 1:
+        print("Invalid --spool-memory-mb", file=sys.stderr)
+        return 2
+    if args.inflight_budget_mb < 1:
+        print("Invalid --inflight-budget-mb", file=sys.stderr)
+        return 2
+    if args.jxl_processes < 1:
+        print("Invalid --jxl-processes", file=sys.stderr)
+        return 2
+    if args.library_root_map is not None and parse_root_map(args.library_root_map) is None:
+        print("Invalid --library-root-map (expected SERVER=LOCAL pairs separated by commas)", file=sys.stderr)
+        return 2
+    if args.library_verify_hash and args.library_root_map is None:
+        print("--library-verify-hash requires --library-root-map.", file=sys.stderr)
+        return 2
+    if args.library_verify_hash and xxhash is None:
+        print("--library-verify-hash requires the 'xxhash' package (pip install xxhash).", file=sys.stderr)
+        return 2
+    if args.video_frames < 0 or args.video_processes < 1 or args.video_timeout < 1:
+        print("Invalid --video-frames/--video-processes/--video-timeout", file=sys.stderr)
+        return 2
+    if args.video_frames and not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+        print("--video-frames requires ffmpeg and ffprobe in PATH", file=sys.stderr)
+        return 2
+    if args.downscale_max_edge < 16:
+        print("Invalid --downscale-max-edge", file=sys.stderr)
+        return 2
+    if args.upload_mode == "downscale" and Image is None:
+        print("--upload-mode downscale requires the 'Pillow' package.", file=sys.stderr)
+        return 2
+    if args.search_cache_max_entries < 1:
+        print("Invalid --search-cache-max-entries", file=sys.stderr)
+        return 2
+    if args.max_connections_per_host < 1:
+        print("Invalid --max-connections-per-host", file=sys.stderr)
+        return 2
+    if args.use_async and aiohttp is None:
+        print("--async requires the 'aiohttp' package.", file=sys.stderr)
+        return 2
     if (args.bakabooru_username and not args.bakabooru_password) or (
         args.bakabooru_password and not args.bakabooru_username
     ):
         print("Both --bakabooru-username and --bakabooru-password are required together.", file=sys.stderr)
         return 2
 
+    args.oxibooru_urls = [url.strip() for url in args.oxibooru_api.split(",") if url.strip()]
+    if not args.oxibooru_urls:
+        print("Invalid --oxibooru-api", file=sys.stderr)
+        return 2
+    args.oxibooru_api = args.oxibooru_urls[0]
+    if not 0 <= args.hedge_quantile < 1:
+        print("Invalid --hedge-quantile (expected 0 <= q < 1)", file=sys.stderr)
+        return 2
+
+    if args.spawn_shards:
+        return run_shards(args)
+    if args.plan or args.estimate:
+        # A plan is a recorded dry run, an estimate a sampled one; nothing is written to Bakabooru.
+        args.dry_run = True
+
+    # Shards commit every write so that none holds the shared write lock for long.
+    shared = args.shard is not None
+    journal = (
+        MigrationJournal(args.journal, commit_every=1 if shared else 200)
+        if args.journal and not args.dry_run
+        else None
+    )
+    if args.journal and args.dry_run:
+        print("[journal] ignored with --dry-run", file=sys.stderr)
+    if args.follow and journal is None:
+        print(
+            "[follow] no --journal: the watermark is kept in memory only, so a restart scans the whole library again",
+            file=sys.stderr,
+        )
+    plan = MigrationPlan(args.plan) if args.plan else None
+
+    # Make sure both Ctrl+C and a service-manager stop unwind through the
+    # `finally` below, even when the parent shell started us with SIGINT ignored.
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    cache: ReverseSearchCache | None = None
+    if args.search_cache and args.estimate:
+        print("[estimate] --search-cache is not used while estimating", file=sys.stderr)
+    elif args.search_cache and not args.apply:
+        cache = ReverseSearchCache(
+            args.search_cache,
+            max_similar_distance=args.max_similar_distance,
+            negative_ttl=args.search_cache_negative_ttl * 3600,
+            max_entries=args.search_cache_max_entries,
+            commit_interval=0.0 if shared else 5.0,
+        )
+        if args.search_cache_clear:
+            cache.clear()
+
+    index: OxibooruChecksumIndex | None = None
+    if args.oxibooru_index and not args.apply:
+        index = OxibooruChecksumIndex(args.oxibooru_index)
+        if args.oxibooru_index_rebuild:
+            index.rebuild()
+
+    tag_snapshot = TagSnapshot(args.tag_snapshot) if args.tag_snapshot else None
+
+    metrics = Metrics(max_posts=args.max_posts if args.max_posts > 0 else None)
+    if args.trace:
+        metrics.tracer = TraceRecorder(args.trace)
+    profiler = RunProfiler() if args.profile else None
+    reporter = ProgressReporter(metrics, args.progress_interval, args.prometheus_textfile)
+    try:
+        with reporter, profiler or nullcontext():
+            if args.apply:
+                exit_code = run_apply(args, metrics, journal, tag_snapshot)
+            else:
+                exit_code = run(args, metrics, journal, cache, index, plan, tag_snapshot)
+    except KeyboardInterrupt:
+        print("\n[interrupted] flushing journal and stopping", file=sys.stderr)
+        exit_code = 128 + signal.SIGINT
+    finally:
+        if journal is not None:
+            journal.close()
+        if cache is not None:
+            cache.close()
+        if index is not None:
+            index.close()
+        if plan is not None:
+            plan.close()
+        if tag_snapshot is not None:
+            tag_snapshot.close()
+        if metrics.tracer is not None:
+            metrics.tracer.close()
+
+    print_summary(metrics)
+    if metrics.tracer is not None:
+        print(f"[trace] written to {args.trace}")
+    if profiler is not None:
+        profiler.report(args.profile)
+    if plan is not None:
+        print(f"[plan] written to {plan.path}; run again with --apply {plan.path} to execute it")
+    if args.metrics_json:
+        report = {**metrics.report(), "exit_code": exit_code}
+        write_atomically(args.metrics_json, json.dumps(report, indent=2) + "\n")
+        print(f"[metrics] report written to {args.metrics_json}")
+    return exit_code
+
+
+def group_sharing(args: argparse.Namespace, groups: list[DuplicateGroup]) -> GroupMatchSharing:
+    sharing = GroupMatchSharing(groups, args.group_min_similarity)
+    print(f"[groups] {len(sharing)} of {len(groups)} duplicate groups share one reverse search")
+    return sharing
+
+
+def oxibooru_client(args: argparse.Namespace, pool_size: int) -> OxibooruClient | OxibooruReplicas:
+    clients = [
+        OxibooruClient(
+            api_base=url,
+            token_auth=args.oxibooru_auth_header,
+            timeout=args.timeout,
+            pool_size=pool_size,
+            retry=retry_policy(args),
+        )
+        for url in args.oxibooru_urls
+    ]
+    if len(clients) == 1:
+        return clients[0]
+    # Room for every worker's search plus its hedge.
+    return OxibooruReplicas(clients, args.hedge_quantile, max_workers=2 * max(1, args.workers))
+
+
+def async_oxibooru_client(args: argparse.Namespace) -> AsyncOxibooruClient | AsyncOxibooruReplicas:
+    clients = [
+        AsyncOxibooruClient(
+            api_base=url,
+            token_auth=args.oxibooru_auth_header,
+            timeout=args.timeout,
+            limit_per_host=args.max_connections_per_host,
+            keepalive_timeout=args.keepalive_timeout,
+            retry=retry_policy(args),
+        )
+        for url in args.oxibooru_urls
+    ]
+    if len(clients) == 1:
+        return clients[0]
+    return AsyncOxibooruReplicas(clients, args.hedge_quantile)
+
+
+def library_files(args: argparse.Namespace, libraries: list[dict[str, Any]]) -> LibraryFiles:
+    return LibraryFiles.from_libraries(libraries, parse_root_map(args.library_root_map) or [], args.library_verify_hash)
+
+
+def video_extractor(args: argparse.Namespace) -> VideoFrameExtractor | None:
+    if args.video_frames <= 0:
+        return None
+    return VideoFrameExtractor(args.video_frames, args.video_processes, timeout=args.video_timeout)
+
+
+def retry_policy(args: argparse.Namespace) -> RetryPolicy:
+    return RetryPolicy(
+        max_attempts=args.max_retries + 1,
+        max_delay=args.retry_max_delay,
+        breaker_threshold=args.breaker_threshold,
+        breaker_cooldown=args.breaker_cooldown,
+    )
+
+
+def refresh_index(args: argparse.Namespace, index: OxibooruChecksumIndex, metrics: Metrics) -> None:
+    index_client = OxibooruClient(
+        api_base=args.oxibooru_api,
+        token_auth=args.oxibooru_auth_header,
+        timeout=args.timeout,
+        retry=retry_policy(args),
+    )
+    index_client.metrics = metrics
+    with metrics.time("index_refresh"):
+        added = index.refresh(index_client)
+    print(f"[index] added {added} Oxibooru posts; {len(index)} indexed")
+
+
+def run(
+    args: argparse.Namespace,
+    metrics: Metrics,
+    journal: MigrationJournal | None,
+    cache: ReverseSearchCache | None,
+    index: OxibooruChecksumIndex | None,
+    plan: MigrationPlan | None = None,
+    tag_snapshot: TagSnapshot | None = None,
+) -> int:
+    pool_size = max(10, args.workers)
+    if index is not None and not args.oxibooru_index_skip_refresh:
+        refresh_index(args, index, metrics)
+
+    if args.use_async:
+        return asyncio.run(main_async(args, metrics, journal, cache, index, plan, tag_snapshot))
+
     baka = BakabooruClient(
         api_base=args.bakabooru_api,
         username=args.bakabooru_username,
         password=args.bakabooru_password,
         timeout=args.timeout,
+        pool_size=pool_size,
+        retry=retry_policy(args),
     )
-    oxi = OxibooruClient(
-        api_base=args.oxibooru_api,
-        token_auth=args.oxibooru_auth_header,
+    oxi = oxibooru_client(args, pool_size)
+    baka.metrics = oxi.metrics = metrics
+    groups = group_sharing(args, baka.get_duplicate_groups()) if args.duplicate_groups else None
+    library = library_files(args, baka.get_libraries()) if args.library_root_map is not None else None
+    limiters = build_limiters(args) if args.adaptive_concurrency else None
+    register_limit_gauges(metrics, limiters)
+    baka, oxi = limit_clients(baka, oxi, limiters)
+    migrator = Migrator(
+        baka=baka,
+        oxi_categories=oxi.get_tag_categories(),
+        dry_run=args.dry_run,
+        legacy_writes=args.legacy_writes,
+        shard=args.shard,
+        tag_snapshot=tag_snapshot,
+    )
+    if plan is not None:
+        plan.write_categories(migrator.oxi_categories)
+    matcher = PostMatcher(
+        baka,
+        oxi,
+        args.max_similar_distance,
+        cache,
+        upload_mode=args.upload_mode,
+        downscale_max_edge=args.downscale_max_edge,
+        jxl_decoder=JxlDecoder(args.jxl_processes, args.jxl_cache),
+        spool_memory=args.spool_memory_mb * 1024 * 1024,
+        budget=ByteBudget(args.inflight_budget_mb * 1024 * 1024),
+        index=index,
+        metrics=metrics,
+        groups=groups,
+        video=video_extractor(args),
+        library=library,
+    )
+    if args.estimate:
+        return run_estimate(baka, matcher, migrator, args, metrics)
+    if args.follow:
+        return follow(baka, matcher, migrator, args, metrics, journal, plan)
+    return run_migration(baka, matcher, migrator, args, metrics, journal, plan)
+
+
+# Two-sided 95% normal quantile for the `--estimate` intervals.
+ESTIMATE_Z = 1.96
+# Below this share of listed posts among the ids in the scan's id range,
+# sampling by id probes rejects too often and numbered pages are cheaper.
+SAMPLE_MIN_DENSITY = 0.25
+
+
+def sample_posts(baka: BakabooruClient, args: argparse.Namespace, count: int) -> tuple[list[dict[str, Any]], int]:
+    """
+    Uniform random sample of `count` posts that a scan with these arguments
+    would list, and the size of that population. The server has no random
+    sort, so posts are fetched one by one, preferably by id probe (an index
+    seek) and otherwise as numbered one-post pages (an OFFSET scan).
+    """
+    media_types = scan_media_types(args)
+    query = build_scan_query(args.after_id, args.query, media_types)
+    first = baka.get_posts_page(page=1, page_size=1, query=query)
+    population = read_page_total(first) or 0
+    if not population or not read_page_items(first):
+        return [], population
+    count = min(count, population)
+    low = int(read_page_items(first)[0]["id"])
+    newest = read_page_items(
+        baka.get_posts_page(page=1, page_size=1, query=build_scan_query(args.after_id, args.query, media_types, "id_desc"))
+    )
+    high = int(newest[0]["id"]) if newest else low
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="sample") as executor:
+        if population / (high - low + 1) < SAMPLE_MIN_DENSITY or count * 2 > population:
+            positions = sorted(random.sample(range(population), count))
+            pages = executor.map(
+                lambda position: baka.get_posts_page(page=position + 1, page_size=1, query=query),
+                positions,
+            )
+            return [items[0] for items in map(read_page_items, pages) if items], population
+
+        def probe(post_id: int) -> dict[str, Any] | None:
+            """The post with exactly this id, when the scan lists it."""
+            probe_query = build_scan_query(post_id - 1, args.query, media_types)
+            items = read_page_items(baka.get_posts_page(page=1, page_size=1, query=probe_query))
+            return items[0] if items and int(items[0]["id"]) == post_id else None
+
+        # Uniform ids over the range, keeping those that are listed posts:
+        # every post is equally likely, whatever the gaps between ids.
+        posts: list[dict[str, Any]] = []
+        tried: set[int] = set()
+        id_range = range(low, high + 1)
+        while len(posts) < count and len(tried) < len(id_range):
+            drawn = random.sample(id_range, min(2 * (count - len(posts)), len(id_range)))
+            candidates = [post_id for post_id in drawn if post_id not in tried][: count - len(posts)]
+            tried.update(candidates)
+            posts.extend(post for post in executor.map(probe, candidates) if post is not None)
+    return sorted(posts, key=lambda post: int(post["id"])), population
+
+
+def mean_interval(values: list[float], population: int) -> tuple[float, float, float]:
+    """Sample mean with its confidence interval (finite population corrected)."""
+    n = len(values)
+    mean = sum(values) / n if n else 0.0
+    if n < 2 or population <= 1:
+        return mean, mean, mean
+    variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+    correction = math.sqrt(max(0, population - n) / (population - 1))
+    half = ESTIMATE_Z * math.sqrt(variance / n) * correction
+    return mean, max(0.0, mean - half), mean + half
+
+
+def proportion_interval(hits: int, n: int, population: int) -> tuple[float, float, float]:
+    """
+    Sample proportion with its Wilson score interval, finite population
+    corrected through the effective sample size (so a census is exact).
+    """
+    if n == 0:
+        return 0.0, 0.0, 0.0
+    p = hits / n
+    if population > 1 and n >= population:
+        return p, p, p
+    if population > 1:
+        n = n * (population - 1) / (population - n)
+    z2 = ESTIMATE_Z**2
+    center = (p + z2 / (2 * n)) / (1 + z2 / n)
+    half = ESTIMATE_Z * math.sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / (1 + z2 / n)
+    return p, max(0.0, center - half), min(1.0, center + half)
+
+
+def run_estimate(
+    baka: BakabooruClient,
+    matcher: PostMatcher,
+    migrator: Migrator,
+    args: argparse.Namespace,
+    metrics: Metrics,
+) -> int:
+    """
+    `--estimate N`: run the full match path (dry run) on a random sample and
+    extrapolate the match rates, tags added, transfer and runtime of a full
+    scan, with 95% confidence intervals. Sampled posts run one at a time so
+    each one's time and traffic can be measured exactly.
+    """
+    posts, population = sample_posts(baka, args, args.estimate)
+    if not posts:
+        print("[estimate] no posts match the scan", file=sys.stderr)
+        return 1
+    print(f"[estimate] sampled {len(posts)} of {population} posts")
+    metrics.set_total(len(posts))
+
+    kinds: list[str] = []
+    tags: list[float] = []
+    transfer: list[float] = []
+    seconds: list[float] = []
+    for post in posts:
+        metrics.inc("scanned")
+        metrics.inc("processed")
+        sent_before = sum(metrics.transfer.values())
+        started = time.monotonic()
+        try:
+            with traced_post(int(post["id"])):
+                match = matcher.match(post)
+                added, _ = apply_post_match(migrator, match, metrics)
+            kinds.append(match.match_kind)
+            tags.append(len(added))
+        except Exception as exc:
+            metrics.inc("failed")
+            print(f"[error] post {post['id']}: {exc}", file=sys.stderr)
+            kinds.append("failed")
+            tags.append(0)
+        seconds.append(time.monotonic() - started)
+        transfer.append(sum(metrics.transfer.values()) - sent_before)
+
+    n = len(posts)
+    print(f"\n=== Estimate for {population} posts (sample of {n}, 95% confidence) ===")
+    for kind, label in (
+        ("exact", "Exact matches"),
+        ("similar", "Similar matches"),
+        ("too_far", "Too-far similars"),
+        ("none", "No match"),
+        ("failed", "Failures"),
+    ):
+        p, low, high = proportion_interval(kinds.count(kind), n, population)
+        print(
+            f"{label + ':':<18}{p:6.1%} ({low:.1%} - {high:.1%})  "
+            f"~{p * population:,.0f} posts ({low * population:,.0f} - {high * population:,.0f})"
+        )
+    mean, low, high = mean_interval(tags, population)
+    print(
+        f"{'Tags to add:':<18}{mean:.2f}/post ({low:.2f} - {high:.2f})  "
+        f"~{mean * population:,.0f} ({low * population:,.0f} - {high * population:,.0f})"
+    )
+    mean, low, high = mean_interval(transfer, population)
+    print(
+        f"{'Transfer:':<18}{format_bytes(mean)}/post  "
+        f"~{format_bytes(mean * population)} ({format_bytes(low * population)} - {format_bytes(high * population)})"
+    )
+    mean, low, high = mean_interval(seconds, population)
+    workers = max(1, args.workers)
+    print(
+        f"{'Runtime:':<18}{mean:.2f}s/post  ~{format_duration(mean * population)} serially "
+        f"({format_duration(low * population)} - {format_duration(high * population)}); "
+        f"~{format_duration(mean * population / workers)} at --workers {workers} if it scales linearly"
+    )
+    return 0
+
+
+def write_planned_post(
+    migrator: Migrator,
+    planned: PlannedPost,
+    failed_tags: set[str],
+    metrics: Metrics,
+) -> tuple[int, list[str], int, list[str]]:
+    missing = [name for name, _ in planned.tags if name in failed_tags]
+    if missing:
+        raise RuntimeError(f"tags could not be created: {', '.join(missing)}")
+    with traced_post(planned.post_id), metrics.time("write"):
+        return migrator.write_post_metadata(planned.post_id, planned.tags, planned.sources)
+
+
+def run_apply(
+    args: argparse.Namespace,
+    metrics: Metrics,
+    journal: MigrationJournal | None,
+    tag_snapshot: TagSnapshot | None = None,
+) -> int:
+    """
+    Execute a `--plan` file without contacting Oxibooru or downloading content.
+
+    The plan is read twice: first to create every category and tag it needs
+    in one parallel pass, then to write the posts in batches of
+    `--apply-batch-size`, `--workers` at a time. Each post is still re-read
+    before its update, so tags and sources added since the plan are kept.
+    """
+    categories, tags, planned_posts = scan_plan(args.apply)
+    print(f"[plan] {planned_posts} posts, {len(tags)} tags, {len(categories)} categories in {args.apply}")
+    metrics.set_total(planned_posts)
+
+    workers = max(1, args.workers)
+    baka = BakabooruClient(
+        api_base=args.bakabooru_api,
+        username=args.bakabooru_username,
+        password=args.bakabooru_password,
         timeout=args.timeout,
+        pool_size=max(10, workers),
+        retry=retry_policy(args),
     )
-    migrator = Migrator(baka=baka, oxi=oxi, dry_run=args.dry_run)
-
-    processed_total = 0
-    scanned_total = 0
-    matched_total = 0
-    exact_matched_total = 0
-    similar_matched_total = 0
-    too_far_similar_total = 0
-    skipped_type_total = 0
-    failed_total = 0
-    discovered_tags_total = 0
-    added_tags_total = 0
-    discovered_sources_total = 0
-    added_sources_total = 0
-
-    page = args.start_page
+    baka.metrics = metrics
+    limiters = build_limiters(args) if args.adaptive_concurrency else None
+    register_limit_gauges(metrics, limiters)
+    baka, _ = limit_clients(baka, None, limiters)
+    migrator = Migrator(baka=baka, oxi_categories=categories, dry_run=args.dry_run, tag_snapshot=tag_snapshot)
     max_posts = args.max_posts if args.max_posts > 0 else None
 
-    while True:
-        page_payload = baka.get_posts_page(page=page, page_size=args.page_size)
-        items = page_payload.get("items") or page_payload.get("Items") or []
-        if not isinstance(items, list):
-            raise RuntimeError("Bakabooru posts payload has invalid 'items'.")
-        if not items:
-            break
+    def settle(planned: PlannedPost, future: Future | None) -> bool:
+        """Count and journal one planned post. Returns False when the run must abort."""
+        try:
+            discovered, added, discovered_sources, added_sources = (
+                future.result() if future is not None else (0, [], 0, [])
+            )
+        except Exception as exc:
+            if journal is not None:
+                journal.record(planned.post_id, planned.content_hash, "failed", error=str(exc))
+            metrics.inc("failed")
+            print(f"[error] post {planned.post_id}: {exc}", file=sys.stderr)
+            return not args.fail_fast
 
-        print(f"[page {page}] fetched {len(items)} posts")
+        if planned.match_kind in ("exact", "similar"):
+            metrics.inc("matched")
+            metrics.inc(f"{planned.match_kind}_matched")
+        elif planned.match_kind == "too_far":
+            metrics.inc("too_far_similar")
+        metrics.inc("discovered_tags", discovered)
+        metrics.inc("added_tags", len(added))
+        metrics.inc("discovered_sources", discovered_sources)
+        metrics.inc("added_sources", len(added_sources))
+        if journal is not None:
+            journal.record(
+                planned.post_id,
+                planned.content_hash,
+                planned.match_kind,
+                distance=planned.distance,
+                tags=added,
+                sources=added_sources,
+            )
+        return True
 
-        for post in items:
-            if max_posts is not None and scanned_total >= max_posts:
-                print("[done] reached --max-posts limit")
-                print_summary(
-                    scanned_total,
-                    processed_total,
-                    matched_total,
-                    exact_matched_total,
-                    similar_matched_total,
-                    too_far_similar_total,
-                    skipped_type_total,
-                    discovered_tags_total,
-                    added_tags_total,
-                    discovered_sources_total,
-                    added_sources_total,
-                    failed_total,
-                )
-                return 0
+    def apply_batch(batch: list[PlannedPost]) -> bool:
+        futures = [
+            executor.submit(write_planned_post, migrator, planned, failed_tags, metrics)
+            if planned.match_kind in ("exact", "similar")
+            else None
+            for planned in batch
+        ]
+        ok = all([settle(planned, future) for planned, future in zip(batch, futures)])
+        if journal is not None:
+            journal.flush()
+        return ok
 
-            scanned_total += 1
-            post_id = int(post["id"])
-            content_type = str(post.get("contentType") or "")
-            relative_path = str(post.get("relativePath") or f"post_{post_id}")
-            post_tags = post.get("tags") or []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="apply") as executor:
+        with metrics.time("prepare_tags"):
+            failed_tags = migrator.prepare_tags(tags, executor)
 
-            if not is_supported_content_type(content_type):
-                skipped_type_total += 1
+        batch: list[PlannedPost] = []
+        for item in read_plan(args.apply):
+            if item.get("type") != "post":
                 continue
+            if max_posts is not None and metrics.get("scanned") >= max_posts:
+                print("[done] reached --max-posts limit")
+                break
 
-            processed_total += 1
-            try:
-                original_bytes = baka.get_post_content(post_id)
-                upload_bytes = original_bytes
-                upload_mime = content_type if content_type else "application/octet-stream"
-                filename = Path(relative_path).name or f"post_{post_id}"
-
-                if is_jxl_content_type(content_type):
-                    upload_bytes = decode_jxl_to_jpeg(original_bytes)
-                    upload_mime = "image/jpeg"
-                    filename = f"{Path(filename).stem}.jpg"
-
-                reverse_result = oxi.reverse_search(
-                    content_bytes=upload_bytes,
-                    filename=filename,
-                    content_type=upload_mime,
-                )
-                matched_post, match_kind, match_distance = select_reverse_search_match(
-                    reverse_result=reverse_result,
-                    max_similar_distance=args.max_similar_distance,
-                )
-                if not matched_post:
-                    if match_kind == "too_far":
-                        too_far_similar_total += 1
-                    continue
-
-                matched_total += 1
-                if match_kind == "exact":
-                    exact_matched_total += 1
-                elif match_kind == "similar":
-                    similar_matched_total += 1
-                    if match_distance is not None:
-                        print(f"[post:{post_id}] using similar match (distance={match_distance:.6f})")
-
-                oxi_tags = matched_post.get("tags") or []
-                discovered, added = migrator.migrate_post_tags(
-                    post_id=post_id,
-                    post_tags=post_tags,
-                    oxi_tags=oxi_tags,
-                )
-                discovered_tags_total += discovered
-                added_tags_total += added
-                discovered_sources, added_sources = migrator.migrate_post_sources(
-                    post_id=post_id,
-                    oxi_post=matched_post,
-                )
-                discovered_sources_total += discovered_sources
-                added_sources_total += added_sources
+            planned = parse_planned_post(item)
+            metrics.inc("scanned")
+            if journal is not None and journal.is_completed(planned.post_id, planned.content_hash):
+                metrics.inc("skipped_journal")
+                continue
 
-            except Exception as exc:
-                failed_total += 1
-                print(f"[error] post {post_id}: {exc}", file=sys.stderr)
-                if args.fail_fast:
-                    print_summary(
-                        scanned_total,
-                        processed_total,
-                        matched_total,
-                        exact_matched_total,
-                        similar_matched_total,
-                        too_far_similar_total,
-                        skipped_type_total,
-                        discovered_tags_total,
-                        added_tags_total,
-                        discovered_sources_total,
-                        added_sources_total,
-                        failed_total,
-                    )
+            metrics.inc("processed")
+            batch.append(planned)
+            if len(batch) >= args.apply_batch_size:
+                if not apply_batch(batch):
                     return 1
+                batch = []
 
-        if len(items) < args.page_size:
-            break
-        page += 1
-
-    print_summary(
-        scanned_total,
-        processed_total,
-        matched_total,
-        exact_matched_total,
-        similar_matched_total,
-        too_far_similar_total,
-        skipped_type_total,
-        discovered_tags_total,
-        added_tags_total,
-        discovered_sources_total,
-        added_sources_total,
-        failed_total,
-    )
+        if batch and not apply_batch(batch):
+            return 1
     return 0
 
 
-def print_summary(
-    scanned_total: int,
-    processed_total: int,
-    matched_total: int,
-    exact_matched_total: int,
-    similar_matched_total: int,
-    too_far_similar_total: int,
-    skipped_type_total: int,
-    discovered_tags_total: int,
-    added_tags_total: int,
-    discovered_sources_total: int,
-    added_sources_total: int,
-    failed_total: int,
-) -> None:
+# Options the `--spawn-shards` coordinator handles itself, mapped to whether they take a value.
+COORDINATOR_OPTIONS = {
+    "--spawn-shards": True,
+    "--metrics-json": True,
+    "--prometheus-textfile": True,
+    "--oxibooru-index-rebuild": False,
+    "--search-cache-clear": False,
+    "--trace": True,
+    "--profile": True,
+}
+
+
+def shard_argv(argv: list[str]) -> list[str]:
+    """The coordinator's command line minus `COORDINATOR_OPTIONS`."""
+    result: list[str] = []
+    skip_value = False
+    for arg in argv:
+        if skip_value:
+            skip_value = False
+            continue
+        name, has_value, _ = arg.partition("=")
+        if name in COORDINATOR_OPTIONS:
+            skip_value = COORDINATOR_OPTIONS[name] and not has_value
+            continue
+        result.append(arg)
+    return result
+
+
+def per_shard_outputs(args: argparse.Namespace, index: int) -> list[str]:
+    """`--trace`/`--profile` of a spawned shard, at `<stem>.shard<I><suffix>` next to the requested path."""
+    options: list[str] = []
+    for option, value in (("--trace", args.trace), ("--profile", args.profile)):
+        if value:
+            path = Path(value)
+            options.extend([option, str(path.with_name(f"{path.stem}.shard{index}{path.suffix}"))])
+    return options
+
+
+def relay_output(stream: IO[str], prefix: str) -> None:
+    for line in stream:
+        sys.stdout.write(prefix + line)
+        sys.stdout.flush()
+
+
+def run_shards(args: argparse.Namespace) -> int:
+    """
+    Local coordinator for `--spawn-shards N`: does the once-per-run setup
+    (index rebuild/refresh, cache clearing, tag snapshot), runs N copies of this script as
+    `--shard i/N` with prefixed output, and merges their reports. The shards
+    share the journal and caches, which are SQLite databases in WAL mode.
+    """
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    count = args.spawn_shards
+    metrics = Metrics()
+    if args.prometheus_textfile:
+        print("[shards] --prometheus-textfile is per process; run --shard processes to export it", file=sys.stderr)
+
+    if args.oxibooru_index:
+        index = OxibooruChecksumIndex(args.oxibooru_index)
+        try:
+            if args.oxibooru_index_rebuild:
+                index.rebuild()
+            if not args.oxibooru_index_skip_refresh:
+                refresh_index(args, index, metrics)
+        finally:
+            index.close()
+    if args.search_cache and args.search_cache_clear:
+        cache = ReverseSearchCache(
+            args.search_cache,
+            max_similar_distance=args.max_similar_distance,
+            negative_ttl=args.search_cache_negative_ttl * 3600,
+            max_entries=args.search_cache_max_entries,
+        )
+        cache.clear()
+        cache.close()
+    if args.tag_snapshot:
+        # Bring the snapshot up to date once instead of N shards racing to reload it.
+        snapshot = TagSnapshot(args.tag_snapshot)
+        try:
+            baka = BakabooruClient(
+                api_base=args.bakabooru_api,
+                username=args.bakabooru_username,
+                password=args.bakabooru_password,
+                timeout=args.timeout,
+                pool_size=max(10, TAG_CATALOGUE_WORKERS),
+                retry=retry_policy(args),
+            )
+            baka.metrics = metrics
+            load_tag_catalogue(baka, baka.get_categories(), snapshot)
+        finally:
+            snapshot.close()
+
+    base = shard_argv(sys.argv[1:])
+    if args.oxibooru_index:
+        base.append("--oxibooru-index-skip-refresh")
+    environment = {**os.environ, "PYTHONUNBUFFERED": "1"}
+    with tempfile.TemporaryDirectory(prefix="bakabooru-shards-") as workdir:
+        shards: list[tuple[subprocess.Popen, threading.Thread, Path]] = []
+        for index_in_run in range(count):
+            report = Path(workdir) / f"shard-{index_in_run}.json"
+            process = subprocess.Popen(
+                [
+                    sys.executable,
+                    str(Path(__file__).resolve()),
+                    *base,
+                    "--shard",
+                    f"{index_in_run}/{count}",
+                    "--metrics-json",
+                    str(report),
+                    *per_shard_outputs(args, index_in_run),
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                env=environment,
+            )
+            assert process.stdout is not None
+            relay = threading.Thread(
+                target=relay_output,
+                args=(process.stdout, f"[shard {index_in_run}/{count}] "),
+                daemon=True,
+            )
+            relay.start()
+            shards.append((process, relay, report))
+
+        try:
+            codes = [process.wait() for process, _, _ in shards]
+        except KeyboardInterrupt:
+            print("\n[interrupted] stopping shards", file=sys.stderr)
+            for process, _, _ in shards:
+                if process.poll() is None:
+                    process.send_signal(signal.SIGINT)
+            codes = [process.wait() for process, _, _ in shards]
+        for _, relay, _ in shards:
+            relay.join()
+
+        reports = [str(report) for _, _, report in shards if report.exists()]
+        if len(reports) < count:
+            print(f"[shards] {count - len(reports)} shard(s) wrote no report", file=sys.stderr)
+        if reports:
+            merge_reports(reports, args.metrics_json, metrics)
+    return next((code for code in codes if code), 0)
+
+
+def merge_reports(paths: list[str], output: str | None, merged: Metrics | None = None) -> int:
+    """Combine shard `--metrics-json` reports into one summary (and report, with `output`)."""
+    exit_code = 0
+    for path in paths:
+        try:
+            report = json.loads(Path(path).read_text(encoding="utf-8"))
+            shard_metrics = Metrics.from_report(report)
+        except (OSError, ValueError, KeyError, RuntimeError) as exc:
+            print(f"Cannot read report {path}: {exc}", file=sys.stderr)
+            return 2
+        exit_code = exit_code or int(report.get("exit_code") or 0)
+        if merged is None:
+            merged = shard_metrics
+        else:
+            merged.merge(shard_metrics)
+
+    assert merged is not None
+    print(f"\n[shards] merged {len(paths)} report(s)")
+    print_summary(merged)
+    if output:
+        write_atomically(output, json.dumps({**merged.report(), "exit_code": exit_code, "shards": len(paths)}, indent=2) + "\n")
+        print(f"[metrics] merged report written to {output}")
+    return exit_code
+
+
+def print_summary(metrics: Metrics) -> None:
     print("\n=== Migration Summary ===")
-    print(f"Scanned posts:          {scanned_total}")
-    print(f"Processed image posts:  {processed_total}")
-    print(f"Skipped by type:        {skipped_type_total}")
-    print(f"Matched posts:          {matched_total}")
-    print(f"  exact matches:        {exact_matched_total}")
-    print(f"  similar matches:      {similar_matched_total}")
-    print(f"  too-far similars:     {too_far_similar_total}")
-    print(f"Discovered tags:        {discovered_tags_total}")
-    print(f"Added tags to posts:    {added_tags_total}")
-    print(f"Discovered sources:     {discovered_sources_total}")
-    print(f"Added sources to posts: {added_sources_total}")
-    print(f"Failures:               {failed_total}")
+    print(f"Scanned posts:          {metrics.get('scanned')}")
+    print(f"Processed posts:        {metrics.get('processed')}")
+    print(f"Skipped by type:        {metrics.get('skipped_type')}")
+    print(f"Skipped (journal):      {metrics.get('skipped_journal')}")
+    print(f"Search cache hits:      {metrics.get('search_cache_hits')}")
+    print(f"Checksum index hits:    {metrics.get('index_hits')}")
+    print(f"Read from disk:         {metrics.get('local_reads')}")
+    print(f"Shared in dup groups:   {metrics.get('group_propagated')}")
+    print(f"JXL decode cache hits:  {metrics.get('jxl_cache_hits')}")
+    print(f"Matched posts:          {metrics.get('matched')}")
+    print(f"  exact matches:        {metrics.get('exact_matched')}")
+    print(f"  similar matches:      {metrics.get('similar_matched')}")
+    print(f"  too-far similars:     {metrics.get('too_far_similar')}")
+    print(f"Discovered tags:        {metrics.get('discovered_tags')}")
+    print(f"Added tags to posts:    {metrics.get('added_tags')}")
+    print(f"Discovered sources:     {metrics.get('discovered_sources')}")
+    print(f"Added sources to posts: {metrics.get('added_sources')}")
+    print(f"Uploaded to Oxibooru:   {format_bytes(metrics.get('uploaded_bytes'))}")
+    print(f"Saved by small-first:   {format_bytes(metrics.get('saved_bytes'))}")
+    print(f"Hedged searches:        {metrics.get('hedged_searches')} ({metrics.get('hedge_wins')} won by the hedge)")
+    print(f"Failures:               {metrics.get('failed')}")
+    elapsed = metrics.elapsed()
+    print(f"Elapsed:                {format_duration(elapsed)} ({metrics.posts_per_second():.1f} posts/s)")
+    for remote, requests_made in sorted(metrics.requests.items()):
+        sent = format_bytes(metrics.transfer.get((remote, "out"), 0))
+        received = format_bytes(metrics.transfer.get((remote, "in"), 0))
+        print(f"{remote + ':':<24}{requests_made} requests, {sent} sent, {received} received")
+    if metrics.stages:
+        print("Stage latency (count, p50, p95, max):")
+        for stage, histogram in sorted(metrics.stages.items()):
+            print(
+                f"  {stage:<20}{histogram.count:>7}  {histogram.quantile(0.5):7.3f}s"
+                f"  {histogram.quantile(0.95):7.3f}s  {histogram.max:7.3f}s"
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+import sys
+import threading
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+import pytest
+
+# The scripts are standalone files, not a package.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmark_oxibooru_migration import (  # noqa: E402
+    BakabooruStandIn,
+    BenchmarkState,
+    CorpusConfig,
+    OxibooruStandIn,
+    StandInServer,
+    SyntheticCorpus,
+)
+from migrate_oxibooru_tags import CircuitBreaker  # noqa: E402
+
+
+@dataclass
+class StandIns:
+    bakabooru_api: str
+    oxibooru_api: str
+    state: BenchmarkState
+
+
+@pytest.fixture
+def stand_ins(monkeypatch: pytest.MonkeyPatch) -> Iterator[Callable[..., StandIns]]:
+    """
+    Start the benchmark's stand-in Bakabooru and Oxibooru in this process:
+    `stand_ins(posts=100, error_rate=0.1)` takes `CorpusConfig` fields plus
+    `latency`, `search_latency` and `error_rate`.
+    """
+    # Breakers are shared per host:port, and a later test may get the same port.
+    monkeypatch.setattr(CircuitBreaker, "_registry", {})
+    servers: list[StandInServer] = []
+
+    def start(latency: float = 0.0, search_latency: float = 0.0, error_rate: float = 0.0, **config: object) -> StandIns:
+        corpus = SyntheticCorpus(CorpusConfig(**config))
+        state = BenchmarkState(corpus.config.existing_tags)
+        pair = [
+            StandInServer(handler, corpus, state, latency, error_rate, search_latency)
+            for handler in (BakabooruStandIn, OxibooruStandIn)
+        ]
+        for server in pair:
+            # A short poll keeps the shutdown at teardown quick.
+            threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        servers.extend(pair)
+        return StandIns(f"{pair[0].url}/api", f"{pair[1].url}/api", state)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
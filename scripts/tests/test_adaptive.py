@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from migrate_oxibooru_tags import AdaptiveClient, AdaptiveLimiter, AsyncBakabooruClient, BakabooruClient, RetryPolicy
+
+
+def listing_client(stand_ins, limiter: AdaptiveLimiter, attempts: int = 5) -> AdaptiveClient:
+    retry = RetryPolicy(max_attempts=attempts, base_delay=0.001, max_delay=0.002, breaker_threshold=0)
+    return AdaptiveClient(BakabooruClient(stand_ins.bakabooru_api, retry=retry), {"get_posts_page": limiter})
+
+
+def hammer(call, count: int, threads: int = 8) -> None:
+    def attempt(page: int) -> None:
+        try:
+            call(page=page % 10 + 1, page_size=1)
+        except Exception:
+            pass
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(attempt, range(count)))
+
+
+def test_limit_grows_while_saturated_and_healthy(stand_ins) -> None:
+    servers = stand_ins(posts=10, latency=0.005)
+    limiter = AdaptiveLimiter("baka-read", maximum=8, initial=2, latency_factor=10.0, window=10)
+    hammer(listing_client(servers, limiter).get_posts_page, 200)
+    assert limiter.limit > 2
+
+
+def test_failures_halve_the_limit(stand_ins) -> None:
+    servers = stand_ins(posts=10, error_rate=1.0)
+    limiter = AdaptiveLimiter("baka-read", maximum=8, initial=8, window=10)
+    hammer(listing_client(servers, limiter, attempts=1).get_posts_page, 40)
+    assert limiter.limit == 1
+
+
+def test_unsaturated_limit_does_not_grow(stand_ins) -> None:
+    servers = stand_ins(posts=10)
+    limiter = AdaptiveLimiter("baka-read", maximum=8, initial=2, latency_factor=10.0, window=10)
+    hammer(listing_client(servers, limiter).get_posts_page, 50, threads=1)
+    assert limiter.limit == 2
+
+
+def test_slots_never_exceed_the_limit() -> None:
+    limiter = AdaptiveLimiter("oxi-search", maximum=8, initial=3, window=1000)
+    lock = threading.Lock()
+    running = peak = 0
+
+    def search() -> None:
+        nonlocal running, peak
+        with limiter.slot():
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.005)
+            with lock:
+                running -= 1
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for _ in range(40):
+            pool.submit(search)
+    assert peak == 3
+
+
+def test_async_failures_halve_the_limit(stand_ins) -> None:
+    pytest.importorskip("aiohttp")
+    servers = stand_ins(posts=10, error_rate=1.0)
+    limiter = AdaptiveLimiter("baka-read", maximum=8, initial=8, window=10)
+    retry = RetryPolicy(max_attempts=1, breaker_threshold=0)
+
+    async def run() -> None:
+        async with AsyncBakabooruClient(servers.bakabooru_api, retry=retry) as baka:
+            limited = AdaptiveClient(baka, {"get_posts_page": limiter})
+            await asyncio.gather(
+                *(limited.get_posts_page(page=1, page_size=1) for _ in range(40)), return_exceptions=True
+            )
+
+    asyncio.run(run())
+    assert limiter.limit == 1
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+
+import pytest
+
+from migrate_oxibooru_tags import (
+    AsyncBakabooruClient,
+    AsyncOxibooruClient,
+    BakabooruClient,
+    Metrics,
+    OxibooruClient,
+    PostMatcher,
+    iter_scheduled_pages,
+    iter_scheduled_pages_async,
+    read_page_items,
+)
+
+pytest.importorskip("aiohttp")
+
+
+def scan_args(**overrides: object) -> argparse.Namespace:
+    args = {
+        "query": None,
+        "priority": ["untagged", "smallest"],
+        "after_id": 0,
+        "page_size": 7,
+        "shard": None,
+        "priority_window": 10,
+        "video_frames": 0,
+    }
+    return argparse.Namespace(**{**args, **overrides})
+
+
+def test_scheduled_listing_matches_its_async_twin(stand_ins) -> None:
+    servers = stand_ins(posts=45, video_every=0)
+    args = scan_args()
+    sync_metrics = Metrics()
+    listed = [
+        post["id"]
+        for page in iter_scheduled_pages(BakabooruClient(servers.bakabooru_api), args, sync_metrics)
+        for post in page
+    ]
+
+    async def list_async() -> list[int]:
+        async with AsyncBakabooruClient(servers.bakabooru_api) as baka:
+            return [
+                post["id"]
+                async for page in iter_scheduled_pages_async(baka, args, Metrics())
+                for post in page
+            ]
+
+    # The stand-in ignores tag-count queries, so the second pass lists every post again.
+    assert sorted(listed) == list(range(1, 46))
+    assert asyncio.run(list_async()) == listed
+
+
+def outcome(match) -> tuple:
+    matched = match.matched_post["id"] if match.matched_post else None
+    return match.match_kind, matched, match.uploaded_bytes, match.saved_bytes
+
+
+@pytest.mark.parametrize("upload_mode", ["full", "thumbnail"])
+def test_matches_agree_with_their_async_twin(stand_ins, upload_mode: str) -> None:
+    servers = stand_ins(posts=30, video_every=0, duplicate_ratio=0.0)
+    baka = BakabooruClient(servers.bakabooru_api)
+    posts = read_page_items(baka.get_posts_page(page=1, page_size=30))
+    matcher = PostMatcher(baka, OxibooruClient(servers.oxibooru_api), 0.1, upload_mode=upload_mode)
+    expected = [outcome(matcher.match(post)) for post in posts]
+
+    async def match_async() -> list[tuple]:
+        async with AsyncBakabooruClient(servers.bakabooru_api) as baka, AsyncOxibooruClient(
+            servers.oxibooru_api
+        ) as oxi:
+            matcher = PostMatcher(baka, oxi, 0.1, upload_mode=upload_mode)
+            return [outcome(await matcher.match_async(post)) for post in posts]
+
+    assert len({kind for kind, *_ in expected}) > 1
+    assert asyncio.run(match_async()) == expected
@@ -0,0 +1,64 @@
+import argparse
+import random
+import sys
+
+import pytest
+
+import migrate_oxibooru_tags as migrate
+from migrate_oxibooru_tags import BakabooruClient, proportion_interval, sample_posts
+
+
+def scan_args(**overrides: object) -> argparse.Namespace:
+    values = {"after_id": 0, "query": None, "video_frames": 0, "workers": 4}
+    values.update(overrides)
+    return argparse.Namespace(**values)
+
+
+def listing_requests(stand_ins) -> int:
+    return stand_ins.state.snapshot()["requests"].get("bakabooru GET /api/posts", 0)
+
+
+def test_sample_probes_ids_in_a_dense_library(stand_ins) -> None:
+    servers = stand_ins(posts=2000, video_every=20)
+    random.seed(7)
+    posts, population = sample_posts(BakabooruClient(servers.bakabooru_api), scan_args(), 100)
+
+    assert population == 1900
+    ids = [int(post["id"]) for post in posts]
+    assert len(ids) == len(set(ids)) == 100
+    assert all(post_id % 20 for post_id in ids)
+    # Spread over the whole library rather than clustered at one end.
+    assert min(ids) < 500 and max(ids) > 1500
+    # Two bounds, then one probe per candidate id; only videos are rejected.
+    assert listing_requests(servers) < 2 + 100 * 1.3
+
+
+def test_sample_of_most_of_the_library_uses_pages(stand_ins) -> None:
+    servers = stand_ins(posts=50, video_every=0)
+    posts, population = sample_posts(BakabooruClient(servers.bakabooru_api), scan_args(), 40)
+
+    assert population == 50
+    assert len({int(post["id"]) for post in posts}) == 40
+    assert listing_requests(servers) == 2 + 40
+
+
+def test_sample_of_an_empty_scan(stand_ins) -> None:
+    servers = stand_ins(posts=10, video_every=0)
+    assert sample_posts(BakabooruClient(servers.bakabooru_api), scan_args(after_id=10), 5) == ([], 0)
+
+
+def test_proportion_interval_contains_the_estimate() -> None:
+    p, low, high = proportion_interval(30, 100, 10_000)
+    assert p == 0.3 and low < p < high
+    # Sampling the whole population leaves no uncertainty.
+    assert proportion_interval(30, 100, 100)[1:] == pytest.approx((0.3, 0.3))
+
+
+def test_estimate_rejects_shard(monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]) -> None:
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["migrate", "--bakabooru-api", "http://127.0.0.1:9/api", "--estimate", "10", "--shard", "0/2"],
+    )
+    assert migrate.main() == 2
+    assert "--shard" in capsys.readouterr().err
@@ -0,0 +1,75 @@
+from migrate_oxibooru_tags import FOLLOW_MAX_ATTEMPTS, FollowWatermark, advance_follow_watermark, completed_prefix
+
+
+def post(post_id: int, import_date: str) -> dict:
+    return {"id": post_id, "importDate": import_date}
+
+
+def test_follow_watermark_json_round_trip() -> None:
+    watermark = FollowWatermark("2026-03-01T12:00:00.1234567Z", 42)
+    restored = FollowWatermark.from_json(watermark.to_json())
+    assert (restored.import_date, restored.post_id, restored.position) == (
+        watermark.import_date,
+        watermark.post_id,
+        watermark.position,
+    )
+
+
+def test_follow_watermark_is_new_and_lookback() -> None:
+    watermark = FollowWatermark("2026-03-01T12:00:00Z", 42)
+    assert watermark.is_new(post(43, "2026-03-01T12:00:00Z"))
+    # Committed late, inside the lookback window: new until advanced over.
+    late = post(40, "2026-03-01T11:59:00Z")
+    assert watermark.is_new(late)
+    watermark.advance([late])
+    assert not watermark.is_new(late)
+    assert watermark.post_id == 42
+    assert not watermark.is_new(post(10, "2026-03-01T11:00:00Z"))
+
+
+def test_follow_watermark_reaches_past() -> None:
+    watermark = FollowWatermark("2026-03-01T12:00:00Z", 42)
+    assert not watermark.reaches_past(post(41, "2026-03-01T11:55:00Z"))
+    assert watermark.reaches_past(post(30, "2026-03-01T11:49:59Z"))
+
+
+def test_follow_watermark_advance_moves_to_newest_and_prunes() -> None:
+    watermark = FollowWatermark("2026-03-01T12:00:00Z", 42)
+    watermark.advance([post(43, "2026-03-01T12:00:01Z"), post(44, "2026-03-01T12:30:00Z")])
+    assert (watermark.post_id, watermark.import_date) == (44, "2026-03-01T12:30:00Z")
+    assert 43 not in watermark.recent and 44 in watermark.recent
+
+
+def test_completed_prefix_stops_at_first_unfinished_post() -> None:
+    posts = [post(1, "2026-03-01T12:00:01Z"), post(2, "2026-03-01T12:00:02Z"), post(3, "2026-03-01T12:00:03Z")]
+    assert completed_prefix(posts, {1, 2, 3}) == posts
+    assert completed_prefix(posts, {1, 3}) == posts[:1]
+    assert completed_prefix(posts, {2, 3}) == []
+
+
+def test_follow_watermark_keeps_failure_counts_across_restarts() -> None:
+    watermark = FollowWatermark("2026-03-01T12:00:00Z", 42)
+    watermark.record_failures([43])
+    restored = FollowWatermark.from_json(watermark.to_json())
+    assert restored.failures == {43: 1}
+    assert "failures" not in FollowWatermark("2026-03-01T12:00:00Z", 42).to_json()
+
+
+def test_failing_post_holds_the_watermark_until_out_of_attempts() -> None:
+    watermark = FollowWatermark("2026-03-01T12:00:00Z", 1)
+    posts = [post(2, "2026-03-01T12:00:02Z"), post(3, "2026-03-01T12:00:03Z")]
+    for _ in range(FOLLOW_MAX_ATTEMPTS - 1):
+        advance_follow_watermark(watermark, posts, completed={3}, failed={2})
+        assert watermark.post_id == 1 and watermark.signature is None
+
+    advance_follow_watermark(watermark, posts, completed={3}, failed={2})
+    assert watermark.post_id == 3
+    assert watermark.failures == {}
+
+
+def test_posts_cut_off_hold_the_watermark() -> None:
+    watermark = FollowWatermark("2026-03-01T12:00:00Z", 1)
+    posts = [post(2, "2026-03-01T12:00:02Z"), post(3, "2026-03-01T12:00:03Z")]
+    for _ in range(FOLLOW_MAX_ATTEMPTS + 1):
+        advance_follow_watermark(watermark, posts, completed={2}, failed=set())
+    assert watermark.post_id == 2
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+import migrate_oxibooru_tags as migrate
+from migrate_oxibooru_tags import Metrics, MultipartStream, OxibooruClient, OxibooruReplicas, Upload
+
+
+def replicas(stand_ins, *search_latencies: float, max_workers: int = 4) -> OxibooruReplicas:
+    clients = [
+        OxibooruClient(stand_ins(posts=10, search_latency=latency).oxibooru_api) for latency in search_latencies
+    ]
+    pool = OxibooruReplicas(clients, hedge_quantile=0.9, max_workers=max_workers)
+    pool.metrics = Metrics()
+    return pool
+
+
+def warm_up(pool: OxibooruReplicas, seconds: float, averages: list[float]) -> None:
+    """Seed the latency window, so searches hedge after `seconds` and go to the lowest average first."""
+    pool.load.samples.extend([seconds] * migrate.HEDGE_MIN_SAMPLES)
+    pool.load.average = list(averages)
+
+
+def upload() -> Upload:
+    return Upload.from_bytes(b"\x89PNG" + bytes(4096), "post.png", "image/png")
+
+
+def test_hedge_returns_the_faster_replica(stand_ins) -> None:
+    pool = replicas(stand_ins, 1.0, 0.0)
+    warm_up(pool, 0.05, [0.01, 0.02])
+    started = time.monotonic()
+    pool.reverse_search(upload())
+
+    assert time.monotonic() - started < 0.8
+    assert pool.metrics.get("hedged_searches") == 1
+    assert pool.metrics.get("hedge_wins") == 1
+    pool.pool.shutdown(wait=True)
+
+
+def test_unhedged_search_returns_without_the_pool(stand_ins) -> None:
+    pool = replicas(stand_ins, 0.0, 0.0)
+    pool.reverse_search(upload())
+    assert pool.metrics.get("hedged_searches") == 0
+    assert pool.load.in_flight == [0, 0]
+    pool.pool.shutdown(wait=True)
+
+
+def test_saturated_pool_searches_inline_without_hedging(stand_ins) -> None:
+    pool = replicas(stand_ins, 0.2, 0.0, max_workers=1)
+    warm_up(pool, 0.05, [0.01, 0.02])
+    assert pool.slots.acquire(blocking=False)
+
+    pool.reverse_search(upload())
+    assert pool.metrics.get("hedged_searches") == 0
+    assert pool.load.in_flight == [0, 0]
+    pool.slots.release()
+    pool.pool.shutdown(wait=True)
+
+
+def test_withdrawn_upload_fails_the_next_read() -> None:
+    body = upload()
+    stream = MultipartStream("content", body)
+    assert len(stream.read(16)) == 16
+
+    body.withdraw()
+    with pytest.raises(migrate.UploadWithdrawn):
+        stream.read()
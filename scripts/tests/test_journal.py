@@ -0,0 +1,67 @@
+import sys
+
+import pytest
+
+import migrate_oxibooru_tags as migrate
+from migrate_oxibooru_tags import MigrationJournal
+
+
+def test_outcomes_survive_a_reopen(tmp_path) -> None:
+    path = str(tmp_path / "journal.db")
+    journal = MigrationJournal(path, commit_every=1000)
+    journal.record(1, "aa", "exact", distance=0.0, tags=["solo"], sources=["https://a.example/1"])
+    journal.record(2, "bb", "none")
+    journal.record(3, "cc", "failed", error="HTTP 503")
+    journal.set_state("follow_watermark", '{"id": 3}')
+    journal.close()
+
+    reopened = MigrationJournal(path)
+    assert reopened.is_completed(1, "aa") and reopened.is_completed(2, "bb")
+    assert not reopened.is_completed(3, "cc")
+    # Changed content is migrated again.
+    assert not reopened.is_completed(1, "a2")
+    assert reopened.get_state("follow_watermark") == '{"id": 3}'
+    assert reopened.get_state("missing") is None
+    reopened.close()
+
+
+def test_a_failure_replaces_an_earlier_success(tmp_path) -> None:
+    journal = MigrationJournal(str(tmp_path / "journal.db"))
+    journal.record(1, "aa", "similar", distance=0.05)
+    journal.record(1, "aa", "failed", error="boom")
+    assert not journal.is_completed(1, "aa")
+    journal.close()
+
+
+def searches(stand_ins) -> int:
+    return stand_ins.state.snapshot()["requests"].get("oxibooru POST /api/posts/reverse-search", 0)
+
+
+def run_main(monkeypatch: pytest.MonkeyPatch, stand_ins, *extra: str) -> int:
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["migrate", "--bakabooru-api", stand_ins.bakabooru_api, "--oxibooru-api", stand_ins.oxibooru_api, *extra],
+    )
+    return migrate.main()
+
+
+def test_rerun_skips_completed_posts_and_retries_failures(stand_ins, monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    monkeypatch.chdir(tmp_path)
+    servers = stand_ins(posts=40, video_every=0)
+    path = str(tmp_path / "journal.db")
+
+    assert run_main(monkeypatch, servers, "--journal", path, "--max-posts", "25") == 0
+    assert searches(servers) == 25
+    assert run_main(monkeypatch, servers, "--journal", path) == 0
+    assert searches(servers) == 40
+
+    journal = MigrationJournal(path)
+    content_hash = journal.completed[7]
+    journal.record(7, content_hash, "failed", error="HTTP 503")
+    journal.close()
+    assert run_main(monkeypatch, servers, "--journal", path) == 0
+    assert searches(servers) == 41
+    journal = MigrationJournal(path)
+    assert journal.is_completed(7, content_hash)
+    journal.close()
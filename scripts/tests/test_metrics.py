@@ -0,0 +1,115 @@
+import json
+import sys
+
+import pytest
+
+import migrate_oxibooru_tags as migrate
+from migrate_oxibooru_tags import Histogram, Metrics
+
+
+def histogram_of(*values: float) -> Histogram:
+    histogram = Histogram()
+    for value in values:
+        histogram.observe(value)
+    return histogram
+
+
+def test_histogram_quantile_empty() -> None:
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_histogram_quantile_single_value_is_exact() -> None:
+    histogram = histogram_of(0.25)
+    assert histogram.quantile(0.0) == pytest.approx(0.25)
+    assert histogram.quantile(0.5) == pytest.approx(0.25)
+    assert histogram.quantile(1.0) == pytest.approx(0.25)
+
+
+def test_histogram_quantile_is_monotonic_and_within_observed_range() -> None:
+    values = [0.002 * 1.3**step for step in range(40)]
+    histogram = histogram_of(*values)
+    quantiles = [histogram.quantile(q / 20) for q in range(21)]
+    assert quantiles == sorted(quantiles)
+    assert min(values) <= quantiles[0] and quantiles[-1] <= max(values)
+    assert histogram.quantile(1.0) == pytest.approx(max(values))
+
+
+def test_histogram_quantile_stays_in_the_right_bucket() -> None:
+    histogram = histogram_of(*([0.001] * 90 + [10.0] * 10))
+    assert histogram.quantile(0.5) <= 0.001
+    assert 1.0 < histogram.quantile(0.95) <= 10.0
+
+
+def test_histogram_overflow_bucket() -> None:
+    histogram = histogram_of(1000.0)
+    assert histogram.counts[-1] == 1
+    assert histogram.quantile(0.99) == pytest.approx(1000.0)
+
+
+def test_histogram_merge_matches_observing_everything() -> None:
+    first = histogram_of(0.003, 0.04, 0.5)
+    second = histogram_of(0.0005, 2.0)
+    first.merge(second)
+    combined = histogram_of(0.003, 0.04, 0.5, 0.0005, 2.0)
+    assert first.counts == combined.counts
+    assert first.count == combined.count == 5
+    assert first.total == pytest.approx(combined.total)
+    assert (first.min, first.max) == (combined.min, combined.max)
+    assert first.quantile(0.5) == pytest.approx(combined.quantile(0.5))
+
+
+def test_histogram_merge_with_empty_keeps_bounds() -> None:
+    histogram = histogram_of(0.1, 0.2)
+    histogram.merge(Histogram())
+    assert (histogram.count, histogram.min, histogram.max) == (2, 0.1, 0.2)
+
+
+def test_report_round_trip_and_merge() -> None:
+    first = Metrics()
+    first.inc("scanned", 3)
+    first.observe("download", 0.02)
+    first.record_request("bakabooru", 100, 2000)
+    second = Metrics.from_report(json.loads(json.dumps(first.report())))
+    assert second.counters == {"scanned": 3}
+    assert second.stages["download"].count == 1
+    assert second.transfer == {("bakabooru", "out"): 100, ("bakabooru", "in"): 2000}
+
+    second.merge(first)
+    assert second.get("scanned") == 6
+    assert second.requests == {"bakabooru": 2}
+    assert second.stages["download"].count == 2
+
+
+def test_run_writes_json_report_and_prometheus_textfile(stand_ins, monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    monkeypatch.chdir(tmp_path)
+    servers = stand_ins(posts=30, video_every=0)
+    report_path = tmp_path / "metrics.json"
+    textfile = tmp_path / "migration.prom"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "migrate",
+            "--bakabooru-api",
+            servers.bakabooru_api,
+            "--oxibooru-api",
+            servers.oxibooru_api,
+            "--metrics-json",
+            str(report_path),
+            "--prometheus-textfile",
+            str(textfile),
+        ],
+    )
+    assert migrate.main() == 0
+
+    report = json.loads(report_path.read_text(encoding="utf-8"))
+    assert report["counters"]["scanned"] == 30
+    assert {"download", "list", "reverse_search"} <= set(report["stages"])
+    served = servers.state.snapshot()["requests"]
+    for remote in ("bakabooru", "oxibooru"):
+        assert report["requests"][remote] == sum(n for name, n in served.items() if name.startswith(f"{remote} "))
+    assert report["bytes"]["oxibooru_out"] > 0
+
+    exposition = textfile.read_text(encoding="utf-8")
+    assert 'bakabooru_migration_count{name="scanned"} 30' in exposition
+    assert 'bakabooru_migration_stage_seconds_count{stage="reverse_search"}' in exposition
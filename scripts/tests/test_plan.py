@@ -0,0 +1,89 @@
+import sys
+
+import pytest
+
+import migrate_oxibooru_tags as migrate
+from migrate_oxibooru_tags import MigrationPlan, PlannedPost, PostMatch, parse_planned_post, read_plan, scan_plan
+
+
+def test_plan_round_trip(tmp_path) -> None:
+    path = str(tmp_path / "plan.jsonl")
+    categories = {"artist": {"name": "artist", "color": "#f00", "order": 1}}
+    oxi_post = {
+        "id": 900,
+        "tags": [{"names": ["Some_Artist", "alias"], "category": "artist"}, {"names": ["solo"], "category": None}],
+        "source": "https://a.example/1\nhttps://b.example/2",
+    }
+    plan = MigrationPlan(path)
+    plan.write_categories(categories)
+    plan.record(
+        PostMatch(post_id=7, content_hash="abc", post_tags=[], match_kind="similar", matched_post=oxi_post, distance=0.05),
+        (["some_artist"], ["https://b.example/2"]),
+    )
+    plan.record(PostMatch(post_id=8, content_hash="def", post_tags=[], match_kind="none"), ([], []))
+    plan.close()
+
+    assert scan_plan(path) == (categories, {"some_artist": "artist", "solo": None}, 2)
+    planned = [parse_planned_post(item) for item in read_plan(path) if item["type"] == "post"]
+    assert planned == [
+        PlannedPost(
+            post_id=7,
+            content_hash="abc",
+            match_kind="similar",
+            distance=0.05,
+            oxibooru_post_id=900,
+            tags=[("some_artist", "artist"), ("solo", None)],
+            sources=["https://a.example/1", "https://b.example/2"],
+            add_tags=["some_artist"],
+            add_sources=["https://b.example/2"],
+        ),
+        PlannedPost(
+            post_id=8,
+            content_hash="def",
+            match_kind="none",
+            distance=None,
+            oxibooru_post_id=None,
+            tags=[],
+            sources=[],
+            add_tags=[],
+            add_sources=[],
+        ),
+    ]
+
+
+def test_read_plan_rejects_other_versions(tmp_path) -> None:
+    path = tmp_path / "plan.jsonl"
+    path.write_text('{"type":"categories","version":999,"categories":{}}\n', encoding="utf-8")
+    with pytest.raises(RuntimeError, match="unsupported plan version"):
+        list(read_plan(str(path)))
+
+
+def run_main(monkeypatch: pytest.MonkeyPatch, stand_ins, *extra: str) -> int:
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["migrate", "--bakabooru-api", stand_ins.bakabooru_api, "--oxibooru-api", stand_ins.oxibooru_api, *extra],
+    )
+    return migrate.main()
+
+
+def written(stand_ins) -> tuple[dict, dict]:
+    """Tag names and sources per updated post; tag ids depend on creation order."""
+    state = stand_ins.state
+    tags = {post_id: sorted(tag["name"] for tag in post_tags) for post_id, post_tags in state.post_tags.items()}
+    return tags, {post_id: sorted(sources) for post_id, sources in state.post_sources.items()}
+
+
+def test_applied_plan_writes_what_a_direct_run_does(stand_ins, monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    monkeypatch.chdir(tmp_path)
+    planned = stand_ins(posts=60, seed=3)
+    direct = stand_ins(posts=60, seed=3)
+    plan = str(tmp_path / "plan.jsonl")
+
+    assert run_main(monkeypatch, planned, "--plan", plan, "--workers", "4") == 0
+    assert written(planned) == ({}, {})
+    assert run_main(monkeypatch, planned, "--apply", plan, "--workers", "4") == 0
+    assert run_main(monkeypatch, direct, "--workers", "4") == 0
+
+    assert written(planned)[0]
+    assert written(planned) == written(direct)
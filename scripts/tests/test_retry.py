@@ -0,0 +1,113 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+import migrate_oxibooru_tags as migrate
+from migrate_oxibooru_tags import (
+    MAX_RETRY_AFTER,
+    AsyncBakabooruClient,
+    BakabooruClient,
+    HttpError,
+    RetryPolicy,
+    parse_retry_after,
+)
+
+
+def quick_retries(max_attempts: int = 5, breaker_threshold: int = 0, breaker_cooldown: float = 0.0) -> RetryPolicy:
+    return RetryPolicy(
+        max_attempts=max_attempts,
+        base_delay=0.001,
+        max_delay=0.002,
+        breaker_threshold=breaker_threshold,
+        breaker_cooldown=breaker_cooldown,
+    )
+
+
+def listing_requests(stand_ins) -> int:
+    return stand_ins.state.snapshot()["requests"].get("bakabooru GET /api/posts", 0)
+
+
+@pytest.mark.parametrize("value", [None, "", "soon", "Mon, 99 Foo 2026"])
+def test_parse_retry_after_rejects_missing_and_malformed(value: str | None) -> None:
+    assert parse_retry_after(value) is None
+
+
+def test_parse_retry_after_seconds() -> None:
+    assert parse_retry_after("5") == 5.0
+    assert parse_retry_after("1.5") == 1.5
+
+
+def test_parse_retry_after_is_clamped() -> None:
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after("86400") == MAX_RETRY_AFTER
+
+
+def test_parse_retry_after_http_date(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = 1_800_000_000.0
+    monkeypatch.setattr(migrate.time, "time", lambda: now)
+    assert parse_retry_after(formatdate(now + 30, usegmt=True)) == pytest.approx(30.0)
+    assert parse_retry_after(formatdate(now - 30, usegmt=True)) == 0.0
+
+
+def test_transient_failures_are_retried(stand_ins) -> None:
+    servers = stand_ins(posts=20, error_rate=0.3)
+    baka = BakabooruClient(servers.bakabooru_api, retry=quick_retries(max_attempts=10))
+    for page in range(1, 21):
+        assert baka.get_posts_page(page=page, page_size=1)["items"]
+
+    injected = servers.state.snapshot()["injected_errors"]
+    assert injected > 0
+    assert listing_requests(servers) == 20 + injected
+
+
+def test_gives_up_after_max_attempts(stand_ins) -> None:
+    servers = stand_ins(posts=5, error_rate=1.0)
+    baka = BakabooruClient(servers.bakabooru_api, retry=quick_retries(max_attempts=3))
+    with pytest.raises(HttpError) as raised:
+        baka.get_posts_page(page=1, page_size=1)
+    assert raised.value.status == 503
+    assert listing_requests(servers) == 3
+
+
+def test_breaker_opens_and_pauses_the_next_request(stand_ins) -> None:
+    servers = stand_ins(posts=5, error_rate=1.0)
+    baka = BakabooruClient(
+        servers.bakabooru_api, retry=quick_retries(max_attempts=3, breaker_threshold=3, breaker_cooldown=0.3)
+    )
+    with pytest.raises(HttpError):
+        baka.get_posts_page(page=1, page_size=1)
+    assert baka.breaker.pause() > 0.2
+
+    # Another client of the same host shares the breaker.
+    single = BakabooruClient(servers.bakabooru_api, retry=quick_retries(max_attempts=1))
+    started = time.monotonic()
+    with pytest.raises(HttpError):
+        single.get_posts_page(page=1, page_size=1)
+    assert time.monotonic() - started >= 0.2
+    # Failing again after the cooldown reopens it for twice as long.
+    assert baka.breaker.pause() > 0.5
+
+
+def test_success_closes_the_breaker(stand_ins) -> None:
+    servers = stand_ins(posts=5)
+    baka = BakabooruClient(servers.bakabooru_api, retry=quick_retries(breaker_threshold=3, breaker_cooldown=0.3))
+    baka.breaker.record(True)
+    baka.breaker.record(True)
+    baka.get_posts_page(page=1, page_size=1)
+    assert baka.breaker.failures == 0
+
+
+def test_async_client_retries_like_the_blocking_one(stand_ins) -> None:
+    pytest.importorskip("aiohttp")
+    servers = stand_ins(posts=5, error_rate=1.0)
+
+    async def fetch() -> None:
+        async with AsyncBakabooruClient(servers.bakabooru_api, retry=quick_retries(max_attempts=3)) as baka:
+            await baka.get_posts_page(page=1, page_size=1)
+
+    with pytest.raises(HttpError) as raised:
+        asyncio.run(fetch())
+    assert raised.value.status == 503
+    assert listing_requests(servers) == 3
@@ -0,0 +1,104 @@
+import sys
+
+import pytest
+
+import migrate_oxibooru_tags as migrate
+from migrate_oxibooru_tags import ReverseSearchCache
+
+MATCHED = {"id": 5, "checksum": "ab", "tags": [], "source": None}
+
+
+def open_cache(
+    tmp_path, max_similar_distance: float = 0.1, ttl: float = 3600.0, entries: int = 100
+) -> ReverseSearchCache:
+    return ReverseSearchCache(str(tmp_path / "cache.db"), max_similar_distance, ttl, entries)
+
+
+def test_results_survive_a_reopen(tmp_path) -> None:
+    cache = open_cache(tmp_path)
+    cache.put("aa", MATCHED, "exact", 0.0)
+    cache.put("bb", None, "none", None)
+    cache.close()
+
+    cache = open_cache(tmp_path)
+    assert cache.get("aa") == (MATCHED, "exact", 0.0)
+    assert cache.get("bb") == (None, "none", None)
+    assert cache.get("cc") is None
+    cache.close()
+
+
+def test_negative_results_expire(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    now = 1_800_000_000.0
+    monkeypatch.setattr(migrate.time, "time", lambda: now)
+    cache = open_cache(tmp_path, ttl=60.0)
+    cache.put("aa", MATCHED, "exact", 0.0)
+    cache.put("bb", None, "none", None)
+
+    now += 61
+    assert cache.get("bb") is None
+    assert cache.get("aa") is not None
+    assert cache.entry_count == 1
+    cache.close()
+
+
+def test_negative_results_are_not_cached_without_a_ttl(tmp_path) -> None:
+    cache = open_cache(tmp_path, ttl=0.0)
+    cache.put("bb", None, "too_far", 0.4)
+    assert cache.get("bb") is None
+    cache.close()
+
+
+def test_threshold_change_drops_dependent_entries(tmp_path) -> None:
+    cache = open_cache(tmp_path, max_similar_distance=0.1)
+    cache.put("exact", MATCHED, "exact", 0.0)
+    cache.put("similar", MATCHED, "similar", 0.05)
+    cache.put("too_far", None, "too_far", 0.3)
+    cache.put("none", None, "none", None)
+    cache.close()
+
+    cache = open_cache(tmp_path, max_similar_distance=0.2)
+    assert cache.get("exact") is not None and cache.get("none") is not None
+    assert cache.get("similar") is None and cache.get("too_far") is None
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    clock = iter(range(1_800_000_000, 1_800_001_000))
+    monkeypatch.setattr(migrate.time, "time", lambda: float(next(clock)))
+    cache = open_cache(tmp_path, entries=10)
+    for n in range(10):
+        cache.put(f"h{n}", MATCHED, "exact", 0.0)
+    assert cache.get("h0") is not None
+
+    cache.put("h10", MATCHED, "exact", 0.0)
+    assert cache.entry_count == 9
+    assert cache.get("h0") is not None and cache.get("h10") is not None
+    assert cache.get("h1") is None and cache.get("h2") is None
+    cache.close()
+
+
+def searches(stand_ins) -> int:
+    return stand_ins.state.snapshot()["requests"].get("oxibooru POST /api/posts/reverse-search", 0)
+
+
+def test_duplicates_and_reruns_skip_the_search(stand_ins, monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    monkeypatch.chdir(tmp_path)
+    servers = stand_ins(posts=40, video_every=0, duplicate_ratio=0.5)
+    argv = [
+        "migrate",
+        "--bakabooru-api",
+        servers.bakabooru_api,
+        "--oxibooru-api",
+        servers.oxibooru_api,
+        "--search-cache",
+        str(tmp_path / "cache.db"),
+        "--workers",
+        "1",
+    ]
+    monkeypatch.setattr(sys, "argv", argv)
+
+    assert migrate.main() == 0
+    # 40 posts over 20 distinct files.
+    assert searches(servers) == 20
+    assert migrate.main() == 0
+    assert searches(servers) == 20
@@ -0,0 +1,28 @@
+import pytest
+
+from migrate_oxibooru_tags import BakabooruClient, Metrics, in_shard, iter_post_pages, parse_shard
+
+
+@pytest.mark.parametrize(("value", "expected"), [("0/1", (0, 1)), ("0/4", (0, 4)), ("3/4", (3, 4))])
+def test_parse_shard_valid(value: str, expected: tuple[int, int]) -> None:
+    assert parse_shard(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "1", "4/4", "-1/4", "1/0", "a/b", "1/2/3", "1/"])
+def test_parse_shard_invalid(value: str) -> None:
+    assert parse_shard(value) is None
+
+
+def test_shards_partition_the_listing(stand_ins) -> None:
+    servers = stand_ins(posts=57, video_every=0)
+    baka = BakabooruClient(servers.bakabooru_api)
+    seen: list[int] = []
+    for index in range(3):
+        metrics = Metrics()
+        pages = iter_post_pages(baka, after_id=0, page_size=10, metrics=metrics, shard=(index, 3))
+        ids = [int(post["id"]) for page in pages for post in page]
+        assert all(in_shard({"id": post_id}, (index, 3)) for post_id in ids)
+        # Each shard's progress total is its share of the library.
+        assert metrics.total_posts == 19
+        seen.extend(ids)
+    assert sorted(seen) == list(range(1, 58))
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+
+from benchmark_oxibooru_migration import CorpusConfig, SyntheticCorpus
+from migrate_oxibooru_tags import (
+    AsyncByteBudget,
+    BakabooruClient,
+    ByteBudget,
+    MultipartStream,
+    OxibooruClient,
+    Upload,
+)
+
+
+def test_content_spills_to_disk_past_the_memory_cap(stand_ins) -> None:
+    servers = stand_ins(posts=4, video_every=0, content_bytes=256 * 1024)
+    expected = SyntheticCorpus(CorpusConfig(posts=4, video_every=0, content_bytes=256 * 1024)).content(1)
+    baka = BakabooruClient(servers.bakabooru_api)
+
+    with baka.get_post_content(1, max_memory=64 * 1024) as spilled:
+        assert spilled._rolled
+        assert spilled.read() == expected
+    with baka.get_post_content(1, max_memory=1024 * 1024) as held:
+        assert not held._rolled
+        assert held.read() == expected
+
+
+def test_spooled_content_streams_into_a_reverse_search(stand_ins) -> None:
+    config = CorpusConfig(posts=40, video_every=0, duplicate_ratio=0.0, exact_ratio=1.0, similar_ratio=0.0)
+    servers = stand_ins(**vars(config))
+    baka = BakabooruClient(servers.bakabooru_api)
+    oxi = OxibooruClient(servers.oxibooru_api)
+
+    with baka.get_post_content(7, max_memory=1024) as content:
+        size = content.seek(0, 2)
+        content.seek(0)
+        result = oxi.reverse_search(Upload(content, size, "7.png", "image/png"))
+    assert result["exactPost"]["id"] == 7
+
+
+def test_multipart_stream_encodes_one_file_part() -> None:
+    data = bytes(range(256)) * 40
+    stream = MultipartStream("content", Upload.from_bytes(data, 'a "quoted".png', "image/png"))
+    chunks = []
+    while chunk := stream.read(1000):
+        chunks.append(chunk)
+    body = b"".join(chunks)
+    assert len(body) == len(stream)
+
+    message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {stream.content_type}\r\n\r\n".encode() + body)
+    (part,) = message.iter_parts()
+    assert part.get_param("name", header="content-disposition") == "content"
+    assert part.get_filename() == "a %22quoted%22.png"
+    assert part.get_content_type() == "image/png"
+    assert part.get_payload(decode=True) == data
+
+    # A retry re-reads the same bytes.
+    stream.seek(0)
+    assert stream.read() == body
+
+
+def test_byte_budget_holds_callers_past_the_limit() -> None:
+    budget = ByteBudget(100)
+    admitted = threading.Event()
+
+    def reserve_more() -> None:
+        with budget.reserve(60):
+            admitted.set()
+
+    with budget.reserve(60):
+        waiter = threading.Thread(target=reserve_more)
+        waiter.start()
+        assert not admitted.wait(0.1)
+    assert admitted.wait(1.0)
+    waiter.join()
+    assert budget.held == 0
+
+
+def test_byte_budget_admits_an_oversized_reservation_alone() -> None:
+    budget = ByteBudget(100)
+    with budget.reserve(500):
+        assert budget.held == 500
+
+
+def test_async_byte_budget_holds_callers_past_the_limit() -> None:
+    async def run() -> list[str]:
+        budget = AsyncByteBudget(100)
+        order: list[str] = []
+
+        async def hold(name: str, amount: int, seconds: float) -> None:
+            async with budget.reserve(amount):
+                order.append(f"{name} in")
+                await asyncio.sleep(seconds)
+                order.append(f"{name} out")
+
+        first = asyncio.ensure_future(hold("first", 60, 0.05))
+        await asyncio.sleep(0)
+        await asyncio.gather(first, hold("second", 60, 0), hold("huge", 500, 0))
+        assert budget.held == 0
+        return order
+
+    started = time.monotonic()
+    order = asyncio.run(run())
+    assert order[:2] == ["first in", "first out"]
+    assert sorted(order[2:]) == ["huge in", "huge out", "second in", "second out"]
+    assert time.monotonic() - started >= 0.05
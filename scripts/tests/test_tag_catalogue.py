@@ -0,0 +1,81 @@
+from typing import Any
+
+import pytest
+
+import migrate_oxibooru_tags as migrate
+from migrate_oxibooru_tags import TagSnapshot, load_tag_catalogue
+
+
+class UsageOrderedTags:
+    """`GET /tags` paged by offset over a usage order, which `reorder` may shuffle between requests."""
+
+    def __init__(self, count: int) -> None:
+        self.tags = [{"id": n, "name": f"tag_{n}", "categoryId": None} for n in range(1, count + 1)]
+        self.requests = 0
+        self.reorders = 0
+
+    def reorder(self) -> bool:
+        return False
+
+    def get_tags_page(self, page: int, page_size: int, query: str | None = None) -> dict[str, Any]:
+        self.requests += 1
+        if self.requests > 1 and self.reorder():
+            # The least used tag gains usage and jumps to the front, shifting every page.
+            self.tags.insert(0, self.tags.pop())
+            self.reorders += 1
+        items = self.tags[(page - 1) * page_size : page * page_size]
+        return {"items": [dict(tag) for tag in items], "totalCount": len(self.tags)}
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(migrate, "TAG_PAGE_SIZE", 2)
+
+
+def names(catalogue: migrate.TagCatalogue) -> set[str]:
+    return {name for name, _, _ in catalogue.rows()}
+
+
+def test_fetches_every_tag_and_reuses_the_snapshot(tmp_path) -> None:
+    server = UsageOrderedTags(7)
+    snapshot = TagSnapshot(str(tmp_path / "tags.db"))
+    assert names(load_tag_catalogue(server, [], snapshot, workers=4)) == {f"tag_{n}" for n in range(1, 8)}
+
+    server.requests = 0
+    cached = load_tag_catalogue(server, [], snapshot, workers=4)
+    assert len(cached) == 7 and cached.from_snapshot
+    assert server.requests == 1
+    snapshot.close()
+
+
+def test_refetches_when_the_order_shifts_mid_fetch(tmp_path) -> None:
+    server = UsageOrderedTags(7)
+    server.reorder = lambda: server.reorders == 0
+    snapshot = TagSnapshot(str(tmp_path / "tags.db"))
+    catalogue = load_tag_catalogue(server, [], snapshot, workers=1)
+    assert server.reorders == 1
+    assert names(catalogue) == {f"tag_{n}" for n in range(1, 8)}
+    assert len(snapshot.load()) == 7
+    snapshot.close()
+
+
+def test_does_not_save_a_catalogue_that_never_settles(tmp_path) -> None:
+    server = UsageOrderedTags(7)
+    server.reorder = lambda: True
+    snapshot = TagSnapshot(str(tmp_path / "tags.db"))
+    catalogue = load_tag_catalogue(server, [], snapshot, workers=1)
+    assert len(catalogue) < 7
+    assert len(snapshot.load()) == 0
+    snapshot.close()
+
+
+def test_snapshot_with_a_renamed_busy_tag_is_reloaded(tmp_path) -> None:
+    server = UsageOrderedTags(5)
+    snapshot = TagSnapshot(str(tmp_path / "tags.db"))
+    load_tag_catalogue(server, [], snapshot)
+    server.tags[0]["name"] = "renamed"
+
+    catalogue = load_tag_catalogue(server, [], snapshot)
+    assert not catalogue.from_snapshot
+    assert catalogue.get("renamed") is not None and catalogue.get("tag_1") is None
+    snapshot.close()
@@ -264,6 +264,20 @@ public class PostReadService
             };
         }
 
+        if (parsedQuery.IdFilter != null)
+        {
+            var id = parsedQuery.IdFilter.Value;
+            query = parsedQuery.IdFilter.Operator switch
+            {
+                NumericComparisonOperator.Equal => query.Where(p => p.Id == id),
+                NumericComparisonOperator.GreaterThan => query.Where(p => p.Id > id),
+                NumericComparisonOperator.GreaterThanOrEqual => query.Where(p => p.Id >= id),
+                NumericComparisonOperator.LessThan => query.Where(p => p.Id < id),
+                NumericComparisonOperator.LessThanOrEqual => query.Where(p => p.Id <= id),
+                _ => query
+            };
+        }
+
         if (parsedQuery.FavoriteFilter.HasValue)
         {
             var isFavorite = parsedQuery.FavoriteFilter.Value;
@@ -44,6 +44,7 @@ public class SearchQuery
     public HashSet<PostMediaType> IncludedMediaTypes { get; set; } = [];
     public HashSet<PostMediaType> ExcludedMediaTypes { get; set; } = [];
     public NumericFilter? TagCountFilter { get; set; }
+    public NumericFilter? IdFilter { get; set; }
     public bool? FavoriteFilter { get; set; }
     public SearchSortField SortField { get; set; } = SearchSortField.FileModifiedDate;
     public SearchSortDirection SortDirection { get; set; } = SearchSortDirection.Desc;
@@ -140,6 +141,21 @@ public static class QueryParser
             return true;
         }
 
+        if (key is "id")
+        {
+            if (!TryParseNumericFilter(value, out var numericFilter))
+            {
+                return true;
+            }
+
+            if (!isNegated)
+            {
+                result.IdFilter = numericFilter;
+            }
+
+            return true;
+        }
+
         if (key is "favorite" or "fav")
         {
             if (!TryParseBoolean(value, out var favoriteValue))